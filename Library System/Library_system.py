@@ -1,23 +1,217 @@
+import gc
 import os
-from tabulate import tabulate
-from datetime import datetime, timedelta
-
-# Base folder for data files (same folder as script)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
+import re
+import sys
+import json
+import time
+import atexit
+import bisect
+import builtins
+import heapq
+import marshal
+import functools
+import threading
+import contextlib
+from collections import namedtuple
+from datetime import datetime, date
+
+try:
+    import fcntl
+except ImportError:  # Windows: ไม่มี fcntl ทำงานแบบโปรเซสเดียวเหมือนเดิม
+    fcntl = None
+
+# Base folder for data files (same folder as script, or LIBRARY_DATA_DIR if set)
+BASE_DIR = os.environ.get("LIBRARY_DATA_DIR") or (os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd())
+
+# จำนวน operation ใน log ที่จะสั่งรวม (compact) กลับเข้าไฟล์ .txt หลัก
+LOG_COMPACT_OPS = int(os.environ.get("LIBRARY_LOG_COMPACT_OPS", "1000"))
+# ตอน compact ถ้าแถวที่ถูกลบ (D) เกินสัดส่วนนี้ของตารางและมีอย่างน้อย VACUUM_MIN_ROWS แถว
+# จะเขียนตารางใหม่โดยตัดแถว D ทิ้ง (vacuum) ด้วย 0 = ปิด (ดู vacuum.py)
+VACUUM_RATIO = float(os.environ.get("LIBRARY_VACUUM_RATIO", "0.3"))
+VACUUM_MIN_ROWS = int(os.environ.get("LIBRARY_VACUUM_MIN_ROWS", "1000"))
+# เก็บสำเนาตารางที่โหลดแล้ว (แถว + index) เป็น <ไฟล์>.cache ให้การเปิดโปรแกรมครั้งถัดไปไม่ต้อง parse ใหม่
+# 0 = ปิด (ดู Table.load_snapshot)
+SNAPSHOT_CACHE = os.environ.get("LIBRARY_SNAPSHOT_CACHE", "1") not in ("0", "", "no", "false")
+# เปลี่ยนเมื่อรูปแบบข้อมูลใน snapshot เปลี่ยน snapshot เก่าจะถูกข้ามไปเอง
+SNAPSHOT_VERSION = 1
+# รูปแบบการเก็บข้อมูล: "text" (.txt คั่นด้วย |), "binary" (.bin columnar ดู binary_storage.py)
+# หรือ "sqlite" (library.db ดู sqlite_storage.py)
+STORAGE = os.environ.get("LIBRARY_STORAGE", "text")
+
+
+def env_number(name, default):
+    """ค่าตัวเลขจาก environment variable (จำนวนเต็มถ้าไม่มีทศนิยม)"""
+    value = os.environ.get(name, default)
+    return float(value) if "." in value else int(value)
+
+
+# ค่าปรับต่อวันที่คืนช้า (บาท) และจำนวนวันที่ให้ยืม
+FINE_PER_DAY = env_number("LIBRARY_FINE_PER_DAY", "5")
+LOAN_DAYS = int(os.environ.get("LIBRARY_LOAN_DAYS", "7"))
+DATE_FORMAT = "%d/%m/%Y"
 
 def get_path(filename):
     return os.path.join(BASE_DIR, filename)
 
+
+# ไฟล์บันทึกรหัส transaction ที่ commit แล้ว (ใช้ตอน transaction แก้หลายตาราง)
+JOURNAL_FILE = "transactions.log"
+# ไฟล์ล็อกสำหรับหลายโปรเซสที่ใช้โฟลเดอร์ข้อมูลเดียวกัน (ดู FileLock)
+DATA_LOCK_FILE = "library.lock"
+WRITE_LOCK_FILE = "library.write.lock"
+
+def log_name(filename):
+    """ชื่อไฟล์ log ของตาราง เช่น books.txt -> books.txt.log"""
+    return filename + ".log"
+
+
+def snapshot_name(filename):
+    """ชื่อไฟล์ snapshot ของตาราง เช่น books.txt -> books.txt.cache"""
+    return filename + ".cache"
+
+
+def file_stamp(filename):
+    """(mtime_ns, size) ของไฟล์ หรือ None ถ้าไม่มีไฟล์"""
+    try:
+        st = os.stat(get_path(filename))
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+# ------------ Instrumentation ------------
+# LIBRARY_PROFILE=1 (หรือชื่อไฟล์) เปิดตัวนับ/ตัวจับเวลาของ I/O, การวาดตาราง, operation และเมนู
+# ตอนจบโปรเซสจะต่อท้ายสรุปของ session เป็น JSON หนึ่งบรรทัดลงไฟล์นั้น (1 = PROFILE_FILE ใน BASE_DIR)
+# LIBRARY_CPROFILE=<ไฟล์> เก็บผล cProfile ของทั้ง session ด้วย (ดูด้วย python -m pstats <ไฟล์>)
+# ถ้าไม่ได้เปิด timed() คืนฟังก์ชันเดิม จึงไม่มี overhead
+PROFILE_FILE = "profile.jsonl"
+PROFILE = os.environ.get("LIBRARY_PROFILE", "")
+CPROFILE = os.environ.get("LIBRARY_CPROFILE", "")
+
+
+class Stats:
+    """ตัวนับ (ชื่อ -> จำนวน) และตัวจับเวลา (ชื่อ -> [ครั้ง, เวลารวม, เวลานานสุด]) ของทั้ง session"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        """สรุปของ session เรียงตัวจับเวลาตามเวลารวมมากไปน้อย"""
+        with self.lock:
+            timers = sorted(self.timers.items(), key=lambda kv: -kv[1][1])
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "pid": os.getpid(),
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "seconds": round(time.time() - self.started, 3),
+            "counters": counters,
+            "timers": {name: {"calls": n, "total_ms": round(total * 1000, 3), "avg_ms": round(total * 1000 / n, 3),
+                              "max_ms": round(longest * 1000, 3)} for name, (n, total, longest) in timers},
+        }
+
+    def write(self, path):
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.summary(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"✘ ข้อผิดพลาดในการเขียนไฟล์ {path}: {e}")
+
+
+STATS = Stats() if PROFILE else None
+
+
+def timed(name):
+    """decorator จับเวลาทุกครั้งที่เรียกฟังก์ชัน (ไม่ได้เปิด LIBRARY_PROFILE = คืนฟังก์ชันเดิม)"""
+    def wrap(func):
+        if STATS is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STATS.record(name, time.perf_counter() - start)
+        return wrapper
+    return wrap
+
+
+def operation(name):
+    """จับเวลาหนึ่ง operation ระดับบนสุด (หนึ่งเมนู หนึ่ง request) ใช้กับ with"""
+    return STATS.timer(name) if STATS is not None else contextlib.nullcontext()
+
+
+def start_profile():
+    """เริ่ม cProfile (ถ้าตั้ง LIBRARY_CPROFILE) และเขียนผลของ session ตอนจบโปรเซส"""
+    profiler = None
+    if CPROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(CPROFILE)
+        if STATS is not None:
+            STATS.write(get_path(PROFILE_FILE) if PROFILE.lower() in ("1", "true", "yes") else PROFILE)
+
+    if profiler is not None or STATS is not None:
+        atexit.register(finish)
+
+
+start_profile()
+
+
+def tabulate(*args, **kwargs):
+    # import tabulate ตอนวาดตารางครั้งแรก การ import Library_system (batch.py, server.py) จึงไม่ต้องรอ
+    from tabulate import tabulate as render
+    return render(*args, **kwargs)
+
+
+# เวลาวาดตารางด้วย tabulate ของทุกหน้าจอ
+tabulate = timed("render.tabulate")(tabulate)
+# เวลารอผู้ใช้พิมพ์ (รวมอยู่ในเวลาของเมนู ลบออกเพื่อดูเวลาที่โปรแกรมใช้จริง)
+# เรียก builtins.input ทุกครั้ง การแทน input ตอนป้อนคำตอบอัตโนมัติ (benchmark) จึงยังใช้ได้
+if STATS is not None:
+    input = timed("ui.input")(lambda prompt="": builtins.input(prompt))
+
 # ------------ Utility ------------
-def read_file(filename, min_fields=None):
+@timed("io.read_file")
+def read_file(filename, min_fields=None, record_type=None):
     """อ่านไฟล์แล้วคืนรายการเป็น list of list
     ถ้ามี min_fields จะเติมช่องว่างให้ครบความยาวนั้นเพื่อหลีกเลี่ยง IndexError
+    ถ้ามี record_type จะแปลงแต่ละแถวเป็น record ตอนอ่าน (ดู make_record)
     """
     filepath = get_path(filename)
     if not os.path.exists(filepath):
         return []
     records = []
     with open(filepath, "r", encoding="utf-8") as f:
+        if STATS is not None:
+            STATS.count("io.read_file.bytes", os.fstat(f.fileno()).st_size)
         for line in f:
             line = line.strip()
             if not line:
@@ -25,62 +219,1229 @@ def read_file(filename, min_fields=None):
             parts = line.split("|")
             if min_fields and len(parts) < min_fields:
                 parts += [""] * (min_fields - len(parts))
-            records.append(parts)
+            records.append(make_record(record_type, parts) if record_type else parts)
     return records
 
 
+@timed("io.write_file")
 def write_file(filename, records):
+    """เขียนทั้งตารางลงไฟล์ชั่วคราวแล้ว rename ทับ ไฟล์เดิมจึงไม่ถูกตัดครึ่งถ้าโปรแกรมล่มกลางทาง"""
     filepath = get_path(filename)
+    tmp_path = filepath + ".tmp"
     try:
-        with open(filepath, "w", encoding="utf-8") as f:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             for rec in records:
                 rec = [str(x) for x in rec]
                 f.write("|".join(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            if STATS is not None:
+                STATS.count("io.write_file.bytes", os.fstat(f.fileno()).st_size)
+        os.replace(tmp_path, filepath)
         return True
     except OSError as e:
         print(f"✘ ข้อผิดพลาดในการเขียนไฟล์ {filename}: {e}")
         return False
 
 
-def get_next_id(records):
-    if not records:
-        return 1
-    ids = []
-    for r in records:
+@timed("io.append_lines")
+def append_lines(filename, lines):
+    """ต่อท้ายหลายบรรทัดลงไฟล์ในการเขียนครั้งเดียว แล้ว fsync"""
+    filepath = get_path(filename)
+    data = "".join(line + "\n" for line in lines)
+    try:
+        with open(filepath, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if STATS is not None:
+            STATS.count("io.append_lines.bytes", len(data.encode("utf-8")))
+        return True
+    except OSError as e:
+        print(f"✘ ข้อผิดพลาดในการเขียนไฟล์ {filename}: {e}")
+        return False
+
+
+def new_txid():
+    return f"{os.getpid()}-{time.time_ns()}"
+
+
+def append_log(filename, ops, txid=None, files=1):
+    """ต่อท้าย operation ลง log ของตาราง ครอบด้วย B|txid|files ... E|txid
+    files = จำนวนตารางที่ transaction นี้แก้ ถ้ามากกว่า 1 บล็อกจะมีผลเมื่อ txid อยู่ใน JOURNAL_FILE แล้วเท่านั้น
+    """
+    txid = txid or new_txid()
+    return append_lines(log_name(filename), [f"B|{txid}|{files}"] + ops + [f"E|{txid}"])
+
+
+def read_journal():
+    """รหัส transaction ที่ commit แล้วทั้งหมด"""
+    filepath = get_path(JOURNAL_FILE)
+    if not os.path.exists(filepath):
+        return set()
+    with open(filepath, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.endswith("\n") and line.strip()}
+
+
+@timed("io.read_log")
+def read_log(filename, committed=None, offset=0):
+    """อ่าน operation ใน log ของตาราง คืน list ของ (op, slot, fields)
+    op: I = เพิ่มแถว, U = แก้ไขแถว, T = ทำเครื่องหมายลบ (tombstone)
+    offset = เริ่มอ่านที่ไบต์นี้ (ต้องเป็นขอบบล็อก) ใช้อ่านเฉพาะส่วนที่โปรเซสอื่นต่อท้ายเพิ่มมา
+    บรรทัดสุดท้ายที่เขียนไม่ครบ (โปรแกรมล่มระหว่างเขียน) จะถูกตัดทิ้ง
+    op ในบล็อก B..E ที่ไม่มี E หรือยังไม่ได้ commit ใน journal จะไม่ถูกนำมาใช้
+    """
+    filepath = get_path(log_name(filename))
+    if not os.path.exists(filepath):
+        return []
+    with open(filepath, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    if STATS is not None:
+        STATS.count("io.read_log.bytes", len(data))
+    if data and not data.endswith(b"\n"):
+        data = data[:data.rfind(b"\n") + 1]
+        with open(filepath, "r+b") as f:
+            f.truncate(offset + len(data))
+    ops = []
+    block = None
+    for line in data.decode("utf-8").splitlines():
+        parts = line.split("|")
+        if parts[0] == "B" and len(parts) >= 3:
+            block, txid, files = [], parts[1], parts[2]
+            continue
+        if parts[0] == "E" and len(parts) >= 2:
+            if block is not None and parts[1] == txid:
+                if files == "1":
+                    ops.extend(block)
+                else:
+                    if committed is None:
+                        committed = read_journal()
+                    if txid in committed:
+                        ops.extend(block)
+            block = None
+            continue
+        if len(parts) < 2 or parts[0] not in ("I", "U", "T"):
+            continue
         try:
-            if r and r[-1] == "A":
-                ids.append(int(r[0]))
-        except Exception:
+            slot = int(parts[1])
+        except ValueError:
             continue
-    return max(ids) + 1 if ids else 1
+        (block if block is not None else ops).append((parts[0], slot, parts[2:]))
+    return ops
 
 
-def find_free_slot(records):
-    for i, r in enumerate(records):
-        if r and r[-1] == "D":
-            return i
-    return None
+def remove_log(filename):
+    remove_file(log_name(filename))
 
 
-def validate_date(date_str):
+def remove_file(filename):
+    filepath = get_path(filename)
     try:
-        datetime.strptime(date_str, "%d/%m/%Y")
-        return True
-    except ValueError:
-        return False
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+class FileLock:
+    """ล็อกไฟล์ใน BASE_DIR ด้วย fcntl.flock เพื่อประสานหลายโปรเซส (หลายเครื่องหน้าเคาน์เตอร์)
+    shared ถือพร้อมกันได้หลายโปรเซส, exclusive ถือได้โปรเซสเดียว
+    เรียกซ้อนกันในโปรเซสเดียวได้ (นับชั้น) ถ้าชั้นในขอ exclusive จะถือ exclusive ไปจนชั้นนอกสุดปล่อย
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = None
+        self.depth = 0
+        self.held_exclusive = False
+
+    def acquire(self, exclusive):
+        if fcntl is None:
+            return
+        if self.depth == 0:
+            self.fd = os.open(get_path(self.filename), os.O_RDWR | os.O_CREAT, 0o644)
+        if self.depth == 0 or (exclusive and not self.held_exclusive):
+            start = time.perf_counter()
+            try:
+                fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except BaseException:
+                if self.depth == 0:
+                    os.close(self.fd)
+                    self.fd = None
+                raise
+            if STATS is not None:
+                STATS.record(f"lock.wait {self.filename}", time.perf_counter() - start)
+            self.held_exclusive = self.held_exclusive or exclusive
+        self.depth += 1
+
+    def release(self):
+        if fcntl is None:
+            return
+        self.depth -= 1
+        if self.depth == 0:
+            # ปิดไฟล์ = ปลดล็อก
+            os.close(self.fd)
+            self.fd = None
+            self.held_exclusive = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        self.acquire(False)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        self.acquire(True)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# DATA_LOCK: shared ระหว่างอ่านไฟล์ตาราง/log, exclusive ระหว่างต่อท้าย log หรือเขียนไฟล์ตารางใหม่
+# WRITE_LOCK: exclusive ตลอด transaction (ตรวจสอบ + แก้ไข + commit) ให้มีผู้เขียนได้ทีละโปรเซส
+# ผู้อ่านจึงถูกบล็อกเฉพาะช่วงสั้นๆ ที่ผู้เขียนกำลังเขียนไฟล์ ไม่ใช่ตลอด transaction
+# ลำดับการล็อกต้องเป็น WRITE_LOCK ก่อน DATA_LOCK เสมอ
+DATA_LOCK = FileLock(DATA_LOCK_FILE)
+WRITE_LOCK = FileLock(WRITE_LOCK_FILE)
+
+
+# ------------ Storage backends ------------
+class TextStorage:
+    """เก็บตารางหลักเป็นไฟล์ .txt คั่นด้วย | (ค่าเริ่มต้น)"""
+
+    name = "text"
+
+    def base_name(self, filename):
+        return filename
+
+    def read(self, filename, min_fields=None, record_type=None):
+        return read_file(filename, min_fields=min_fields, record_type=record_type)
+
+    def write(self, filename, records):
+        return write_file(filename, records)
+
+
+class BinaryStorage:
+    """เก็บตารางหลักเป็นไฟล์ .bin แบบ columnar อ่านผ่าน mmap (ดู binary_storage.py)
+    log ของการแก้ไขยังเป็นไฟล์ <ตาราง>.txt.log เหมือนเดิม
+    """
+
+    name = "binary"
+
+    def __init__(self):
+        import binary_storage
+        self.lib = binary_storage
+
+    def base_name(self, filename):
+        return self.lib.bin_name(filename)
+
+    @timed("io.read_binary")
+    def read(self, filename, min_fields=None, record_type=None):
+        records = self.lib.read_table(get_path(self.base_name(filename)))
+        if min_fields:
+            for parts in records:
+                if len(parts) < min_fields:
+                    parts += [""] * (min_fields - len(parts))
+        if record_type:
+            records = [make_record(record_type, parts) for parts in records]
+        return records
+
+    @timed("io.write_binary")
+    def write(self, filename, records):
+        try:
+            self.lib.write_table(get_path(self.base_name(filename)), filename, [[str(x) for x in r] for r in records])
+            return True
+        except OSError as e:
+            print(f"✘ ข้อผิดพลาดในการเขียนไฟล์ {self.base_name(filename)}: {e}")
+            return False
+
+
+STORAGE_BACKENDS = {"text": TextStorage, "binary": BinaryStorage}
+
+
+def make_storage(name=None):
+    name = name or STORAGE
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"ไม่รู้จักรูปแบบไฟล์ {name!r} (ใช้ได้: {', '.join(STORAGE_BACKENDS)})")
+    return STORAGE_BACKENDS[name]()
+
+
+# ------------ Repository (in-memory cache) ------------
+# จำนวนฟิลด์ขั้นต่ำของแต่ละตาราง (รวมคอลัมน์ Status A/D ท้ายแถว)
+TABLE_FIELDS = {
+    "books.txt": 5,         # BookID|Title|Author|TotalCopies|Status
+    "members.txt": 4,       # MemberID|Name|Phone|Status
+    "borrows.txt": 7,       # BorrowID|MemberID|BorrowDate|ReturnDate|Fine|BorrowStatus|Status
+    "borrow_items.txt": 6,  # ItemID|BorrowID|BookID|ItemStatus|Fine|Status
+}
 
+# ไฟล์ประวัติที่ vacuum(archive=True) ย้ายรายการยืมที่ปิดแล้วไปต่อท้าย (รูปแบบและรหัสเดิม)
+HISTORY_FILES = {
+    "borrows.txt": "borrows_history.txt",
+    "borrow_items.txt": "borrow_items_history.txt",
+}
 
-def calculate_fine(borrow_date, return_date, actual_return_date=None):
+# index รองตาม foreign key: ชื่อ index -> คอลัมน์
+TABLE_INDEXES = {
+    "borrows.txt": {"member": 1},
+    "borrow_items.txt": {"borrow": 1},
+}
+
+
+# ------------ Records ------------
+# แถวที่โหลดเข้าหน่วยความจำเป็น tuple ที่มีชื่อฟิลด์ (__slots__ ว่าง ไม่มี __dict__) แทน list ของ str
+# ใช้แทน list เดิมได้ (r[0], r[-1], len, วนลูป, "|".join) แต่แก้ไขในที่ไม่ได้ ต้องสร้างแถวใหม่แล้ว put()
+# คอลัมน์ที่ค่าซ้ำกันมาก (สถานะ วันที่ ค่าปรับ รหัสอ้างอิง) ถูก intern ผ่าน VALUE_POOL
+# ทุกแถวจึงชี้ str ตัวเดียวกัน แทนที่จะมีสำเนาของตัวเองแถวละชุด
+VALUE_POOL = {}
+
+
+class Book(namedtuple("Book", ["book_id", "title", "author", "total_copies", "status"])):
+    __slots__ = ()
+    pooled = (3,)
+
+
+class Member(namedtuple("Member", ["member_id", "name", "phone", "status"])):
+    __slots__ = ()
+    pooled = ()
+
+
+class Borrow(namedtuple("Borrow", ["borrow_id", "member_id", "borrow_date", "return_date", "fine",
+                                   "borrow_status", "status"])):
+    __slots__ = ()
+    pooled = (1, 2, 3, 4, 5)
+
+
+class BorrowItem(namedtuple("BorrowItem", ["item_id", "borrow_id", "book_id", "item_status", "fine", "status"])):
+    __slots__ = ()
+    pooled = (2, 3, 4)
+
+
+RECORD_TYPES = {
+    "books.txt": Book,
+    "members.txt": Member,
+    "borrows.txt": Borrow,
+    "borrow_items.txt": BorrowItem,
+}
+
+
+def make_record(record_type, parts):
+    """แปลงแถว (list ของ str) เป็น record_type ถ้าจำนวนฟิลด์ตรงกัน ไม่ตรงหรือไม่มีชนิดจะคืนแถวเดิม"""
+    if record_type is None or type(parts) is record_type or len(parts) != len(record_type._fields):
+        return parts
+    parts = list(parts)
+    pool = VALUE_POOL
+    for i in record_type.pooled:
+        value = parts[i]
+        parts[i] = pool.setdefault(value, value)
+    return tuple.__new__(record_type, parts)
+
+
+def with_status(r, status):
+    """สำเนาของแถว (list) ที่เปลี่ยนคอลัมน์ Status ท้ายแถว"""
+    return list(r[:-1]) + [status]
+
+
+def is_active(r):
+    return bool(r) and r[-1] == "A"
+
+
+def is_deleted(r):
+    return bool(r) and r[-1] == "D"
+
+
+def id_number(r):
+    """รหัสของแถวเป็นตัวเลข (0 ถ้าไม่ใช่ตัวเลข)"""
     try:
-        due_date = datetime.strptime(return_date, "%d/%m/%Y")
-        if actual_return_date:
-            actual = datetime.strptime(actual_return_date, "%d/%m/%Y")
-            days_late = (actual - due_date).days
+        return int(r[0])
+    except (IndexError, ValueError):
+        return 0
+
+
+def is_borrowed_item(bi):
+    """borrow item ที่ยังไม่ถูกลบและยังไม่คืน"""
+    return is_active(bi) and len(bi) >= 6 and bi[3].strip() == "กำลังยืม"
+
+
+def needs_vacuum(dead, total):
+    """ตารางที่มีแถว D dead แถวจาก total แถว ถึงเกณฑ์ vacuum อัตโนมัติหรือยัง"""
+    return VACUUM_RATIO > 0 and dead >= VACUUM_MIN_ROWS and dead > VACUUM_RATIO * total
+
+
+def archivable_borrows(borrows_with_items, before=None):
+    """รหัสรายการยืมที่ย้ายไปไฟล์ประวัติได้: คืนครบทุกเล่มแล้วและไม่มีค่าปรับค้าง
+    (ตัวนับค่าปรับรายสมาชิกจึงไม่เปลี่ยน) before = ordinal ถ้าระบุจะเอาเฉพาะที่ครบกำหนดก่อนวันนั้น
+    """
+    closed = set()
+    for br, items in borrows_with_items:
+        if br[5].strip() != "คืนแล้ว" or parse_fine(br[4]):
+            continue
+        if any(is_borrowed_item(bi) or parse_fine(bi[4]) for bi in items):
+            continue
+        if before is not None and (date_ordinal(br[3]) or before) >= before:
+            continue
+        closed.add(br[0].strip())
+    return closed
+
+
+class Table:
+    """ข้อมูลของไฟล์ .txt หนึ่งไฟล์ที่เก็บไว้ในหน่วยความจำ
+    โหลดครั้งเดียว แล้วโหลดใหม่เฉพาะเมื่อ mtime/size ของไฟล์เปลี่ยน
+    ดูแล index รหัสหลัก (by_id) และ index รอง (groups) ของแถวที่ยังไม่ถูกลบ
+    free คือ stack ของตำแหน่งแถวที่ถูกลบ (D) ให้ insert หยิบมาใช้ซ้ำ
+    max_id คือรหัสสูงสุดที่เคยใช้ (รวมแถวที่ถูกลบ) รหัสใหม่จึงไม่ซ้ำกับรหัสเก่าที่ถูกอ้างอิงอยู่
+    การแก้ไขทุกครั้งต้องผ่าน put()/insert()/replace() เพื่อให้ index ถูกต้อง
+
+    การบันทึกไม่เขียนทับทั้งไฟล์ แต่ต่อท้าย operation ลง <ไฟล์>.log
+    ตอนโหลดจะอ่านไฟล์ .txt แล้ว replay log ทับ และเมื่อ log ยาวถึง
+    LOG_COMPACT_OPS จะ compact รวมกลับเข้าไฟล์ .txt แล้วลบ log ทิ้ง
+    ถ้าโปรเซสอื่นแค่ต่อท้าย log (ไฟล์หลักไม่เปลี่ยน) จะอ่านเฉพาะส่วนที่เพิ่มมา (refresh)
+    """
+
+    def __init__(self, filename, min_fields=None, indexes=None, storage=None):
+        self.filename = filename
+        self.min_fields = min_fields
+        self.record_type = RECORD_TYPES.get(filename)
+        self.storage = storage or make_storage()
+        self.index_columns = indexes or {}
+        self.records = []
+        self.by_id = {}
+        self.groups = {}
+        self.free = []
+        self.max_id = 0
+        self.listeners = []
+        self.pending = []
+        self.undo = None
+        self.log_ops = 0
+        self.stamp = None
+        self.loaded = False
+        self.pinned = False
+        self.defer_compact = False
+
+    def file_stamp(self):
+        return (file_stamp(self.storage.base_name(self.filename)), file_stamp(log_name(self.filename)))
+
+    def is_stale(self):
+        return not self.loaded or self.file_stamp() != self.stamp
+
+    @timed("table.load")
+    def load(self):
+        with DATA_LOCK.shared():
+            self.stamp = self.file_stamp()
+            if SNAPSHOT_CACHE and self.load_snapshot():
+                return
+            self.records = self.storage.read(self.filename, min_fields=self.min_fields, record_type=self.record_type)
+            self.log_ops = self.replay_log()
+        self.pending = []
+        self.loaded = True
+        self.rebuild_indexes()
+        self.save_snapshot()
+
+    def snapshot_key(self):
+        """ค่าที่ snapshot ต้องตรงกันจึงจะใช้ได้: รูปแบบไฟล์ snapshot, เวอร์ชัน Python (marshal) และโครงสร้างตาราง"""
+        fields = self.record_type._fields if self.record_type else None
+        return (SNAPSHOT_VERSION, sys.version_info[:2], self.filename, fields, self.min_fields,
+                sorted(self.index_columns.items()))
+
+    def save_snapshot(self):
+        """เขียนแถว index และสถานะของ listener ที่มี state() ลง snapshot_name (เขียนไฟล์ใหม่แล้ว rename ทับ)
+        ต้องเรียกตอนที่ข้อมูลในหน่วยความจำตรงกับ self.stamp (หลังโหลด/compact) ถ้าเขียนไม่ได้ก็แค่ไม่มีแคช
+        """
+        if not SNAPSHOT_CACHE or self.pending or self.undo is not None:
+            return
+        path = get_path(snapshot_name(self.filename))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        record_type = self.record_type
+        body = {
+            "records": [tuple(r) if type(r) is record_type else list(r) for r in self.records],
+            "by_id": self.by_id, "groups": self.groups, "free": self.free, "max_id": self.max_id,
+            "log_ops": self.log_ops,
+            "listeners": {listener_key(l): l.state() for l in self.listeners if getattr(l, "state", None)},
+        }
+        try:
+            with open(tmp_path, "wb") as f:
+                marshal.dump((self.snapshot_key(), self.stamp), f)
+                marshal.dump(body, f)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError):
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+    def load_snapshot(self):
+        """โหลดตารางจาก snapshot แทนการ parse ไฟล์ ใช้ได้เมื่อไฟล์หลักยังเป็นไฟล์เดียวกับตอนเขียน snapshot
+        (mtime/size ตรงกัน) และ log ยาวขึ้นหรือเท่าเดิม ส่วนของ log ที่ต่อท้ายหลังจากนั้นอ่านต่อแบบ refresh()
+        listener ที่มี restore() และมีสถานะใน snapshot รับสถานะคืน ที่เหลือป้อนทุกแถวแบบ rebuild_indexes
+        คืน False ถ้าไม่มี snapshot หรือใช้ไม่ได้ (ให้โหลดจากไฟล์ตามปกติ)
+        """
+        base, log = self.stamp
+        # ปิด GC ระหว่างสร้าง object จำนวนมาก (ไม่มี reference วน) ไม่อย่างนั้น GC สแกนซ้ำจนช้าลงเกือบเท่าตัว
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(get_path(snapshot_name(self.filename)), "rb") as f:
+                key, stamp = marshal.load(f)
+                if key != self.snapshot_key() or stamp[0] != base or base is None:
+                    return False
+                if stamp[1] != log and (log is None or (stamp[1] is not None and log[1] < stamp[1][1])):
+                    return False
+                # marshal.load จากไฟล์อ่านทีละน้อย อ่านส่วนที่เหลือทั้งก้อนแล้ว loads เร็วกว่ามาก
+                body = marshal.loads(f.read())
+            new, record_type = tuple.__new__, self.record_type
+            records = [new(record_type, r) if type(r) is tuple else r for r in body["records"]]
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.records = records
+        self.by_id, self.groups, self.free = body["by_id"], body["groups"], body["free"]
+        self.max_id, self.log_ops = body["max_id"], body["log_ops"]
+        self.stamp = tuple(stamp)
+        self.pending = []
+        self.loaded = True
+        states = body["listeners"]
+        fed = [l for l in self.listeners if not (getattr(l, "restore", None) and listener_key(l) in states)]
+        for listener in self.listeners:
+            if listener not in fed:
+                listener.restore(states[listener_key(listener)])
+        for listener in fed:
+            listener.reset()
+            for r in self.records:
+                listener.change(None, r)
+        if self.stamp != (base, log):
+            self.refresh()
+        return True
+
+    @timed("table.refresh")
+    def refresh(self):
+        """โหลดการแก้ไขของโปรเซสอื่น: ถ้าไฟล์หลักเหมือนเดิมและ log แค่ยาวขึ้น
+        จะอ่านเฉพาะบล็อกที่ต่อท้ายเพิ่มมาแล้วปรับ index ทีละแถว ไม่อย่างนั้นโหลดใหม่ทั้งตาราง
+        """
+        with DATA_LOCK.shared():
+            base, log = self.file_stamp()
+            old_base, old_log = self.stamp or (None, None)
+            if not self.loaded or base != old_base or log is None or (old_log and log[1] < old_log[1]):
+                self.load()
+                return
+            ops = read_log(self.filename, offset=old_log[1] if old_log else 0)
+            for op, slot, fields in ops:
+                if op == "T":
+                    if 0 <= slot < len(self.records) and self.records[slot]:
+                        self._apply(slot, self.make(with_status(self.records[slot], "D")))
+                    continue
+                if self.min_fields and len(fields) < self.min_fields:
+                    fields += [""] * (self.min_fields - len(fields))
+                if 0 <= slot <= len(self.records):
+                    self._apply(slot, self.make(fields))
+            self.log_ops += len(ops)
+            self.stamp = self.file_stamp()
+
+    def replay_log(self):
+        """นำ operation ใน log มาทำซ้ำบน records (ทำซ้ำกี่รอบก็ได้ผลเท่าเดิม) คืนจำนวน op"""
+        ops = read_log(self.filename)
+        for op, slot, fields in ops:
+            if op == "T":
+                if 0 <= slot < len(self.records) and self.records[slot]:
+                    self.records[slot] = self.make(with_status(self.records[slot], "D"))
+                continue
+            if self.min_fields and len(fields) < self.min_fields:
+                fields += [""] * (self.min_fields - len(fields))
+            if 0 <= slot < len(self.records):
+                self.records[slot] = self.make(fields)
+            elif slot == len(self.records):
+                self.records.append(self.make(fields))
+        return len(ops)
+
+    def make(self, row):
+        return make_record(self.record_type, row)
+
+    def log_line(self, i, old, row):
+        if old is None:
+            return "|".join(["I", str(i), *row])
+        if is_active(old) and not is_active(row) and list(row[:-1]) == list(old[:-1]):
+            return f"T|{i}"
+        return "|".join(["U", str(i), *row])
+
+    def rebuild_indexes(self):
+        self.by_id = {}
+        self.groups = {name: {} for name in self.index_columns}
+        for listener in self.listeners:
+            listener.reset()
+        # ดันตำแหน่งจากท้ายไปหน้า ให้ช่องว่างแรกสุดอยู่บนสุดของ stack
+        self.free = [i for i in range(len(self.records) - 1, -1, -1) if is_deleted(self.records[i])]
+        self.max_id = 0
+        for i, r in enumerate(self.records):
+            self._index(i, r)
+            self.max_id = max(self.max_id, id_number(r))
+            for listener in self.listeners:
+                listener.change(None, r)
+
+    def _index(self, i, r):
+        if not is_active(r):
+            return
+        self.by_id.setdefault(r[0].strip(), i)
+        for name, col in self.index_columns.items():
+            if col < len(r):
+                bisect.insort(self.groups[name].setdefault(r[col].strip(), []), i)
+
+    def _unindex(self, i, r):
+        if not is_active(r):
+            return
+        key = r[0].strip()
+        if self.by_id.get(key) == i:
+            del self.by_id[key]
+        for name, col in self.index_columns.items():
+            if col >= len(r):
+                continue
+            positions = self.groups[name].get(r[col].strip())
+            if not positions:
+                continue
+            # positions เรียงอยู่แล้ว หาด้วย bisect แทนการไล่ทั้ง list
+            j = bisect.bisect_left(positions, i)
+            if j < len(positions) and positions[j] == i:
+                del positions[j]
+                if not positions:
+                    del self.groups[name][r[col].strip()]
+
+    def rows(self):
+        """คืน list ของแถวทั้งหมด (รวมแถวที่ถูกลบ D) โหลดใหม่ถ้าไฟล์เปลี่ยน
+        ระหว่าง transaction ที่แก้ตารางนี้ไปแล้วจะไม่โหลดใหม่ เพื่อไม่ให้การแก้ไขที่ยังไม่ commit หาย
+        ถ้า pinned (อยู่ใน Repository.snapshot) และโหลดแล้วจะไม่ตรวจไฟล์ซ้ำ
+        """
+        if not self.undo and not (self.pinned and self.loaded) and self.is_stale():
+            self.refresh()
+        return self.records
+
+    def get(self, record_id):
+        """หาแถวที่ยังไม่ถูกลบตามรหัสใน O(1) คืน None ถ้าไม่พบ"""
+        self.rows()
+        i = self.by_id.get(str(record_id).strip())
+        return self.records[i] if i is not None else None
+
+    def group(self, name, key):
+        """แถวที่ยังไม่ถูกลบซึ่งคอลัมน์ของ index รอง name มีค่าเท่ากับ key (เรียงตามลำดับในไฟล์)"""
+        self.rows()
+        return [self.records[i] for i in self.groups[name].get(str(key).strip(), ())]
+
+    def put(self, i, row):
+        """แทนที่แถวตำแหน่ง i (หรือต่อท้ายถ้า i == len) พร้อมปรับ index และจดลง pending"""
+        row = self.make(row)
+        old = self._apply(i, row)
+        self.pending.append(self.log_line(i, old, row))
+        if self.undo is not None:
+            self.undo.append((i, old))
+
+    def _apply(self, i, row):
+        """เปลี่ยนแถวในหน่วยความจำพร้อมปรับ index/free/max_id/listener คืนแถวเดิม (None ถ้าต่อท้าย)"""
+        old = self.records[i] if i < len(self.records) else None
+        if old is not None:
+            self._unindex(i, old)
+            self.records[i] = row
+        else:
+            self.records.append(row)
+        if is_deleted(row) and (old is None or not is_deleted(old)):
+            self.free.append(i)
+        self.max_id = max(self.max_id, id_number(row))
+        self._index(i, row)
+        for listener in self.listeners:
+            listener.change(old, row)
+        return old
+
+    def rollback(self, keep=None):
+        """ย้อนการแก้ไขใน transaction ที่ยังไม่ commit (ย้อนจากหลังไปหน้า)
+        keep = จำนวนการแก้ไขแรกที่เก็บไว้ (ย้อนถึง savepoint) None = ย้อนทั้งหมดและจบ transaction ของตารางนี้
+        """
+        undo = self.undo or []
+        for i, old in reversed(undo[keep or 0:]):
+            cur = self.records[i]
+            self._unindex(i, cur)
+            if old is None:
+                self.records.pop()
+            else:
+                self.records[i] = old
+                self._index(i, old)
+                if is_deleted(old) and not is_deleted(cur):
+                    self.free.append(i)
+            for listener in self.listeners:
+                listener.change(cur, old)
+        if keep is not None:
+            # put() จด pending และ undo คู่กันเสมอ ตัดทิ้งที่ตำแหน่งเดียวกัน
+            del undo[keep:]
+            del self.pending[keep:]
+            return
+        self.pending = []
+        self.undo = None
+
+    def free_slot(self):
+        """หยิบตำแหน่งแถวที่ถูกลบจาก free list (O(1)) คืน None ถ้าไม่มี"""
+        while self.free:
+            i = self.free.pop()
+            # ข้ามตำแหน่งที่ถูกเขียนทับไปแล้ว (เช่นจาก replay หรือ rollback)
+            if i < len(self.records) and is_deleted(self.records[i]):
+                return i
+        return None
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def insert(self, fields):
+        """เพิ่มแถวใหม่ (ใช้ช่องที่ถูกลบถ้ามี) คืนรหัสใหม่ ทำงานใน O(1)"""
+        records = self.rows()
+        slot = self.free_slot()
+        new_id = str(self.next_id())
+        self.put(len(records) if slot is None else slot, [new_id] + [str(x) for x in fields] + ["A"])
+        return new_id
+
+    def replace(self, record_id, row):
+        """แทนที่แถวที่ยังไม่ถูกลบตามรหัส คืน False ถ้าไม่พบ"""
+        self.rows()
+        i = self.by_id.get(str(record_id).strip())
+        if i is None:
+            return False
+        self.put(i, row)
+        return True
+
+    def save(self):
+        """ต่อท้าย operation ที่ค้างอยู่ลง log ในการเขียนครั้งเดียว
+        ระหว่าง transaction จะยังไม่เขียน รอ Transaction.commit()
+        """
+        if self.undo is not None or not self.pending:
+            return True
+        with WRITE_LOCK.exclusive(), DATA_LOCK.exclusive():
+            return self.flush(append_log(self.filename, self.pending))
+
+    def flush(self, ok):
+        """ปรับสถานะหลังเขียน pending ลง log แล้ว (ok = เขียนสำเร็จหรือไม่)"""
+        if ok:
+            self.log_ops += len(self.pending)
+            self.pending = []
+            self.stamp = self.file_stamp()
+            if self.log_ops >= LOG_COMPACT_OPS and not self.defer_compact:
+                ok = self.compact()
         else:
-            days_late = (datetime.now() - due_date).days
-        return max(0, days_late * 5)
-    except Exception:
+            # เขียนไม่สำเร็จ ข้อมูลในหน่วยความจำอาจไม่ตรงกับไฟล์ ให้โหลดใหม่ครั้งหน้า
+            self.pending = []
+            self.loaded = False
+        return ok
+
+    @timed("table.compact")
+    def compact(self):
+        """รวม log กลับเข้าไฟล์ตารางหลัก (เขียนไฟล์ใหม่แบบ atomic) แล้วลบ log"""
+        if self.pending and not self.save():
+            return False
+        with WRITE_LOCK.exclusive(), DATA_LOCK.exclusive():
+            if file_stamp(log_name(self.filename)) is None:
+                return True
+            self.rows()
+            if not self.storage.write(self.filename, self.records):
+                self.loaded = False
+                return False
+            remove_log(self.filename)
+            self.log_ops = 0
+            self.stamp = self.file_stamp()
+            self.save_snapshot()
+            return True
+
+    def dead_rows(self):
+        """จำนวนแถวที่ถูกลบ (D) ที่ยังค้างอยู่ในตาราง"""
+        return sum(1 for r in self.rows() if is_deleted(r))
+
+    @timed("table.vacuum")
+    def vacuum(self, select=None, history=None):
+        """เขียนตารางใหม่โดยตัดแถวที่ถูกลบ (D) ทิ้ง คืน (จำนวนแถวที่ตัด, จำนวนแถวที่ย้าย) หรือ None ถ้าเขียนไม่สำเร็จ
+        select(row) = True คือแถวที่ยังใช้อยู่ที่ต้องย้ายไปต่อท้ายไฟล์ history (ต่อท้ายก่อนเขียนตาราง
+        ถ้าล่มกลางทางจะมีแถวซ้ำในไฟล์ประวัติ ไม่ใช่แถวหาย)
+        แถวรหัสสูงสุดถูกเก็บไว้เป็น D ถ้าจำเป็น รหัสใหม่จึงไม่ซ้ำกับรหัสที่เคยใช้
+        log อ้างอิงตำแหน่งแถว จึง compact ก่อนเสมอ
+        """
+        if not self.compact():
+            return None
+        with WRITE_LOCK.exclusive(), DATA_LOCK.exclusive():
+            records = self.rows()
+            keep, moved = [], []
+            for r in records:
+                if is_active(r):
+                    (moved if select and select(r) else keep).append(r)
+            top = max(records, key=id_number, default=None)
+            if top is not None and id_number(top) > max((id_number(r) for r in keep), default=0):
+                keep.append(self.make(with_status(top, "D")))
+            removed = len(records) - len(keep) - len(moved)
+            if not moved and not removed:
+                return (0, 0)
+            if moved and not append_lines(history, ["|".join(str(x) for x in r) for r in moved]):
+                return None
+            if not self.storage.write(self.filename, keep):
+                self.loaded = False
+                return None
+            self.records = keep
+            self.rebuild_indexes()
+            self.stamp = self.file_stamp()
+            self.save_snapshot()
+            return (removed, len(moved))
+
+    def invalidate(self):
+        self.loaded = False
+
+
+class BorrowedCounter:
+    """BookID -> จำนวนเล่มที่กำลังถูกยืมอยู่ ปรับทุกครั้งที่ borrow_items เปลี่ยน"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def reset(self):
+        self.counts = {}
+
+    def state(self):
+        return self.counts
+
+    def restore(self, state):
+        self.counts = state
+
+    def change(self, old, new):
+        if old is not None and is_borrowed_item(old):
+            key = old[2].strip()
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+        if new is not None and is_borrowed_item(new):
+            key = new[2].strip()
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+class Listener:
+    """listener ของตารางที่สร้างจากฟังก์ชัน reset/change (ให้ object เดียวฟังได้หลายตาราง)
+    state/restore (ถ้ามี) ใช้เก็บ/คืนสถานะผ่าน snapshot ของตาราง แทนการป้อนทุกแถวใหม่
+    """
+
+    def __init__(self, reset, change, state=None, restore=None):
+        self.reset = reset
+        self.change = change
+        self.state = state
+        self.restore = restore
+
+
+def listener_key(listener):
+    """ชื่อของ listener ในไฟล์ snapshot เช่น BorrowedCounter.change, MemberLoans.change_item"""
+    return listener.change.__qualname__
+
+
+class MemberLoans:
+    """MemberID -> [จำนวนเล่มที่ยังไม่คืน, ค่าปรับที่บันทึกไว้] ปรับทุกครั้งที่ borrows หรือ borrow_items เปลี่ยน
+    ฟังสองตาราง: borrows_listener (BorrowID -> MemberID) และ items_listener (ตัวนับต่อ BorrowID)
+    ผลรวมรายสมาชิกได้จากทั้งสองส่วน ตารางใดโหลดใหม่ (reset) ก็สร้างผลรวมคืนได้จากอีกส่วนที่ยังอยู่
+    ค่าปรับนับแบบเดียวกับ "ค่าปรับที่ยังไม่ได้รับ" ของรายงาน (เล่มที่คืนแล้วและมีค่าปรับ)
+    """
+
+    def __init__(self):
+        self.borrow_member = {}  # BorrowID -> MemberID ของรายการยืมที่ยังไม่ถูกลบ
+        self.per_borrow = {}     # BorrowID -> [เล่มที่ยังไม่คืน, ค่าปรับ]
+        self.per_member = {}     # MemberID -> [เล่มที่ยังไม่คืน, ค่าปรับ]
+        self.borrows_listener = Listener(self.reset_borrows, self.change_borrow,
+                                         lambda: self.borrow_member, self.restore_borrows)
+        self.items_listener = Listener(self.reset_items, self.change_item, lambda: self.per_borrow, self.restore_items)
+
+    def add(self, totals, key, counts, sign):
+        if key is None or counts is None:
+            return
+        total = totals.setdefault(key, [0, 0])
+        total[0] += sign * counts[0]
+        total[1] += sign * counts[1]
+        if not total[0] and not total[1]:
+            del totals[key]
+
+    def reset_borrows(self):
+        self.borrow_member = {}
+        self.per_member = {}
+
+    def reset_items(self):
+        self.per_borrow = {}
+        self.per_member = {}
+
+    def restore_borrows(self, state):
+        self.borrow_member = state
+        self.recount()
+
+    def restore_items(self, state):
+        self.per_borrow = state
+        self.recount()
+
+    def recount(self):
+        # per_borrow มีเฉพาะรายการยืมที่ยังมีเล่มค้างหรือค่าปรับ จึงน้อยกว่าจำนวนแถวมาก
+        self.per_member = {}
+        for borrow_id, counts in self.per_borrow.items():
+            self.add(self.per_member, self.borrow_member.get(borrow_id), counts, 1)
+
+    def change_borrow(self, old, new):
+        old = (old[0].strip(), old[1].strip()) if old is not None and is_active(old) and len(old) > 1 else None
+        new = (new[0].strip(), new[1].strip()) if new is not None and is_active(new) and len(new) > 1 else None
+        if old == new:
+            return
+        if old is not None:
+            self.borrow_member.pop(old[0], None)
+            self.add(self.per_member, old[1], self.per_borrow.get(old[0]), -1)
+        if new is not None:
+            self.borrow_member[new[0]] = new[1]
+            self.add(self.per_member, new[1], self.per_borrow.get(new[0]), 1)
+
+    def change_item(self, old, new):
+        for bi, sign in ((old, -1), (new, 1)):
+            if bi is None or not is_active(bi) or len(bi) < 6:
+                continue
+            counts = (1 if is_borrowed_item(bi) else 0, parse_fine(bi[4]) if bi[3].strip() == "คืนแล้ว" else 0)
+            if counts == (0, 0):
+                continue
+            borrow_id = bi[1].strip()
+            self.add(self.per_borrow, borrow_id, counts, sign)
+            self.add(self.per_member, self.borrow_member.get(borrow_id), counts, sign)
+
+    def state(self, member_id):
+        """(จำนวนเล่มที่ยังไม่คืน, ค่าปรับที่บันทึกไว้) ของสมาชิก"""
+        return tuple(self.per_member.get(str(member_id).strip(), (0, 0)))
+
+
+class Transaction:
+    """รวมการแก้ไขหลายตารางให้บันทึกพร้อมกันแบบ all-or-nothing
+
+    ระหว่าง transaction การแก้ไขจะอยู่ในหน่วยความจำเท่านั้น (save() ของตารางยังไม่เขียน)
+    ตอน commit จะต่อท้าย log ของแต่ละตารางที่ถูกแก้ครั้งเดียวต่อไฟล์ (fsync)
+    ถ้าแก้มากกว่า 1 ตารางจะเขียน txid ลง JOURNAL_FILE เป็นจุด commit สุดท้าย
+    โปรแกรมล่มก่อนถึงจุดนั้น ตอนโหลดใหม่จะไม่เห็นการแก้ไขใดๆ ของ transaction นี้เลย
+    ถ้ามี exception ใน with จะ rollback ข้อมูลในหน่วยความจำกลับ
+
+    ตลอด transaction จะถือ WRITE_LOCK และโหลดการแก้ไขของโปรเซสอื่นก่อนเริ่ม
+    การตรวจสอบ (เช่นเล่มว่าง) ภายใน with จึงเห็นข้อมูลล่าสุดและไม่ชนกับผู้เขียนคนอื่น
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.txid = new_txid()
+        self.nested = False
+        self.ok = None
+
+    def __enter__(self):
+        if self.repo.txn is not None:
+            # transaction ซ้อน: รวมเข้ากับตัวนอกสุด
+            self.nested = True
+            return self
+        WRITE_LOCK.acquire(True)
+        try:
+            for t in self.repo.tables.values():
+                t.save()
+                # ตรวจไฟล์เสมอแม้อยู่ใน snapshot: ต้องเห็นข้อมูลล่าสุดก่อนแก้ไข
+                if t.loaded and t.is_stale():
+                    t.refresh()
+                t.undo = []
+        except BaseException:
+            WRITE_LOCK.release()
+            raise
+        self.repo.txn = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            return False
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            WRITE_LOCK.release()
+        return False
+
+    @timed("txn.commit")
+    def commit(self):
+        touched = [t for t in self.repo.tables.values() if t.pending]
+        ok = True
+        with DATA_LOCK.exclusive():
+            for t in touched:
+                if not append_log(t.filename, t.pending, self.txid, len(touched)):
+                    ok = False
+                    break
+            if ok and len(touched) > 1:
+                ok = append_lines(JOURNAL_FILE, [self.txid])
+            self.repo.txn = None
+            for t in self.repo.tables.values():
+                t.undo = None
+            if ok:
+                for t in touched:
+                    t.flush(True)
+            else:
+                # บางไฟล์อาจมีบล็อกที่ยังไม่ commit ค้างอยู่ ซึ่งจะถูกข้ามตอนโหลด
+                for t in touched:
+                    t.flush(False)
+        self.ok = ok
+        return ok
+
+    def rollback(self):
+        for t in self.repo.tables.values():
+            t.rollback()
+        self.repo.txn = None
+        self.ok = False
+
+    def savepoint(self):
+        """จุดที่ rollback_to ย้อนกลับมาได้: จำนวนการแก้ไขของแต่ละตารางใน transaction ณ ตอนนี้"""
+        return {name: len(t.undo) for name, t in self.repo.tables.items() if t.undo is not None}
+
+    def rollback_to(self, mark):
+        """ย้อนเฉพาะการแก้ไขหลัง savepoint() transaction ยังเปิดอยู่และการแก้ไขก่อนหน้ายังรอ commit ตามเดิม
+        รหัสที่งานที่ถูกย้อนหยิบไปแล้วไม่ถูกใช้ซ้ำ (max_id คือรหัสสูงสุดที่เคยใช้)
+        """
+        for name, t in self.repo.tables.items():
+            if t.undo is not None:
+                t.rollback(mark.get(name, 0))
+
+
+class Repository:
+    """จุดเข้าถึงข้อมูลทั้ง 4 ตาราง ทุก helper และเมนูอ่าน/เขียนผ่านตัวนี้"""
+
+    def __init__(self, storage=None):
+        self.storage = storage or make_storage()
+        self.tables = {name: Table(name, n, TABLE_INDEXES.get(name), self.storage) for name, n in TABLE_FIELDS.items()}
+        self.borrowed = BorrowedCounter()
+        self.tables["borrow_items.txt"].listeners.append(self.borrowed)
+        self.loans = MemberLoans()
+        self.tables["borrows.txt"].listeners.append(self.loans.borrows_listener)
+        self.tables["borrow_items.txt"].listeners.append(self.loans.items_listener)
+        self.txn = None
+        self.snapshots = 0
+
+    def table(self, filename):
+        if filename not in self.tables:
+            self.tables[filename] = Table(filename, storage=self.storage)
+            self.tables[filename].pinned = self.snapshots > 0
+        return self.tables[filename]
+
+    def rows(self, filename):
+        return self.table(filename).rows()
+
+    def active(self, filename):
+        """วนเฉพาะแถวที่ยังไม่ถูกลบ (Status = A)"""
+        return (r for r in self.rows(filename) if is_active(r))
+
+    def get(self, filename, record_id):
+        """หาแถวที่ยังไม่ถูกลบตามรหัส คืน None ถ้าไม่พบ"""
+        return self.table(filename).get(record_id)
+
+    def items_of(self, borrow_id):
+        """borrow_items ที่ยังไม่ถูกลบของรายการยืมนี้"""
+        return self.table("borrow_items.txt").group("borrow", borrow_id)
+
+    def borrowed_items_of(self, borrow_id):
+        """borrow_items ของรายการยืมนี้ที่ยังไม่คืน"""
+        return [bi for bi in self.items_of(borrow_id) if is_borrowed_item(bi)]
+
+    def borrows_with_items(self, unreturned_only=False):
+        """รายการยืมที่ยังไม่ถูกลบคู่กับ borrow_items ของรายการนั้น (join ผ่าน index BorrowID)
+        unreturned_only=True คืนเฉพาะรายการที่ยังมีเล่มไม่คืน
+        """
+        # ตรวจว่าไฟล์เปลี่ยนครั้งเดียวต่อการวน แทนที่จะ stat ไฟล์ทุกครั้งที่เรียก items_of
+        table = self.table("borrow_items.txt")
+        table.rows()
+        by_borrow = table.groups["borrow"]
+        for br in self.active("borrows.txt"):
+            items = [table.records[i] for i in by_borrow.get(br[0].strip(), ())]
+            if unreturned_only and not any(is_borrowed_item(bi) for bi in items):
+                continue
+            yield br, items
+
+    def borrowed_count(self, book_id):
+        self.rows("borrow_items.txt")
+        return self.borrowed.counts.get(str(book_id).strip(), 0)
+
+    def check_borrowed_counts(self):
+        """นับจำนวนเล่มที่ถูกยืมใหม่ทั้งหมดจาก borrow_items แล้วเทียบกับตัวนับ
+        คืน dict BookID -> (ค่าในตัวนับ, ค่าที่นับใหม่) เฉพาะเล่มที่ไม่ตรงกัน
+        """
+        actual = {}
+        for bi in self.rows("borrow_items.txt"):
+            if is_borrowed_item(bi):
+                actual[bi[2].strip()] = actual.get(bi[2].strip(), 0) + 1
+        counts = self.borrowed.counts
+        return {
+            book_id: (counts.get(book_id, 0), actual.get(book_id, 0))
+            for book_id in set(counts) | set(actual)
+            if counts.get(book_id, 0) != actual.get(book_id, 0)
+        }
+
+    def member_loans(self, member_id):
+        """(จำนวนเล่มที่ยังไม่คืน, ค่าปรับที่บันทึกไว้) ของสมาชิก อ่านจากตัวนับ MemberLoans ใน O(1)"""
+        self.rows("borrows.txt")
+        self.rows("borrow_items.txt")
+        return self.loans.state(member_id)
+
+    def save(self, filename):
+        return self.table(filename).save()
+
+    def transaction(self):
+        """ใช้กับ with: with repo.transaction() as txn: ..."""
+        return Transaction(self)
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """อ่านหลายแถวต่อเนื่องโดยตรวจว่าไฟล์เปลี่ยนแค่ครั้งเดียวตอนเริ่ม (ไม่ stat ไฟล์ทุกครั้งที่ get)
+        การแก้ไขของโปรเซสอื่นระหว่างบล็อกจะเห็นหลังออกจากบล็อก
+        """
+        if not self.snapshots:
+            for t in self.tables.values():
+                if t.loaded:
+                    t.rows()
+                t.pinned = True
+        self.snapshots += 1
+        try:
+            yield self
+        finally:
+            self.snapshots -= 1
+            if not self.snapshots:
+                for t in self.tables.values():
+                    t.pinned = False
+
+    @contextlib.contextmanager
+    def bulk(self):
+        """นำเข้าข้อมูลจำนวนมากหลาย transaction: ระหว่างบล็อกไม่ compact ทุก LOG_COMPACT_OPS
+        (ซึ่งจะเขียนทั้งตารางใหม่ทุกชุด) แต่ compact ครั้งเดียวตอนออกจากบล็อก
+        """
+        for t in self.tables.values():
+            t.defer_compact = True
+        try:
+            yield self
+        finally:
+            for t in self.tables.values():
+                t.defer_compact = False
+            self.compact()
+
+    def compact(self):
+        """รวม log ของทุกตารางกลับเข้าไฟล์ตารางหลัก (ถ้าไม่เหลือ log แล้วจะลบ journal ด้วย)"""
+        with WRITE_LOCK.exclusive(), DATA_LOCK.exclusive():
+            ok = all([t.compact() for t in self.tables.values()])
+            if ok and not any(file_stamp(log_name(name)) for name in self.tables):
+                remove_file(JOURNAL_FILE)
+            if ok and self.txn is None:
+                # ตรวจเฉพาะตารางที่โหลดไว้แล้ว ไม่โหลดทุกตารางตอนออกจากโปรแกรมแค่เพื่อนับแถว D
+                for t in self.tables.values():
+                    if t.loaded and needs_vacuum(t.dead_rows(), len(t.records)):
+                        ok = t.vacuum() is not None and ok
+            return ok
+
+    def vacuum(self, archive=False, before=None):
+        """ตัดแถวที่ถูกลบออกจากทุกตาราง คืน dict ชื่อไฟล์ -> (แถวที่ตัด, แถวที่ย้าย) หรือ None ถ้าล้มเหลว
+        archive=True ย้ายรายการยืมที่ปิดแล้ว (ดู archivable_borrows) พร้อม borrow_items ไป HISTORY_FILES
+        """
+        with WRITE_LOCK.exclusive(), DATA_LOCK.exclusive():
+            if not all([t.compact() for t in self.tables.values()]):
+                return None
+            closed = archivable_borrows(self.borrows_with_items(), before) if archive else set()
+            selects = {"borrows.txt": lambda r: r[0].strip() in closed,
+                       "borrow_items.txt": lambda r: r[1].strip() in closed}
+            result = {}
+            # ย้าย borrow_items ก่อน ถ้าล่มกลางทางจะเหลือรายการยืมที่ไม่มี item แทน item ที่ไม่มีรายการยืม
+            for name in sorted(self.tables, key=lambda name: name != "borrow_items.txt"):
+                select = selects.get(name) if closed else None
+                result[name] = self.tables[name].vacuum(select, HISTORY_FILES.get(name))
+                if result[name] is None:
+                    return None
+            return result
+
+    def invalidate(self):
+        for t in self.tables.values():
+            t.invalidate()
+
+
+def make_repository(name=None):
+    """สร้าง repository ตามรูปแบบการเก็บข้อมูลที่ตั้งไว้ (LIBRARY_STORAGE)"""
+    name = name or STORAGE
+    if name == "sqlite":
+        import sqlite_storage
+        return sqlite_storage.SqliteRepository(get_path(sqlite_storage.DB_FILE))
+    return Repository(make_storage(name))
+
+
+repo = make_repository()
+
+# ------------ Dates ------------
+# วันที่ในไฟล์เป็นข้อความ dd/mm/yyyy ภายในโปรแกรมใช้ ordinal (จำนวนวันนับจาก 1/1/1)
+_date_ordinals = {}
+
+
+def date_ordinal(text):
+    """วันที่ dd/mm/yyyy เป็น ordinal (แปลงครั้งเดียวต่อค่า) คืน None ถ้ารูปแบบไม่ถูกต้อง"""
+    ordinal = _date_ordinals.get(text, False)
+    if ordinal is False:
+        try:
+            ordinal = datetime.strptime(text, DATE_FORMAT).toordinal()
+        except (TypeError, ValueError):
+            ordinal = None
+        _date_ordinals[text] = ordinal
+    return ordinal
+
+
+def ordinal_date(ordinal):
+    return date.fromordinal(ordinal).strftime(DATE_FORMAT)
+
+
+def today_ordinal():
+    return date.today().toordinal()
+
+
+def validate_date(date_str):
+    return date_ordinal(date_str) is not None
+
+
+def due_date(borrow_date):
+    """วันที่ต้องคืนของรายการที่ยืมวันที่ borrow_date (ยืมได้ LOAN_DAYS วัน)"""
+    return ordinal_date(date_ordinal(borrow_date) + LOAN_DAYS)
+
+
+def calculate_fine(borrow_date, return_date, actual_return_date=None, today=None):
+    """ค่าปรับต่อเล่ม: จำนวนวันที่คืนช้ากว่า return_date x FINE_PER_DAY
+    ยังไม่คืน (ไม่มี actual_return_date) คิดถึงวัน today (ordinal, ค่าเริ่มต้นวันนี้)
+    """
+    due = date_ordinal(return_date)
+    if actual_return_date:
+        actual = date_ordinal(actual_return_date)
+    else:
+        actual = today if today is not None else today_ordinal()
+    if due is None or actual is None:
         return 0
+    return max(0, actual - due) * FINE_PER_DAY
+
+
+# จำนวนเล่มขั้นต่ำที่จะคำนวณค่าปรับด้วย NumPy (น้อยกว่านี้ list ธรรมดาเร็วกว่าเวลา import NumPy)
+NUMPY_MIN_ROWS = 5000
+_numpy = False
+
+
+def numpy_module():
+    """NumPy (import ครั้งแรกที่ใช้) หรือ None ถ้าไม่ได้ติดตั้ง"""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as _numpy
+        except ImportError:  # ไม่มี NumPy คำนวณค่าปรับแบบ list ธรรมดา
+            _numpy = None
+    return _numpy
+
+
+def overdue_fines(dues, today=None):
+    """จำนวนวันที่เกินกำหนดและค่าปรับสะสมของหลายเล่มในรอบเดียว (ใช้ NumPy ถ้ามีและ dues ยาวพอ)
+    dues = list ของ ordinal วันที่ต้องคืน (None = วันที่ผิดรูปแบบ)
+    คืน (list วันที่เกินกำหนด หรือ None, list ค่าปรับ) ตามลำดับเดียวกับ dues
+    """
+    today = today if today is not None else today_ordinal()
+    numpy = numpy_module() if len(dues) >= NUMPY_MIN_ROWS else None
+    if numpy is not None:
+        due = numpy.fromiter((d or 0 for d in dues), dtype=numpy.int64, count=len(dues))
+        days = today - due
+        fines = numpy.maximum(days, 0) * FINE_PER_DAY
+        fines[due == 0] = 0
+        return [None if d is None else n for d, n in zip(dues, days.tolist())], fines.tolist()
+    days = [None if d is None else today - d for d in dues]
+    return days, [0 if n is None else max(0, n) * FINE_PER_DAY for n in days]
 
 
 def ensure_min_len(lst, n):
@@ -89,89 +1450,683 @@ def ensure_min_len(lst, n):
 
 # Helpers to get names/titles
 def get_book_title(book_id):
-    books = read_file("books.txt", min_fields=5)
-    return next((b[1] for b in books if b and b[0].strip() == book_id and b[-1] == "A"), "ไม่ทราบชื่อหนังสือ")
+    book = repo.get("books.txt", book_id)
+    return book[1] if book else "ไม่ทราบชื่อหนังสือ"
 
 
 def get_member_name(member_id):
-    members = read_file("members.txt", min_fields=4)
-    return next((m[1] for m in members if m and m[0].strip() == member_id and m[-1] == "A"), "ไม่ทราบชื่อ")
+    member = repo.get("members.txt", member_id)
+    return member[1] if member else "ไม่ทราบชื่อ"
 
 # เพิ่มฟังก์ชันนับจำนวนหนังสือที่ถูกยืมอยู่
 def get_borrowed_count(book_id):
-    """นับจำนวนเล่มของหนังสือที่กำลังถูกยืมอยู่"""
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
-    count = 0
-    for bi in borrow_items:
-        try:
-            if bi and bi[-1] == "A" and bi[2].strip() == book_id and bi[3].strip() == "กำลังยืม":
-                count += 1
-        except Exception:
-            continue
-    return count
+    """นับจำนวนเล่มของหนังสือที่กำลังถูกยืมอยู่ (อ่านจากตัวนับใน repo ไม่ต้องสแกน borrow_items)"""
+    return repo.borrowed_count(book_id)
+
+
+def get_available_copies(book):
+    """จำนวนเล่มว่างของแถวหนังสือ = จำนวนเล่มทั้งหมด - เล่มที่กำลังถูกยืม"""
+    total_copies = int(book[3]) if book[3].isdigit() else 0
+    return total_copies - get_borrowed_count(book[0])
 
 # เพิ่มฟังก์ชันเช็คสถานะหนังสือ
 def get_book_borrow_status(book_id):
     """เช็คว่าหนังสือกำลังถูกยืมอยู่หรือไม่"""
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
-    for bi in borrow_items:
-        try:
-            if bi and bi[-1] == "A" and bi[2].strip() == book_id and bi[3].strip() == "กำลังยืม":
-                return "ถูกยืม"
-        except Exception:
+    return "ถูกยืม" if get_borrowed_count(book_id) > 0 else "ว่าง"
+
+
+def verify_borrowed_counts():
+    """ตรวจตัวนับเล่มที่ถูกยืมเทียบกับการนับใหม่จาก borrow_items รายงานและแก้ค่าที่คลาดเคลื่อน"""
+    drift = repo.check_borrowed_counts()
+    if not drift:
+        print("✔ ตัวนับจำนวนเล่มที่ถูกยืมตรงกับข้อมูลทั้งหมด")
+        return True
+    rows = [[book_id, get_book_title(book_id), cached, actual] for book_id, (cached, actual) in sorted(drift.items())]
+    print("⚠️ พบตัวนับไม่ตรงกับข้อมูล:")
+    print(tabulate(rows, headers=["BookID","ชื่อหนังสือ","ตัวนับ","นับใหม่"], tablefmt="grid"))
+    repo.table("borrow_items.txt").rebuild_indexes()
+    print("✔ คำนวณตัวนับใหม่เรียบร้อย")
+    return False
+
+# คำค้น: ภาษาไทย (ช่วง U+0E00-U+0E7F รวมสระและวรรณยุกต์) หรือคำภาษาอื่น/ตัวเลขที่ต่อเนื่องกัน
+SEARCH_TOKEN_RE = re.compile(r"[\u0e00-\u0e7f]+|[^\W_\u0e00-\u0e7f]+")
+# ภาษาไทยไม่เว้นวรรคระหว่างคำ จึงทำ index เป็นชิ้นยาว THAI_GRAM ตัวอักษร
+THAI_GRAM = 3
+# คำค้นที่สั้นกว่านี้ต้องตรงทั้ง key (ไม่ขยายเป็น prefix ซึ่งจะครอบคลุม key จำนวนมาก)
+MIN_PREFIX = 2
+
+
+def search_terms(text):
+    return SEARCH_TOKEN_RE.findall(str(text).casefold())
+
+
+def is_thai(term):
+    return "\u0e00" <= term[0] <= "\u0e7f"
+
+
+def search_keys(term):
+    """key ใน index ของคำหนึ่งคำ: คำอังกฤษใช้ทั้งคำ ภาษาไทยใช้ทุกชิ้น term[i:i+THAI_GRAM]
+    (ชิ้นท้ายสั้นกว่า THAI_GRAM) ข้อความไทยทุกช่วงที่ยาวไม่เกิน THAI_GRAM จึงเป็น prefix ของบาง key
+    """
+    if not is_thai(term):
+        return [term]
+    return [term[i:i + THAI_GRAM] for i in range(len(term))]
+
+
+class SearchIndex:
+    """inverted index ของชื่อหนังสือ/ผู้แต่ง: key -> set ของ BookID (เฉพาะแถวที่ยังไม่ถูกลบ)
+    เป็น listener ของตาราง books จึงปรับตามทุกครั้งที่เพิ่ม/แก้/ลบหนังสือ
+    การค้นแบบ prefix ใช้ sorted_keys (เรียงใหม่เมื่อมี key ใหม่สะสมเกิน 1024 ตัว) ร่วมกับ added
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.postings = {}
+        self.sorted_keys = []
+        self.added = set()
+
+    def keys_of(self, r):
+        keys = set()
+        for term in search_terms(r[1] + " " + r[2]):
+            keys.update(search_keys(term))
+        return keys
+
+    def change(self, old, new):
+        if old is not None and is_active(old) and len(old) >= 3:
+            book_id = old[0].strip()
+            for key in self.keys_of(old):
+                ids = self.postings.get(key)
+                if ids is not None:
+                    ids.discard(book_id)
+                    if not ids:
+                        del self.postings[key]
+        if new is not None and is_active(new) and len(new) >= 3:
+            book_id = new[0].strip()
+            for key in self.keys_of(new):
+                if key not in self.postings:
+                    self.postings[key] = set()
+                    self.added.add(key)
+                self.postings[key].add(book_id)
+
+    def prefix_keys(self, prefix):
+        if len(self.added) > 1024:
+            self.sorted_keys = sorted(self.postings)
+            self.added = set()
+        i = bisect.bisect_left(self.sorted_keys, prefix)
+        while i < len(self.sorted_keys) and self.sorted_keys[i].startswith(prefix):
+            if self.sorted_keys[i] in self.postings:
+                yield self.sorted_keys[i]
+            i += 1
+        yield from (k for k in self.added if k.startswith(prefix) and k in self.postings)
+
+    def plan(self, term):
+        """(จำนวนแถวโดยประมาณ, โหมด, posting sets) ของคำค้นหนึ่งคำ
+        คำไทยที่ยาวกว่า THAI_GRAM ต้องมีทุกชิ้น ("all") นอกนั้นเป็น prefix ของ key ใดก็ได้ ("any")
+        """
+        if is_thai(term) and len(term) > THAI_GRAM:
+            postings = [self.postings.get(term[i:i + THAI_GRAM], set()) for i in range(len(term) - THAI_GRAM + 1)]
+            return min(len(p) for p in postings), "all", postings
+        if len(term) < MIN_PREFIX:
+            postings = [self.postings[term]] if term in self.postings else []
+        else:
+            postings = [self.postings[k] for k in self.prefix_keys(term)]
+        return sum(len(p) for p in postings), "any", postings
+
+    def search(self, query, lookup):
+        """set ของ BookID ที่ตรงกับทุกคำใน query (ห้ามแก้ไข set ที่ได้)
+        เริ่มจากคำที่ตรงน้อยที่สุด แล้วกรองผลลัพธ์ที่เหลือด้วยคำถัดไป
+        lookup(book_id) คืนแถวหนังสือ ใช้ยืนยันคำไทยที่ยาวกว่า THAI_GRAM (ชิ้นครบแต่อาจไม่ติดกัน)
+        """
+        terms = set(search_terms(query))
+        if not terms:
+            return set()
+        result = None
+        for size, mode, postings in sorted((self.plan(t) for t in terms), key=lambda p: p[0]):
+            if not size:
+                return set()
+            if result is None:
+                if len(postings) == 1:
+                    result = postings[0]
+                elif mode == "all":
+                    result = set.intersection(*sorted(postings, key=len))
+                else:
+                    result = set().union(*postings)
+            elif mode == "all" or len(postings) == 1:
+                for p in postings:
+                    result = result & p
+            else:
+                result = {b for b in result if any(b in p for p in postings)}
+            if not result:
+                return set()
+        long_thai = [t for t in terms if is_thai(t) and len(t) > THAI_GRAM]
+        if long_thai:
+            def matches(book_id):
+                r = lookup(book_id)
+                text = (r[1] + " " + r[2]).casefold() if r else ""
+                return all(t in text for t in long_thai)
+            result = {book_id for book_id in result if matches(book_id)}
+        return result
+
+
+def book_search_index():
+    """SearchIndex ของตาราง books สร้างครั้งแรกที่ค้นหา แล้วผูกเป็น listener ให้ปรับตามการแก้ไข"""
+    table = repo.table("books.txt")
+    rows = table.rows()
+    for listener in table.listeners:
+        if isinstance(listener, SearchIndex):
+            return listener
+    index = SearchIndex()
+    for r in rows:
+        index.change(None, r)
+    index.sorted_keys = sorted(index.postings)
+    index.added = set()
+    table.listeners.append(index)
+    return index
+
+
+@timed("op.search_books")
+def search_books(query, available_only=False, limit=None):
+    """ค้นหนังสือจากชื่อเรื่อง/ผู้แต่ง คืนแถวหนังสือเรียงตาม BookID
+    คำภาษาอังกฤษ/ตัวเลขตรงแบบ prefix ของคำ ภาษาไทยตรงแบบข้อความย่อย ทุกคำต้องตรง
+    available_only=True คืนเฉพาะเล่มที่ยังมีเล่มว่าง
+    """
+    index = book_search_index()
+    ids = index.search(query, lambda book_id: repo.get("books.txt", book_id))
+    max_id = repo.table("books.txt").next_id() - 1
+    if limit is not None and limit * max_id < len(ids) * len(ids):
+        # ผลลัพธ์หนาแน่นเมื่อเทียบกับจำนวนที่ต้องแสดง: ไล่ BookID 1, 2, 3, ... แล้วหยุดเมื่อครบ
+        # ถูกกว่าการเรียง ids ทั้งหมด (คาดว่าต้องไล่ประมาณ limit * max_id / len(ids) รหัส)
+        ordered = (b for b in map(str, range(1, max_id + 1)) if b in ids)
+    else:
+        ordered = sorted(ids, key=lambda b: (id_number([b]), b))
+    results = []
+    for book_id in ordered:
+        book = repo.get("books.txt", book_id)
+        if book is None or (available_only and get_available_copies(book) <= 0):
             continue
-    return "ว่าง"
+        results.append(book)
+        if limit is not None and len(results) >= limit:
+            break
+    return results
+
+
+class DueIndex:
+    """index วันที่ต้องคืนของรายการยืมที่ยังคืนไม่ครบ (มี borrow_items ที่ยังไม่คืนอย่างน้อยหนึ่งเล่ม ดู is_borrowed_item)
+    entries คือ list ของ (ordinal วันที่ต้องคืน, รหัสเป็นตัวเลข, BorrowID) เรียงจากวันที่ต้องคืนเก่าสุด
+    by_member แยกแบบเดียวกันตาม MemberID ฟังสองตารางแบบ MemberLoans: borrows_listener (วันที่ต้องคืน/สมาชิก)
+    และ items_listener (จำนวนเล่มที่ยังไม่คืนต่อ BorrowID) จึงไม่ขึ้นกับ BorrowStatus ของหัวรายการ
+    ค้นช่วงวันที่ด้วย bisect: O(log n + k) รายการที่วันที่ต้องคืนผิดรูปแบบจะไม่อยู่ใน index
+    """
+
+    def __init__(self):
+        self.borrows = {}     # BorrowID -> ((ordinal วันที่ต้องคืน, รหัสเป็นตัวเลข, BorrowID), MemberID)
+        self.open_count = {}  # BorrowID -> จำนวนเล่มที่ยังไม่คืน
+        self.reset_lists()
+        self.borrows_listener = Listener(self.reset_borrows, self.change_borrow)
+        self.items_listener = Listener(self.reset_items, self.change_item)
+
+    def reset_lists(self):
+        self.entries = []
+        self.by_member = {}
+        # list ที่ต่อท้ายแบบไม่เรียงไว้ (None = entries, นอกนั้นเป็น MemberID) เรียงตอนใช้ครั้งถัดไป
+        self.dirty = set()
+
+    def reset_borrows(self):
+        self.borrows = {}
+        self.reset_lists()
+
+    def reset_items(self):
+        self.open_count = {}
+        self.reset_lists()
+
+    def entry_of(self, borrow_id):
+        """(entry, MemberID) ของรายการยืมที่ควรอยู่ใน index หรือ None"""
+        return self.borrows.get(borrow_id) if self.open_count.get(borrow_id) else None
+
+    def change_borrow(self, old, new):
+        for r, sign in ((old, -1), (new, 1)):
+            if r is None or not is_active(r) or len(r) < 4:
+                continue
+            borrow_id = r[0].strip()
+            before = self.entry_of(borrow_id)
+            if sign < 0:
+                self.borrows.pop(borrow_id, None)
+            else:
+                due = date_ordinal(r[3].strip())
+                if due is not None:
+                    self.borrows[borrow_id] = (due, id_number(r), borrow_id), r[1].strip()
+            self.move(before, self.entry_of(borrow_id))
+
+    def change_item(self, old, new):
+        for bi, sign in ((old, -1), (new, 1)):
+            if bi is None or not is_borrowed_item(bi):
+                continue
+            borrow_id = bi[1].strip()
+            before = self.entry_of(borrow_id)
+            count = self.open_count.get(borrow_id, 0) + sign
+            if count > 0:
+                self.open_count[borrow_id] = count
+            else:
+                self.open_count.pop(borrow_id, None)
+            self.move(before, self.entry_of(borrow_id))
+
+    def sorted_list(self, member_id=None):
+        entries = self.entries if member_id is None else self.by_member.get(member_id, [])
+        if member_id in self.dirty:
+            entries.sort()
+            self.dirty.discard(member_id)
+        return entries
+
+    def move(self, old, new):
+        """ย้าย entry ของรายการยืมหนึ่งรายการใน entries/by_member จาก old เป็น new (None = ไม่อยู่ใน index)"""
+        if old == new:
+            return
+        if old is not None:
+            entry, member_id = old
+            for key in (None, member_id):
+                entries = self.sorted_list(key)
+                i = bisect.bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+            if not self.by_member.get(member_id):
+                self.by_member.pop(member_id, None)
+        if new is not None:
+            entry, member_id = new
+            for key in (None, member_id):
+                entries = self.entries if key is None else self.by_member.setdefault(key, [])
+                # ส่วนใหญ่รายการใหม่ครบกำหนดช้ากว่ารายการเดิมทั้งหมด ต่อท้ายได้เลยโดยไม่ต้องเรียงใหม่
+                if entries and entry < entries[-1]:
+                    self.dirty.add(key)
+                entries.append(entry)
+
+    def earliest(self, member_id=None):
+        """ordinal วันที่ต้องคืนที่เร็วที่สุด (ของสมาชิก member_id) หรือ None ถ้าไม่มีรายการค้าง"""
+        entries = self.sorted_list(None if member_id is None else str(member_id).strip())
+        return entries[0][0] if entries else None
+
+    def between(self, start=None, end=None, member_id=None):
+        """รายการที่วันที่ต้องคืนอยู่ในช่วง start..end (ordinal รวมทั้งสองข้าง None = ไม่จำกัด)"""
+        entries = self.sorted_list(None if member_id is None else str(member_id).strip())
+        lo = 0 if start is None else bisect.bisect_left(entries, (start,))
+        hi = len(entries) if end is None else bisect.bisect_left(entries, (end + 1,))
+        return entries[lo:hi]
+
+    def overdue(self, as_of, member_id=None):
+        """รายการที่เกินกำหนด ณ วันที่ as_of (วันที่ต้องคืนก่อน as_of)"""
+        return self.between(None, as_of - 1, member_id)
+
+    def due_within(self, days, today, member_id=None):
+        """รายการที่ยังไม่เกินกำหนดและครบกำหนดภายใน days วันนับจาก today"""
+        return self.between(today, today + days, member_id)
+
+
+def due_index():
+    """DueIndex ของ repo สร้างครั้งแรกที่ใช้ แล้วผูกเป็น listener ของ borrows และ borrow_items ให้ปรับตามการแก้ไข"""
+    borrows, items = repo.table("borrows.txt"), repo.table("borrow_items.txt")
+    borrow_rows, item_rows = borrows.rows(), items.rows()
+    for listener in borrows.listeners:
+        owner = getattr(listener.change, "__self__", None)
+        if isinstance(owner, DueIndex):
+            return owner
+    index = DueIndex()
+    for table, rows, listener in ((borrows, borrow_rows, index.borrows_listener),
+                                  (items, item_rows, index.items_listener)):
+        for r in rows:
+            listener.change(None, r)
+        table.listeners.append(listener)
+    return index
+
+
+def overdue_borrows(as_of=None, member_id=None):
+    """แถว borrows ที่เกินกำหนด ณ วันที่ as_of (ordinal ค่าเริ่มต้นวันนี้) เรียงจากที่ครบกำหนดนานที่สุด"""
+    as_of = as_of if as_of is not None else today_ordinal()
+    with repo.snapshot():
+        return [repo.get("borrows.txt", e[2]) for e in due_index().overdue(as_of, member_id)]
+
+
+def borrows_due_within(days, today=None, member_id=None):
+    """แถว borrows ที่ครบกำหนดภายใน days วันนับจาก today (ordinal ค่าเริ่มต้นวันนี้) เรียงตามวันที่ต้องคืน"""
+    today = today if today is not None else today_ordinal()
+    with repo.snapshot():
+        return [repo.get("borrows.txt", e[2]) for e in due_index().due_within(days, today, member_id)]
+
+
+# ------------ Listing (pagination) ------------
+# จำนวนแถวต่อหน้าของเมนูแสดงรายการ (0 = แสดงทั้งหมดในหน้าเดียว)
+PAGE_SIZE = int(os.environ.get("LIBRARY_PAGE_SIZE", "20"))
+
+def page_of(rows, key, size, after=None, reverse=False):
+    """หน้าหนึ่งของ rows (iterable ใดๆ ไม่ต้องเป็น list) เรียงตาม key(row) ต่อจาก cursor after
+    key ต้องไม่ซ้ำกันระหว่างแถว (ให้มีรหัสอยู่ท้าย tuple) ใช้ heap เลือกแค่ size+1 แถว ไม่เรียงทั้งตาราง
+    คืน (list แถวในหน้า, cursor ของหน้าถัดไป หรือ None ถ้าเป็นหน้าสุดท้าย)
+    """
+    if after is not None:
+        after = tuple(after)
+        rows = (r for r in rows if (key(r) < after if reverse else key(r) > after))
+    if not size:
+        page = sorted(rows, key=key, reverse=reverse)
+        return page, None
+    page = (heapq.nlargest if reverse else heapq.nsmallest)(size + 1, rows, key=key)
+    if len(page) <= size:
+        return page, None
+    return page[:size], key(page[size - 1])
+
+
+# ลำดับที่เลือกได้ของแต่ละรายการ: ชื่อ -> key(row) (รหัสอยู่ท้ายเสมอ cursor จึงไม่ซ้ำ)
+BOOK_SORTS = {
+    "id": lambda r: (id_number(r),),
+    "title": lambda r: (r[1].casefold(), id_number(r)),
+    "author": lambda r: (r[2].casefold(), id_number(r)),
+    "available": lambda r: (get_available_copies(r), id_number(r)),
+}
+MEMBER_SORTS = {
+    "id": lambda r: (id_number(r),),
+    "name": lambda r: (r[1].casefold(), id_number(r)),
+}
+# แถวของรายการยืมคือคู่ (borrow, borrow_items)
+BORROW_SORTS = {
+    "id": lambda p: (id_number(p[0]),),
+    "borrow_date": lambda p: (date_ordinal(p[0][2]) or 0, id_number(p[0])),
+    "return_date": lambda p: (date_ordinal(p[0][3]) or 0, id_number(p[0])),
+    "member": lambda p: (id_number([p[0][1]]), id_number(p[0])),
+}
+
+
+def book_rows(available_only=False, query=None):
+    """หนังสือที่ยังไม่ถูกลบแบบ generator กรองด้วยคำค้น (ผ่าน SearchIndex) และ/หรือเล่มว่าง"""
+    if query:
+        ids = book_search_index().search(query, lambda book_id: repo.get("books.txt", book_id))
+        rows = (r for r in (repo.get("books.txt", b) for b in ids) if r is not None)
+    else:
+        rows = repo.active("books.txt")
+    if available_only:
+        rows = (r for r in rows if get_available_copies(r) > 0)
+    return rows
+
+
+def member_rows():
+    return repo.active("members.txt")
+
+
+def borrow_rows(status=None, member_id=None, overdue_only=False, unreturned_only=False, due_within=None,
+                today=None):
+    """คู่ (borrow, borrow_items) แบบ generator
+    status = BorrowStatus ที่ต้องการ, member_id = เฉพาะสมาชิกนี้ (ใช้ index member)
+    unreturned_only = เฉพาะรายการที่ยังมีเล่มไม่คืน
+    overdue_only = เฉพาะรายการที่เลยวันที่ต้องคืนแล้ว ณ today (ordinal, ค่าเริ่มต้นวันนี้)
+    due_within = เฉพาะรายการที่ครบกำหนดภายในจำนวนวันนี้นับจาก today
+    สองตัวหลังใช้ DueIndex จึงไม่ต้องวนรายการยืมทั้งหมด
+    """
+    today = today if today is not None else today_ordinal()
+    if overdue_only:
+        borrows = overdue_borrows(today, member_id)
+    elif due_within is not None:
+        borrows = borrows_due_within(due_within, today, member_id)
+    elif member_id is not None:
+        borrows = repo.table("borrows.txt").group("member", member_id)
+    else:
+        borrows = None
+    if borrows is not None:
+        pairs = ((br, repo.items_of(br[0])) for br in borrows if br is not None)
+        if unreturned_only:
+            pairs = (p for p in pairs if any(is_borrowed_item(bi) for bi in p[1]))
+    else:
+        pairs = repo.borrows_with_items(unreturned_only=unreturned_only)
+    if status:
+        pairs = (p for p in pairs if len(p[0]) > 5 and p[0][5].strip() == status)
+    return pairs
+
+
+def browse(rows_for, render, sorts, sort="id", page_size=None, parse_filter=None):
+    """แสดงรายการทีละหน้า: rows_for(**filters) คืน iterable ของแถว, render(page) พิมพ์หนึ่งหน้า
+    ถ้ายังมีหน้าถัดไปจะถามคำสั่ง: Enter = หน้าถัดไป, s <ลำดับ> = เรียงใหม่, f <ตัวกรอง> = กรอง, q = กลับ
+    parse_filter(ข้อความ) คืน dict ของ filters หรือ None ถ้าเข้าใจไม่ได้
+    """
+    page_size = PAGE_SIZE if page_size is None else page_size
+    filters = {}
+    after = None
+    while True:
+        rows, next_after = page_of(rows_for(**filters), sorts[sort], page_size, after)
+        render(rows)
+        if next_after is None:
+            return
+        while True:
+            prompt = f"[Enter] หน้าถัดไป | s <{'/'.join(sorts)}> เรียงใหม่"
+            if parse_filter:
+                prompt += " | f <ตัวกรอง> กรอง"
+            cmd = input(prompt + " | q กลับ: ").strip()
+            if cmd.lower() == "q":
+                return
+            if not cmd:
+                after = next_after
+                break
+            name, _, arg = cmd.partition(" ")
+            if name == "s" and arg.strip() in sorts:
+                sort, after = arg.strip(), None
+                break
+            if name == "f" and parse_filter and parse_filter(arg.strip()) is not None:
+                filters, after = parse_filter(arg.strip()), None
+                break
+            print("✘ คำสั่งไม่ถูกต้อง")
+
 
 # ------------ CRUD Template ------------
+# การเขียนทุกครั้งอยู่ใน transaction เพื่อถือ WRITE_LOCK และเห็นข้อมูลล่าสุดของโปรเซสอื่นก่อนเลือกรหัส/ตำแหน่งแถว
+@timed("op.add_record")
 def add_record(filename, fields):
-    records = read_file(filename)
-    slot = find_free_slot(records)
-    new_id = str(get_next_id(records))
-    data = [new_id] + [str(x) for x in fields] + ["A"]
-    if slot is not None:
-        records[slot] = data
-    else:
-        records.append(data)
-    ok = write_file(filename, records)
-    if ok:
+    with repo.transaction() as txn:
+        new_id = repo.table(filename).insert(fields)
+    if txn.ok is not False:
         print("✔ บันทึกข้อมูลเรียบร้อย")
     return new_id
 
 
-def view_records(filename, headers, min_fields=0):
-    records = read_file(filename, min_fields=min_fields if min_fields > 0 else None)
-    print("\n" + "="*40)
-    print(" | ".join(headers))
-    print("="*40)
-    for r in records:
-        if r and r[-1] == "A":
+def view_records(filename, headers, min_fields=0, sorts=None, page_size=None):
+    def render(rows):
+        print("\n" + "="*40)
+        print(" | ".join(headers))
+        print("="*40)
+        for r in rows:
             # ไม่แสดงคอลัมน์ Status สุดท้าย
-            display_record = r[:-1]  # เอา status ออก
-            print(" | ".join(display_record))
-    print("="*40)
+            print(" | ".join(r[:-1]))
+        print("="*40)
+
+    browse(lambda: repo.active(filename), render, sorts or {"id": lambda r: (id_number(r),)}, page_size=page_size)
 
 
+@timed("op.update_record")
 def update_record(filename, record_id, new_fields):
-    records = read_file(filename)
-    for i, r in enumerate(records):
-        if r and r[0] == record_id and r[-1] == "A":
-            records[i] = [record_id] + [str(x) for x in new_fields] + ["A"]
-            write_file(filename, records)
-            print("✔ แก้ไขข้อมูลเรียบร้อย")
-            return
+    with repo.transaction():
+        found = repo.table(filename).replace(record_id, [record_id] + [str(x) for x in new_fields] + ["A"])
+    if found:
+        print("✔ แก้ไขข้อมูลเรียบร้อย")
+        return
     print("✘ ไม่พบข้อมูล")
 
 
+@timed("op.delete_record")
 def delete_record(filename, record_id):
-    records = read_file(filename)
-    for i, r in enumerate(records):
-        if r and r[0] == record_id and r[-1] == "A":
-            records[i][-1] = "D"
-            write_file(filename, records)
-            print("✔ ลบข้อมูลเรียบร้อย (Free-list)")
-            return
+    with repo.transaction():
+        table = repo.table(filename)
+        r = table.get(record_id)
+        if r is not None:
+            table.replace(record_id, with_status(r, "D"))
+    if r is not None:
+        print("✔ ลบข้อมูลเรียบร้อย (Free-list)")
+        return
     print("✘ ไม่พบข้อมูล")
 
+# ------------ Service API ------------
+# ฟังก์ชันกลุ่มนี้ไม่ใช้ input()/print() เรียกได้จากเมนู, batch.py หรือโค้ดอื่น
+# ทุกฟังก์ชันคืน dict ที่มี "ok" เสมอ ถ้าไม่สำเร็จจะมี "error" เป็นข้อความอธิบาย และจะไม่มีการเขียนข้อมูลใดๆ
+# ถ้าเรียกภายใน repo.transaction() ของผู้เรียก การเขียนจะรวมอยู่ใน transaction นั้น
+MAX_BOOKS_PER_BORROW = 3
+# เงื่อนไขการยืมต่อสมาชิก (0 = ไม่จำกัด/ไม่ตรวจ): จำนวนเล่มที่ยืมค้างได้พร้อมกัน,
+# ค่าปรับค้างสูงสุดที่ยังยืมได้ (บาท) และห้ามยืมเมื่อมีรายการเกินกำหนดที่ยังไม่คืน
+MAX_OPEN_ITEMS = int(os.environ.get("LIBRARY_MAX_OPEN_ITEMS", "3"))
+MAX_UNPAID_FINE = env_number("LIBRARY_MAX_UNPAID_FINE", "0")
+BLOCK_OVERDUE = os.environ.get("LIBRARY_BLOCK_OVERDUE", "0") not in ("0", "", "no", "false")
+
+
+def failure(error, **extra):
+    return {"ok": False, "error": error, **extra}
+
+
+def today_str():
+    return date.today().strftime(DATE_FORMAT)
+
+
+def member_state(member_id, today=None):
+    """สถานะการยืมของสมาชิก {"open_items", "unpaid_fine", "overdue"} จากตัวนับรายสมาชิก ไม่ต้อง join ตาราง"""
+    today = today if today is not None else today_ordinal()
+    open_items, unpaid_fine = repo.member_loans(member_id)
+    earliest = due_index().earliest(member_id)
+    return {"open_items": open_items, "unpaid_fine": unpaid_fine,
+            "overdue": earliest is not None and earliest < today}
+
+
+def loan_block(member_id, new_items, today=None):
+    """เหตุผลที่สมาชิกยืมเพิ่มอีก new_items เล่มไม่ได้ หรือ None ถ้ายืมได้ (ตรวจใน O(1))"""
+    state = member_state(member_id, today)
+    if MAX_OPEN_ITEMS and state["open_items"] + new_items > MAX_OPEN_ITEMS:
+        return f"สมาชิกยืมค้างอยู่ {state['open_items']} เล่ม (ยืมพร้อมกันได้ไม่เกิน {MAX_OPEN_ITEMS} เล่ม)"
+    if MAX_UNPAID_FINE and state["unpaid_fine"] > MAX_UNPAID_FINE:
+        return f"มีค่าปรับค้าง {state['unpaid_fine']:.2f} บาท (ยืมได้เมื่อไม่เกิน {MAX_UNPAID_FINE} บาท)"
+    if BLOCK_OVERDUE and state["overdue"]:
+        return "มีรายการยืมที่เกินกำหนดยังไม่คืน"
+    return None
+
+
+@timed("op.create_book")
+def create_book(title, author, total_copies):
+    """เพิ่มหนังสือ คืน {"ok", "book_id"}"""
+    try:
+        total_copies = int(total_copies)
+    except (TypeError, ValueError):
+        return failure("กรุณาใส่ตัวเลข")
+    if total_copies <= 0:
+        return failure("จำนวนเล่มต้องมากกว่า 0")
+    with repo.transaction() as txn:
+        book_id = repo.table("books.txt").insert([str(title).strip(), str(author).strip(), total_copies])
+    return {"ok": txn.ok is not False, "book_id": book_id}
+
+
+@timed("op.create_member")
+def create_member(name, phone):
+    """เพิ่มสมาชิก คืน {"ok", "member_id"}"""
+    with repo.transaction() as txn:
+        member_id = repo.table("members.txt").insert([str(name).strip(), str(phone).strip()])
+    return {"ok": txn.ok is not False, "member_id": member_id}
+
+
+@timed("op.create_borrow")
+def create_borrow(member_id, book_ids, borrow_date=None):
+    """ยืมหนังสือหลายเล่มในรายการเดียว (ไม่เกิน MAX_BOOKS_PER_BORROW เล่ม และผ่านเงื่อนไขของ loan_block)
+    คืน {"ok", "borrow_id", "return_date", "item_ids"}
+    """
+    member_id = str(member_id).strip()
+    # ต้องเป็น list ไม่อย่างนั้นสตริง "13" จะถูกวนทีละตัวอักษรเป็นเล่ม 1 และ 3
+    if not isinstance(book_ids, (list, tuple)):
+        return failure("book_ids ต้องเป็น list ของ BookID")
+    book_ids = [str(b).strip() for b in book_ids]
+    borrow_date = (borrow_date or today_str()).strip()
+    if not validate_date(borrow_date):
+        return failure("รูปแบบวันที่ไม่ถูกต้อง")
+    if not book_ids:
+        return failure("ไม่มีหนังสือที่เลือก")
+    if len(book_ids) > MAX_BOOKS_PER_BORROW:
+        return failure(f"ยืมได้ไม่เกิน {MAX_BOOKS_PER_BORROW} เล่มต่อครั้ง")
+    return_date = due_date(borrow_date)
+
+    # ตรวจสอบภายใน transaction (ถือ WRITE_LOCK) เล่มว่างที่เห็นจึงไม่ถูกโปรเซสอื่นยืมตัดหน้า
+    # หัวรายการและทุกเล่มบันทึกพร้อมกันใน transaction เดียว
+    with repo.transaction() as txn:
+        if not check_member_exists(member_id):
+            return failure("ไม่พบสมาชิกในระบบ")
+        blocked = loan_block(member_id, len(book_ids), date_ordinal(borrow_date))
+        if blocked:
+            return failure(blocked)
+        for book_id in set(book_ids):
+            book = repo.get("books.txt", book_id)
+            if not book:
+                return failure("ไม่พบหนังสือในระบบ", book_id=book_id)
+            if get_available_copies(book) < book_ids.count(book_id):
+                return failure("หนังสือเล่มนี้ไม่มีเล่มว่าง", book_id=book_id)
+        borrow_id = repo.table("borrows.txt").insert([member_id, borrow_date, return_date, "0", "กำลังยืม"])
+        items_table = repo.table("borrow_items.txt")
+        item_ids = [items_table.insert([borrow_id, book_id, "กำลังยืม", "0"]) for book_id in book_ids]
+    if txn.ok is False:
+        return failure("บันทึกข้อมูลไม่สำเร็จ")
+    return {"ok": True, "borrow_id": borrow_id, "return_date": return_date, "item_ids": item_ids}
+
+
+@timed("op.return_items")
+def return_items(borrow_id, book_ids, actual_return_date=None):
+    """คืนหนังสือตาม BookID ของรายการยืม พร้อมคำนวณค่าปรับ
+    คืน {"ok", "borrow_id", "items": [{"item_id", "book_id", "fine"}], "total_fine", "status"}
+    """
+    borrow_id = str(borrow_id).strip()
+    actual_return_date = (actual_return_date or today_str()).strip()
+    if not validate_date(actual_return_date):
+        return failure("รูปแบบวันที่ไม่ถูกต้อง")
+    if not isinstance(book_ids, (list, tuple)):
+        return failure("book_ids ต้องเป็น list ของ BookID")
+    if not book_ids:
+        return failure("ไม่มีรายการที่จะคืน")
+
+    with repo.transaction() as txn:
+        borrow = repo.get("borrows.txt", borrow_id)
+        if not borrow:
+            return failure("ไม่พบรหัสการยืม")
+        borrowed = repo.borrowed_items_of(borrow_id)
+        chosen = []
+        for book_id in (str(b).strip() for b in book_ids):
+            bi = next((bi for bi in borrowed if bi[2] == book_id and bi not in chosen), None)
+            if bi is None:
+                return failure("ไม่พบ BookID หรือคืนไปแล้ว", book_id=book_id)
+            chosen.append(bi)
+
+        # ค่าปรับคิดจากวันที่ต้องคืนของรายการยืม (br[3]) เทียบกับวันที่คืนจริง
+        fine = calculate_fine(borrow[2], borrow[3], actual_return_date)
+        items_table = repo.table("borrow_items.txt")
+        for bi in chosen:
+            bi = list(bi)
+            ensure_min_len(bi, 6)
+            bi[3] = "คืนแล้ว"
+            bi[4] = str(fine)
+            items_table.replace(bi[0], bi)
+
+        # เช็กว่าคืนครบทุกเล่มแล้วหรือยัง
+        br = list(borrow)
+        ensure_min_len(br, 6)
+        br[5] = "กำลังยืม" if repo.borrowed_items_of(borrow_id) else "คืนแล้ว"
+        # เขียนแถวยืมเฉพาะเมื่อเปลี่ยนจริง คืนบางเล่มจึงไม่เพิ่ม op U และรายการใน journal โดยเปล่าประโยชน์
+        if br != list(borrow):
+            repo.table("borrows.txt").replace(borrow_id, br)
+    if txn.ok is False:
+        return failure("บันทึกข้อมูลไม่สำเร็จ")
+    return {"ok": True, "borrow_id": borrow_id, "status": br[5], "total_fine": fine * len(chosen),
+            "items": [{"item_id": bi[0], "book_id": bi[2], "fine": fine} for bi in chosen]}
+
+
+@timed("op.delete_borrow")
+def delete_borrow(borrow_id):
+    """ลบรายการยืมและ borrow_items ที่เกี่ยวข้อง (หนังสือที่ยังยืมอยู่ถือว่าคืนกลับเข้าคลัง)"""
+    borrow_id = str(borrow_id).strip()
+    with repo.transaction() as txn:
+        borrow = repo.get("borrows.txt", borrow_id)
+        if not borrow:
+            return failure("ไม่พบข้อมูล")
+        items_table = repo.table("borrow_items.txt")
+        for bi in repo.items_of(borrow_id):
+            items_table.replace(bi[0], with_status(bi, "D"))
+        repo.table("borrows.txt").replace(borrow_id, with_status(borrow, "D"))
+    if txn.ok is False:
+        return failure("บันทึกข้อมูลไม่สำเร็จ")
+    return {"ok": True, "borrow_id": borrow_id}
+
 # ------------ Specific Functions ------------
 def add_book():
     title = input("ชื่อหนังสือ: ").strip()
@@ -185,59 +2140,78 @@ def add_book():
             break
         except ValueError:
             print("✘ กรุณาใส่ตัวเลข")
-    add_record("books.txt", [title, author, total_copies])
+    if create_book(title, author, total_copies)["ok"]:
+        print("✔ บันทึกข้อมูลเรียบร้อย")
 
 
-def view_books():
-    """แสดงรายการหนังสือพร้อมสถานะว่าง/ถูกยืม"""
-    records = read_file("books.txt", min_fields=5)
-    print("\n" + "="*80)
-    print(" | ".join(["BookID", "Title", "Author", "Total Copies", "Available"]))
-    print("="*80)
-    for r in records:
-        if r and r[-1] == "A":
+def view_books(page_size=None):
+    """แสดงรายการหนังสือพร้อมสถานะว่าง/ถูกยืม ทีละหน้า
+    ตัวกรอง: f available = เฉพาะที่มีเล่มว่าง, f <คำค้น> = ค้นจากชื่อเรื่อง/ผู้แต่ง, f เฉยๆ = ล้างตัวกรอง
+    """
+    def render(rows):
+        print("\n" + "="*80)
+        print(" | ".join(["BookID", "Title", "Author", "Total Copies", "Available"]))
+        print("="*80)
+        for r in rows:
             total_copies = int(r[3]) if r[3].isdigit() else 0
-            borrowed_count = get_borrowed_count(r[0])
-            available_copies = total_copies - borrowed_count
+            available_copies = get_available_copies(r)
             print(" | ".join([r[0], r[1], r[2], str(total_copies), str(available_copies)]))
-    print("="*80)
+        print("="*80)
+
+    def parse_filter(text):
+        if not text:
+            return {}
+        if text == "available":
+            return {"available_only": True}
+        return {"query": text}
+
+    browse(book_rows, render, BOOK_SORTS, page_size=page_size, parse_filter=parse_filter)
+
+
+def find_books(limit=50):
+    """ค้นหนังสือจากชื่อเรื่องหรือผู้แต่ง (แสดงไม่เกิน limit รายการ)"""
+    query = input("คำค้น (ชื่อหนังสือ/ผู้แต่ง): ").strip()
+    available_only = input("เฉพาะเล่มที่มีเล่มว่าง? (y/n): ").strip().lower() == "y"
+    found = search_books(query, available_only=available_only, limit=limit)
+    if not found:
+        print("ไม่พบหนังสือที่ตรงกับคำค้น")
+        return
+    rows = [[r[0], r[1], r[2], r[3], str(get_available_copies(r))] for r in found]
+    print(tabulate(rows, headers=["BookID","ชื่อหนังสือ","ผู้แต่ง","จำนวนเล่ม","เล่มว่าง"], tablefmt="grid"))
+    if len(found) >= limit:
+        print(f"แสดง {limit} รายการแรก ลองใช้คำค้นที่เจาะจงขึ้น")
 
 
 def add_member():
     name = input("ชื่อสมาชิก: ").strip()
     phone = input("เบอร์โทร: ").strip()
-    add_record("members.txt", [name, phone])
+    if create_member(name, phone)["ok"]:
+        print("✔ บันทึกข้อมูลเรียบร้อย")
 
 
-def view_members():
-    view_records("members.txt", ["MemberID", "Name", "Phone"], min_fields=4)
+def view_members(page_size=None):
+    view_records("members.txt", ["MemberID", "Name", "Phone"], min_fields=4, sorts=MEMBER_SORTS, page_size=page_size)
 
 # ยืมหลายเล่ม (แก้ไขให้รองรับหนังสือหลายเล่มและจำกัดการยืมไม่เกิน 3 เล่ม)
 def check_book_availability(book_id):
     """เช็คว่าหนังสือมีเล่มว่างหรือไม่"""
-    books = read_file("books.txt", min_fields=5)
-    book = next((b for b in books if b and b[0].strip() == book_id and b[-1] == "A"), None)
+    book = repo.get("books.txt", book_id)
     if not book:
         return False
-    
-    total_copies = int(book[3]) if book[3].isdigit() else 0
-    borrowed_count = get_borrowed_count(book_id)
-    return borrowed_count < total_copies
+    return get_available_copies(book) > 0
 
 
 def check_member_exists(member_id):
-    members = read_file("members.txt", min_fields=4)
-    return any(m and m[0].strip() == member_id and m[-1] == "A" for m in members)
+    return repo.get("members.txt", member_id) is not None
 
 
 def check_book_exists(book_id):
-    books = read_file("books.txt", min_fields=5)
-    return any(b and b[0].strip() == book_id and b[-1] == "A" for b in books)
+    return repo.get("books.txt", book_id) is not None
 
 
 def show_members_list():
     """แสดงรายการสมาชิกทั้งหมด"""
-    records = read_file("members.txt", min_fields=4)
+    records = repo.rows("members.txt")
     active_members = []
     
     for r in records:
@@ -252,14 +2226,12 @@ def show_members_list():
 
 def show_available_books():
     """แสดงรายการหนังสือที่มีเล่มว่างให้ยืม"""
-    records = read_file("books.txt", min_fields=5)
+    records = repo.rows("books.txt")
     available_books = []
     
     for r in records:
         if r and r[-1] == "A":
-            total_copies = int(r[3]) if r[3].isdigit() else 0
-            borrowed_count = get_borrowed_count(r[0])
-            available_copies = total_copies - borrowed_count
+            available_copies = get_available_copies(r)
             if available_copies > 0:
                 available_books.append([r[0], r[1], r[2], str(available_copies)])
     
@@ -277,19 +2249,28 @@ def add_borrow():
     if not check_member_exists(member_id):
         print("✘ ไม่พบสมาชิกในระบบ")
         return
+    blocked = loan_block(member_id, 1)
+    if blocked:
+        print(f"✘ {blocked}")
+        return
+    # จำนวนที่ยืมได้ในครั้งนี้: ไม่เกินต่อครั้ง และรวมกับที่ยืมค้างอยู่แล้วไม่เกิน MAX_OPEN_ITEMS
+    limit, reason = MAX_BOOKS_PER_BORROW, f"จำกัด {MAX_BOOKS_PER_BORROW} เล่มต่อครั้ง"
+    open_items = repo.member_loans(member_id)[0]
+    if MAX_OPEN_ITEMS and MAX_OPEN_ITEMS - open_items < limit:
+        limit, reason = MAX_OPEN_ITEMS - open_items, f"ยืมค้างอยู่ {open_items} เล่ม จำกัด {MAX_OPEN_ITEMS} เล่มต่อคน"
 
     # แสดงรายการหนังสือที่มีให้ยืม
     show_available_books()
     
     print("\nกรอก BookID ที่ต้องการยืม (พิมพ์ 'done' เมื่อเสร็จ หรือ 'cancel' เพื่อยกเลิก):")
-    print("หมายเหตุ: สามารถยืมได้ไม่เกิน 3 เล่ม")
+    print(f"หมายเหตุ: สามารถยืมได้ไม่เกิน {limit} เล่ม")
     selected_books = []
     while True:
-        if len(selected_books) >= 3:
-            print("⚠️ ยืมครบ 3 เล่มแล้ว (จำกัด 3 เล่มต่อครั้ง)")
+        if len(selected_books) >= limit:
+            print(f"⚠️ ยืมครบ {limit} เล่มแล้ว ({reason})")
             break
             
-        book_id = input(f"BookID ({len(selected_books)+1}/3): ").strip()
+        book_id = input(f"BookID ({len(selected_books)+1}/{limit}): ").strip()
         if book_id.lower() == "done":
             break
         if book_id.lower() == "cancel":
@@ -298,18 +2279,14 @@ def add_borrow():
         if not check_book_exists(book_id):
             print("✘ ไม่พบหนังสือในระบบ")
             continue
-        if not check_book_availability(book_id):
+        # นับเล่มที่เลือกไปแล้วในรายการนี้ด้วย
+        available_copies = get_available_copies(repo.get("books.txt", book_id)) - selected_books.count(book_id)
+        if available_copies <= 0:
             print("✘ หนังสือเล่มนี้ไม่มีเล่มว่าง")
             continue
         
         # แสดงข้อมูลหนังสือและจำนวนที่ว่าง
-        books = read_file("books.txt", min_fields=5)
-        book = next((b for b in books if b and b[0].strip() == book_id and b[-1] == "A"), None)
-        if book:
-            total_copies = int(book[3]) if book[3].isdigit() else 0
-            borrowed_count = get_borrowed_count(book_id)
-            available_copies = total_copies - borrowed_count
-            print(f"✔ เพิ่มหนังสือ {get_book_title(book_id)} (เหลือ {available_copies-1} เล่ม)")
+        print(f"✔ เพิ่มหนังสือ {get_book_title(book_id)} (เหลือ {available_copies-1} เล่ม)")
         
         selected_books.append(book_id)
 
@@ -326,39 +2303,28 @@ def add_borrow():
         print("✘ รูปแบบวันที่ไม่ถูกต้อง")
         return
 
-    borrow_dt = datetime.strptime(borrow_date, "%d/%m/%Y")
-    return_dt = borrow_dt + timedelta(days=7)
-    return_date = return_dt.strftime("%d/%m/%Y")
-    print(f"📅 วันที่ต้องคืน: {return_date}")
-
-    # บันทึกการยืมจริง
-    borrow_id = add_record("borrows.txt", [member_id, borrow_date, return_date, "0", "กำลังยืม"])
-    for book_id in selected_books:
-        add_record("borrow_items.txt", [borrow_id, book_id, "กำลังยืม", "0"])
+    result = create_borrow(member_id, selected_books, borrow_date)
+    if not result["ok"]:
+        print(f"✘ {result['error']}")
+        return
+    print(f"📅 วันที่ต้องคืน: {result['return_date']}")
     print("✔ บันทึกการยืมเรียบร้อย")
 
 
 def show_active_borrows():
     """แสดงรายการยืมที่ยังไม่คืนครบ"""
-    borrows = read_file("borrows.txt", min_fields=7)
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
     active_borrows = []
     
-    for br in borrows:
-        if not br or br[-1] != "A":
-            continue
-        # เช็คว่ามีหนังสือที่ยังไม่คืนหรือไม่
-        has_unreturned = any(bi and len(bi) >= 6 and bi[1] == br[0] and bi[3].strip() == "กำลังยืม" and bi[-1] == "A" for bi in borrow_items)
-        if has_unreturned:
+    for br, items in repo.borrows_with_items(unreturned_only=True):
+        # หนังสือที่ยังไม่คืนของรายการนี้
+        unreturned = [bi for bi in items if is_borrowed_item(bi)]
+        if unreturned:
             member_name = get_member_name(br[1])
             borrow_date = br[2]
             return_date = br[3]
             
             # หาชื่อหนังสือที่ยังยืมอยู่
-            book_titles = []
-            for bi in borrow_items:
-                if bi and len(bi) >= 6 and bi[1] == br[0] and bi[3].strip() == "กำลังยืม" and bi[-1] == "A":
-                    book_titles.append(get_book_title(bi[2]))
+            book_titles = [get_book_title(bi[2]) for bi in unreturned]
             books_str = ", ".join(book_titles)
             
             active_borrows.append([br[0], member_name, books_str, borrow_date, return_date])
@@ -373,27 +2339,20 @@ def show_active_borrows():
 
 def delete_borrow_record(borrow_id):
     """ลบรายการยืมและ borrow_items ที่เกี่ยวข้อง"""
-    # ลบ borrow_items ที่เกี่ยวข้องก่อน
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
-    for i, bi in enumerate(borrow_items):
-        if bi and bi[1] == borrow_id and bi[-1] == "A":
-            borrow_items[i][-1] = "D"  # ทำเครื่องหมายลบ
-    write_file("borrow_items.txt", borrow_items)
-    
-    # ลบรายการยืมหลัก
-    delete_record("borrows.txt", borrow_id)
+    result = delete_borrow(borrow_id)
+    if not result["ok"]:
+        print(f"✘ {result['error']}")
+        return
     print("✔ ลบรายการยืมและคืนหนังสือทั้งหมดในรายการนี้เรียบร้อย")
 
 def show_borrowed_books(borrow_id):
     """แสดงรายการหนังสือที่กำลังยืมอยู่ในรายการยืมนี้"""
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
     borrowed_books = []
     
-    for bi in borrow_items:
-        if bi and len(bi) >= 6 and bi[1] == borrow_id and bi[3].strip() == "กำลังยืม" and bi[-1] == "A":
-            book_id = bi[2]
-            book_title = get_book_title(book_id)
-            borrowed_books.append([book_id, book_title])
+    for bi in repo.borrowed_items_of(borrow_id):
+        book_id = bi[2]
+        book_title = get_book_title(book_id)
+        borrowed_books.append([book_id, book_title])
     
     if borrowed_books:
         print(f"\n📖 หนังสือที่กำลังยืมในรายการ {borrow_id}:")
@@ -409,10 +2368,7 @@ def return_book():
         return
     
     borrow_id = input("\nรหัสการยืม: ").strip()
-    borrows = read_file("borrows.txt", min_fields=7)
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
-
-    borrow = next((br for br in borrows if br and br[0] == borrow_id and br[-1] == "A"), None)
+    borrow = repo.get("borrows.txt", borrow_id)
     if not borrow:
         print("✘ ไม่พบรหัสการยืม")
         return
@@ -421,24 +2377,21 @@ def return_book():
     if not show_borrowed_books(borrow_id):
         return
 
-    items_to_return = []
+    books_to_return = []
     print("\nกรอก BookID ที่ต้องการคืน (พิมพ์ 'done' เมื่อเสร็จ):")
     while True:
         book_id = input("BookID: ").strip()
         if book_id.lower() == "done":
             break
-        found = False
-        for i, bi in enumerate(borrow_items):
-            # bi: [item_id, borrow_id, book_id, status, fine, "A"]
-            if bi and len(bi) >= 6 and bi[1] == borrow_id and bi[2] == book_id and bi[3].strip() == "กำลังยืม":
-                items_to_return.append(i)
-                found = True
-                print(f"✔ เพิ่ม {get_book_title(book_id)} ลงรายการคืน")
-                break
-        if not found:
+        # bi: [item_id, borrow_id, book_id, status, fine, "A"]
+        borrowed = sum(1 for bi in repo.borrowed_items_of(borrow_id) if bi[2] == book_id)
+        if borrowed > books_to_return.count(book_id):
+            books_to_return.append(book_id)
+            print(f"✔ เพิ่ม {get_book_title(book_id)} ลงรายการคืน")
+        else:
             print("✘ ไม่พบ BookID หรือคืนไปแล้ว")
     
-    if not items_to_return:
+    if not books_to_return:
         print("✘ ไม่มีรายการที่จะคืน")
         return
 
@@ -447,191 +2400,622 @@ def return_book():
         print("✘ รูปแบบวันที่ไม่ถูกต้อง")
         return
 
-    # คืนหนังสือ + คำนวณค่าปรับ โดยใช้วันที่จาก borrow (br[2]=borrow_date, br[3]=return_date)
-    for i in items_to_return:
-        bi = borrow_items[i]
-        ensure_min_len(bi, 6)
-        fine = calculate_fine(borrow[2], borrow[3], actual_return_date)
-        borrow_items[i][3] = "คืนแล้ว"
-        borrow_items[i][4] = str(fine)
+    result = return_items(borrow_id, books_to_return, actual_return_date)
+    if not result["ok"]:
+        print(f"✘ {result['error']}")
+        return
+    print("✔ คืนหนังสือเรียบร้อย")
 
-    write_file("borrow_items.txt", borrow_items)
 
-    # เช็กว่าคืนครบทุกเล่มแล้วหรือยัง
-    still_borrowed = any(bi and len(bi) >= 6 and bi[1] == borrow_id and bi[3].strip() == "กำลังยืม" and bi[-1] == "A" for bi in borrow_items)
-    for i, br in enumerate(borrows):
-        if br and br[0] == borrow_id:
-            ensure_min_len(br, 6)
-            borrows[i][5] = "กำลังยืม" if still_borrowed else "คืนแล้ว"
-            break
-    write_file("borrows.txt", borrows)
+def view_borrows(page_size=None):
+    """แสดงรายการยืมทีละหน้า
+    ตัวกรอง: f active = ยังคืนไม่ครบ, f overdue = เกินกำหนด, f due <N> = ครบกำหนดภายใน N วัน,
+    f member <MemberID>, f status <สถานะ>, f เฉยๆ = ล้างตัวกรอง
+    """
+    def render(pairs):
+        table = []
+        for br, items in pairs:
+            member_name = get_member_name(br[1])
+            borrow_date = br[2]
+            return_date = br[3]
+            status = br[5] if len(br) > 5 else ""
+            # หา titles ที่ยังสถานะกำลังยืมของ borrow นี้
+            titles = [get_book_title(bi[2]) for bi in items if is_borrowed_item(bi)]
+            titles_str = ", ".join(titles) if titles else "-"
+            # คำนวนค่าปรับรวมของรายการยืมนี้ (จาก borrow_items)
+            fine_sum = sum(parse_fine(bi[4]) for bi in items)
+            table.append([br[0], member_name, titles_str, borrow_date, return_date, status, f"{fine_sum:.2f}"])
+
+        if table:
+            print(tabulate(table, headers=["BorrowID","Member","Books(กำลังยืม)","BorrowDate","ReturnDate","Status","TotalFine"], tablefmt="grid"))
+        else:
+            print("ไม่มีรายการการยืม")
+
+    def parse_filter(text):
+        name, _, arg = text.partition(" ")
+        if not text:
+            return {}
+        if name == "overdue":
+            return {"overdue_only": True}
+        if name == "active":
+            return {"unreturned_only": True}
+        if name == "due" and arg.strip().isdigit():
+            return {"due_within": int(arg)}
+        if name == "member" and arg.strip():
+            return {"member_id": arg.strip()}
+        if name == "status" and arg.strip():
+            return {"status": arg.strip()}
+        return None
+
+    browse(borrow_rows, render, BORROW_SORTS, page_size=page_size, parse_filter=parse_filter)
 
-    print("✔ คืนหนังสือเรียบร้อย")
+# ------------ Enhanced Report ------------
+def parse_fine(value):
+    """แปลงค่าปรับจากข้อความเป็นตัวเลข (ค่าที่ไม่ใช่ตัวเลขนับเป็น 0)"""
+    return float(value) if str(value).replace('.', '', 1).isdigit() else 0
 
 
-def view_borrows():
-    borrows = read_file("borrows.txt", min_fields=7)
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
-    members = read_file("members.txt", min_fields=4)
-    books = read_file("books.txt", min_fields=5)  # แก้ไขจาก 4 เป็น 5
+# จำนวนวันของอันดับหนังสือยอดนิยมช่วงล่าสุดในรายงาน
+POPULAR_DAYS = int(os.environ.get("LIBRARY_POPULAR_DAYS", "30"))
 
-    table = []
-    for br in borrows:
-        if not br or br[-1] != "A":
-            continue
-        member_name = get_member_name(br[1])
-        borrow_date = br[2]
-        return_date = br[3]
-        status = br[5] if len(br) > 5 else ""
-        # หา titles ที่ยังสถานะกำลังยืมของ borrow นี้
-        titles = []
-        for bi in borrow_items:
-            if bi and len(bi) >= 6 and bi[1] == br[0] and bi[3].strip() == "กำลังยืม" and bi[-1] == "A":
-                titles.append(get_book_title(bi[2]))
-        titles_str = ", ".join(titles) if titles else "-"
-        # คำนวนค่าปรับรวมของรายการยืมนี้ (จาก borrow_items)
-        fine_sum = 0.0
-        for bi in borrow_items:
-            if bi and bi[-1] == "A" and bi[1] == br[0]:
-                try:
-                    fine_sum += float(bi[4]) if str(bi[4]).replace('.', '', 1).isdigit() else 0
-                except Exception:
-                    continue
-        table.append([br[0], member_name, titles_str, borrow_date, return_date, status, f"{fine_sum:.2f}"])
 
-    if table:
-        print(tabulate(table, headers=["BorrowID","Member","Books(กำลังยืม)","BorrowDate","ReturnDate","Status","TotalFine"], tablefmt="grid"))
-    else:
-        print("ไม่มีรายการการยืม")
+class ReportAggregator:
+    """สะสมข้อมูลทุกส่วนของรายงานจากการวน borrow_items รอบเดียว ผลย่อยหลายชุดรวมกันได้ด้วย merge()
+    ไม่อ่านตาราง borrows ระหว่างวน: เก็บ BorrowID ของเล่มที่ยังไม่คืน/มีค่าปรับไว้ แล้วตรวจกับ borrows
+    ตอนสร้างรายงาน จึงแบ่งวนเป็นช่วงในหลายโปรเซสได้ (ดู parallel_report)
+    recent คือ BorrowID -> ordinal วันที่ยืม ของรายการยืมในช่วงของอันดับตามเวลา (ดู recent_borrows)
+    """
 
-# ------------ Enhanced Report ------------
-def generate_report():
-    books = read_file("books.txt", min_fields=5)  # แก้ไขจาก 4 เป็น 5
-    members = read_file("members.txt", min_fields=4)
-    borrows = read_file("borrows.txt", min_fields=7)
-    borrow_items = read_file("borrow_items.txt", min_fields=6)
+    def __init__(self, today=None, recent=None):
+        self.today = today if today is not None else today_ordinal()
+        self.recent = recent or {}
+        self.total_fine = 0.0
+        self.unpaid_fine = 0.0
+        self.currently_borrowed = 0
+        self.borrowed_rows = []  # (item_id, borrow_id, book_id)
+        self.fine_rows = []      # (item_id, borrow_id, book_id, ค่าปรับ, สถานะ)
+        self.book_counts = {}
+        self.dated_counts = {}   # (ordinal วันที่ยืม, book_id) -> จำนวนเล่ม
+
+    def feed(self, bi):
+        if not is_active(bi):
+            return
+        item_id, book_id = bi[0].strip(), bi[2]
+        self.book_counts[book_id] = self.book_counts.get(book_id, 0) + 1
+        day = self.recent.get(bi[1].strip())
+        if day is not None:
+            self.dated_counts[(day, book_id)] = self.dated_counts.get((day, book_id), 0) + 1
+        fine = parse_fine(bi[4])
+        self.total_fine += fine
+        status = bi[3].strip()
+        # ถ้าคืนแล้วแต่ยังมีค่าปรับ = ยังไม่ได้รับ
+        if status == "คืนแล้ว" and fine > 0:
+            self.unpaid_fine += fine
+        if status == "กำลังยืม":
+            self.currently_borrowed += 1
+            self.borrowed_rows.append((item_id, bi[1], book_id))
+        if fine > 0:
+            self.fine_rows.append((item_id, bi[1], book_id, fine, bi[3]))
+
+    def merge(self, other):
+        self.total_fine += other.total_fine
+        self.unpaid_fine += other.unpaid_fine
+        self.currently_borrowed += other.currently_borrowed
+        self.borrowed_rows.extend(other.borrowed_rows)
+        self.fine_rows.extend(other.fine_rows)
+        for book_id, count in other.book_counts.items():
+            self.book_counts[book_id] = self.book_counts.get(book_id, 0) + count
+        for key, count in other.dated_counts.items():
+            self.dated_counts[key] = self.dated_counts.get(key, 0) + count
+        return self
+
+    def item_rows(self, rows):
+        """borrowed_rows/fine_rows เรียงตาม ItemID แบบเดียวกับ LoanStats.item_rows (ตัด ItemID ออก)
+        ลำดับในไฟล์ขึ้นกับช่องที่ถูกลบแล้วใช้ซ้ำ รายงานจึงไม่ขึ้นกับว่าแบ่งวนกี่โปรเซส
+        """
+        return [r[1:] for r in sorted(rows, key=lambda r: (id_number(r), r[0]))]
+
+    def top(self, k=5, first=None, last=None):
+        """อันดับแบบเดียวกับ LoanStats.top: ทั้งหมด หรือเฉพาะวันที่ยืม first..last (ordinal) ที่อยู่ใน recent"""
+        if first is None:
+            counts = self.book_counts
+        else:
+            counts = {}
+            for (day, book_id), n in self.dated_counts.items():
+                if first <= day <= last:
+                    counts[book_id] = counts.get(book_id, 0) + n
+        return heapq.nsmallest(k, counts.items(), key=lambda x: (-x[1], id_number(x), x[0]))
+
+
+def report_windows(today):
+    """ช่วงวันที่ (first, last) ของอันดับ POPULAR_DAYS วันล่าสุด และของเดือนนี้"""
+    d = date.fromordinal(today)
+    month_start = date(d.year, d.month, 1)
+    next_month = date(d.year + d.month // 12, d.month % 12 + 1, 1)
+    return (today - POPULAR_DAYS + 1, today), (month_start.toordinal(), next_month.toordinal() - 1)
+
+
+def recent_borrows(today):
+    """BorrowID -> ordinal วันที่ยืม ของรายการยืมที่ยังไม่ถูกลบและยืมในช่วงของ report_windows"""
+    windows = report_windows(today)
+    recent = {}
+    for br in repo.active("borrows.txt"):
+        day = date_ordinal(br[2].strip())
+        if day is not None and any(first <= day <= last for first, last in windows):
+            recent[br[0].strip()] = day
+    return recent
+
+
+# ------------ Parallel report ------------
+# จำนวนโปรเซสของ generate_report เมื่อ borrow_items ยังไม่ได้โหลดเข้าหน่วยความจำ (0/1 = ไม่แบ่ง)
+REPORT_WORKERS = int(os.environ.get("LIBRARY_REPORT_WORKERS", "0"))
+# ไบต์ที่แต่ละโปรเซสอ่านต่อครั้ง
+SHARD_BLOCK = 8 * 1024 * 1024
+
+
+def shard_lines(path, start, end):
+    """วนบรรทัด (ตัดช่องว่างหัวท้ายแล้ว ไม่รวมบรรทัดว่าง) ที่เริ่มในช่วงไบต์ start..end-1 ของไฟล์
+    บรรทัดที่คร่อมขอบช่วงเป็นของช่วงที่บรรทัดนั้นเริ่ม ทุกช่วงรวมกันจึงได้ทุกบรรทัดครั้งเดียวพอดี
+    """
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        pos = f.tell()
+        while pos < end:
+            block = f.read(min(SHARD_BLOCK, end - pos))
+            if not block:
+                break
+            if not block.endswith(b"\n"):
+                block += f.readline()
+            pos += len(block)
+            for line in block.decode("utf-8").split("\n"):
+                line = line.strip()
+                if line:
+                    yield line
 
-    print("\n📊 รายงานสรุประบบห้องสมุด")
-    print("="*60)
 
-    total_books = sum(1 for b in books if b and b[-1] == "A")
-    total_members = sum(1 for m in members if m and m[-1] == "A")
-    total_borrows = sum(1 for br in borrows if br and br[-1] == "A")
+def count_shard(path, start, end):
+    return sum(1 for _ in shard_lines(path, start, end))
 
-    active_borrows = 0
-    completed_borrows = 0
-    for br in borrows:
-        if not br or br[-1] != "A":
-            continue
-        items = [bi for bi in borrow_items if bi and len(bi) >= 6 and bi[1] == br[0] and bi[-1] == "A"]
-        if any(i[3].strip() == "กำลังยืม" for i in items):
-            active_borrows += 1
+
+def report_shard(path, start, end, today, recent, first_slot=0, ops=None):
+    """ReportAggregator ของแถว borrow_items ในช่วงไบต์ start..end (ทำงานในโปรเซสลูก)
+    ops คือ slot -> list ของ (op, fields) จาก log ของแถวในช่วงนี้ ใช้ทับแถวในไฟล์ตามลำดับแบบ replay_log
+    (first_slot = ตำแหน่งแถวแรกของช่วงในตาราง)
+    """
+    n = TABLE_FIELDS["borrow_items.txt"]
+    agg = ReportAggregator(today, recent)
+    for slot, line in enumerate(shard_lines(path, start, end), first_slot):
+        parts = line.split("|")
+        if len(parts) < n:
+            parts += [""] * (n - len(parts))
+        if ops and slot in ops:
+            for op, fields in ops[slot]:
+                parts = with_status(parts, "D") if op == "T" else fields
+        agg.feed(parts)
+    agg.recent = None
+    return agg
+
+
+@timed("op.parallel_report")
+def parallel_report(workers=None, today=None):
+    """ReportAggregator ของ borrow_items ทั้งตาราง โดยแบ่งไฟล์เป็น workers ช่วงไบต์ให้โปรเซสลูกอ่านพร้อมกัน
+    ไม่โหลดตารางเข้าหน่วยความจำของโปรเซสนี้ ผลย่อยรวมตามลำดับช่วง จึงเรียงแถวเหมือนวนทั้งไฟล์
+    log ที่ยังไม่ compact อ่านครั้งเดียวตอนเริ่ม (ถ้ามี นับแถวของแต่ละช่วงก่อน เพื่อรู้ slot ของแต่ละบรรทัด)
+    ไม่ถือล็อกระหว่างอ่าน: ถ้าไฟล์หลักถูกเขียนใหม่ระหว่างนั้น (compact) จะอ่านใหม่อีกรอบโดยถือ DATA_LOCK
+    คืน None ถ้าไม่ได้เก็บข้อมูลเป็นไฟล์ .txt
+    """
+    if not isinstance(repo, Repository) or not isinstance(repo.storage, TextStorage):
+        return None
+    workers = max(1, workers or REPORT_WORKERS or os.cpu_count() or 1)
+    today = today if today is not None else today_ordinal()
+    filename = "borrow_items.txt"
+    path = get_path(filename)
+    with repo.snapshot():
+        recent = recent_borrows(today)
+    for attempt in range(2):
+        with DATA_LOCK.shared() if attempt else contextlib.nullcontext():
+            with DATA_LOCK.shared():
+                stamp = file_stamp(filename)
+                ops = read_log(filename)
+            if stamp is None:
+                return ReportAggregator(today)
+            agg = run_shards(path, stamp[1], workers, today, recent, ops)
+            if file_stamp(filename) == stamp:
+                return agg
+    return agg
+
+
+def run_shards(path, size, workers, today, recent, ops):
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges = [(size * i // workers, size * (i + 1) // workers) for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        firsts, shard_ops, extra = [0] * workers, [None] * workers, []
+        if ops:
+            counts = list(pool.map(count_shard, [path] * workers, *zip(*ranges)))
+            firsts = [sum(counts[:i]) for i in range(workers)]
+            total = sum(counts)
+            by_slot = {}
+            for op, slot, fields in ops:
+                if op != "T" and len(fields) < TABLE_FIELDS["borrow_items.txt"]:
+                    fields += [""] * (TABLE_FIELDS["borrow_items.txt"] - len(fields))
+                if slot < total:
+                    by_slot.setdefault(slot, []).append((op, fields))
+                elif slot - total < len(extra):
+                    # แถวที่ log เพิ่มต่อท้ายไฟล์ ใช้กฎเดียวกับ replay_log
+                    extra[slot - total] = with_status(extra[slot - total], "D") if op == "T" else fields
+                elif slot - total == len(extra) and op != "T":
+                    extra.append(fields)
+            for i in range(workers):
+                shard_ops[i] = {s: v for s, v in by_slot.items() if firsts[i] <= s < firsts[i] + counts[i]}
+        futures = [pool.submit(report_shard, path, start, end, today, recent, first, shard)
+                   for (start, end), first, shard in zip(ranges, firsts, shard_ops)]
+        agg = ReportAggregator(today)
+        for future in futures:
+            agg.merge(future.result())
+    tail = ReportAggregator(today, recent)
+    for r in extra:
+        tail.feed(r)
+    return agg.merge(tail)
+
+
+class Leaderboard:
+    """จำนวนครั้งที่ถูกยืมต่อ BookID พร้อมลำดับที่เรียงไว้ตลอด (มากสุดก่อน เท่ากันเรียงตามรหัส)
+    add() ปรับด้วย bisect ทุกครั้งที่ตัวนับเปลี่ยน top(k) จึงตัดจากหัว list ได้เลยไม่ต้องเรียงใหม่
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.order = []  # (-จำนวนครั้ง, รหัสเป็นตัวเลข, BookID)
+
+    def add(self, book_id, n):
+        old = self.counts.get(book_id, 0)
+        key = id_number([book_id])
+        if old:
+            del self.order[bisect.bisect_left(self.order, (-old, key, book_id))]
+        count = old + n
+        if count:
+            self.counts[book_id] = count
+            bisect.insort(self.order, (-count, key, book_id))
         else:
-            completed_borrows += 1
+            del self.counts[book_id]
 
-    total_fine = 0
-    unpaid_fine = 0
-    for bi in borrow_items:
-        if not bi or bi[-1] != "A":
-            continue
-        try:
-            fine = float(bi[4]) if str(bi[4]).replace('.', '', 1).isdigit() else 0
-            total_fine += fine
-            # ถ้าคืนแล้วแต่ยังมีค่าปรับ = ยังไม่ได้รับ
-            if bi[3].strip() == "คืนแล้ว" and fine > 0:
-                unpaid_fine += fine
-        except Exception:
-            continue
+    def top(self, k):
+        """list ของ (BookID, จำนวนครั้ง) k อันดับแรก"""
+        return [(book_id, -count) for count, _, book_id in self.order[:k]]
 
-    # นับหนังสือที่กำลังถูกยืมอยู่
-    books_currently_borrowed = 0  # หนังสือที่กำลังถูกยืมตอนนี้
-    
-    for bi in borrow_items:
-        if bi and bi[-1] == "A" and bi[3].strip() == "กำลังยืม":
-            books_currently_borrowed += 1
 
-    print(f"📚 จำนวนหนังสือทั้งหมด: {total_books} เรื่อง")
-    
-    # คำนวณจำนวนเล่มรวมทั้งหมด
-    total_copies_all = 0
-    for b in books:
-        if b and b[-1] == "A":
+class LoanStats:
+    """ตัวเลขสรุปของรายงานและอันดับหนังสือยอดนิยม ปรับทุกครั้งที่ยืม คืน หรือลบ (listener ของทั้ง 4 ตาราง)
+    รายงานจึงอ่านค่าที่นับไว้แล้ว ไม่ต้องวน borrow_items ทั้งตารางทุกครั้ง
+    ฝั่ง borrow_items (ตัวนับต่อเล่ม ค่าปรับ รายการต่อ BorrowID) กับฝั่ง borrows (วันที่ยืม) แยกกัน
+    ส่วนที่ต้องใช้ทั้งสองฝั่ง (จำนวนรายการที่กำลังยืม อันดับตามช่วงเวลา) ปรับเมื่อฝั่งใดเปลี่ยนก็ได้
+    ตารางใดโหลดใหม่ (reset) ก็สร้างคืนได้จากอีกฝั่งที่ยังอยู่ แบบเดียวกับ MemberLoans
+    อันดับตามช่วงเวลานับตามวันที่ยืมของรายการยืมที่ยังไม่ถูกลบ: รายเดือน และ days วันล่าสุด
+    (ช่วงเลื่อนตาม today ตอนอ่าน โดยหัก/เพิ่มเฉพาะวันที่หลุด/เข้าช่วง)
+    """
+
+    def __init__(self):
+        self.listeners = {
+            "books.txt": Listener(self.reset_books, self.change_book),
+            "members.txt": Listener(self.reset_members, self.change_member),
+            "borrows.txt": Listener(self.reset_borrows, self.change_borrow),
+            "borrow_items.txt": Listener(self.reset_items, self.change_item),
+        }
+        self.reset_books()
+        self.reset_members()
+        self.reset_borrows()
+        self.reset_items()
+
+    def reset_books(self):
+        self.total_books = 0
+        self.total_copies = 0
+
+    def reset_members(self):
+        self.total_members = 0
+
+    def reset_borrows(self):
+        self.borrow_day = {}  # BorrowID -> ordinal วันที่ยืม (None ถ้าผิดรูปแบบ) ของรายการที่ยังไม่ถูกลบ
+        self.reset_joined()
+
+    def reset_items(self):
+        self.board = Leaderboard()
+        self.total_fine = 0.0
+        self.unpaid_fine = 0.0
+        self.currently_borrowed = 0
+        self.per_borrow = {}   # BorrowID -> [เล่มที่ยังไม่คืน, {BookID: จำนวนเล่ม}]
+        self.open_items = {}   # ItemID -> (BorrowID, BookID) ของเล่มที่ยังไม่คืน
+        self.fined_items = {}  # ItemID -> (BorrowID, BookID, ค่าปรับ, สถานะ)
+        self.reset_joined()
+
+    def reset_joined(self):
+        # ฝั่งหนึ่งเพิ่งว่าง ส่วนที่ใช้ทั้งสองฝั่งจึงเป็นศูนย์ และถูกนับคืนตอนตารางนั้นป้อนแถวกลับมา
+        self.active_borrows = 0
+        self.days = {}     # ordinal วันที่ยืม -> {BookID: จำนวนเล่ม}
+        self.months = {}   # (ปี, เดือน) -> Leaderboard
+        self.windows = {}  # จำนวนวัน -> [ordinal วันสุดท้ายของช่วง, Leaderboard]
+
+    def change_book(self, old, new):
+        for r, sign in ((old, -1), (new, 1)):
+            if r is not None and is_active(r):
+                self.total_books += sign
+                self.total_copies += sign * (int(r[3]) if r[3].isdigit() else 0)
+
+    def change_member(self, old, new):
+        for r, sign in ((old, -1), (new, 1)):
+            if r is not None and is_active(r):
+                self.total_members += sign
+
+    def add_borrow(self, borrow_id, day, open_count, books, sign):
+        """นับ (sign=1) หรือหัก (sign=-1) ส่วนของรายการยืมหนึ่งรายการในตัวเลขที่ใช้ทั้งสองฝั่ง"""
+        if open_count:
+            self.active_borrows += sign
+        for book_id, n in books.items():
+            self.add_day(day, book_id, sign * n)
+
+    def add_day(self, day, book_id, n):
+        if day is None or not n:
+            return
+        bucket = self.days.setdefault(day, {})
+        bucket[book_id] = bucket.get(book_id, 0) + n
+        if not bucket[book_id]:
+            del bucket[book_id]
+            if not bucket:
+                del self.days[day]
+        d = date.fromordinal(day)
+        self.months.setdefault((d.year, d.month), Leaderboard()).add(book_id, n)
+        for days, (end, board) in self.windows.items():
+            if end - days < day <= end:
+                board.add(book_id, n)
+
+    def change_borrow(self, old, new):
+        old = (old[0].strip(), date_ordinal(old[2].strip())) if old is not None and is_active(old) and len(old) > 2 else None
+        new = (new[0].strip(), date_ordinal(new[2].strip())) if new is not None and is_active(new) and len(new) > 2 else None
+        if old == new:
+            return
+        for entry, sign in ((old, -1), (new, 1)):
+            if entry is None:
+                continue
+            borrow_id, day = entry
+            if sign > 0:
+                self.borrow_day[borrow_id] = day
+            else:
+                self.borrow_day.pop(borrow_id, None)
+            open_count, books = self.per_borrow.get(borrow_id, (0, {}))
+            self.add_borrow(borrow_id, day, open_count, books, sign)
+
+    def change_item(self, old, new):
+        for bi, sign in ((old, -1), (new, 1)):
+            if bi is None or not is_active(bi) or len(bi) < 6:
+                continue
+            item_id, borrow_id, book_id = bi[0].strip(), bi[1].strip(), bi[2]
+            fine = parse_fine(bi[4])
+            status = bi[3].strip()
+            borrowed = status == "กำลังยืม"
+            self.board.add(book_id, sign)
+            self.total_fine += sign * fine
+            if status == "คืนแล้ว" and fine > 0:
+                self.unpaid_fine += sign * fine
+            if borrowed:
+                self.currently_borrowed += sign
+            for items, value, wanted in ((self.open_items, (borrow_id, book_id), borrowed),
+                                         (self.fined_items, (borrow_id, book_id, fine, bi[3]), fine > 0)):
+                if not wanted:
+                    continue
+                if sign > 0:
+                    items[item_id] = value
+                else:
+                    items.pop(item_id, None)
+
+            entry = self.per_borrow.setdefault(borrow_id, [0, {}])
+            was_open = entry[0] > 0
+            entry[0] += sign if borrowed else 0
+            entry[1][book_id] = entry[1].get(book_id, 0) + sign
+            if not entry[1][book_id]:
+                del entry[1][book_id]
+            if not entry[0] and not entry[1]:
+                del self.per_borrow[borrow_id]
+            if borrow_id in self.borrow_day:
+                self.active_borrows += (entry[0] > 0) - was_open
+                self.add_day(self.borrow_day[borrow_id], book_id, sign)
+
+    def top(self, k=5, days=None, month=None, today=None):
+        """อันดับหนังสือที่ถูกยืมมากที่สุด k อันดับ list ของ (BookID, จำนวนครั้ง)
+        days=30: เฉพาะที่ยืมใน 30 วันล่าสุดถึง today (ordinal ค่าเริ่มต้นวันนี้)
+        month=(ปี, เดือน): เฉพาะที่ยืมในเดือนนั้น ไม่ระบุทั้งคู่ = ตลอดเวลา
+        """
+        if month is not None:
+            board = self.months.get(tuple(month))
+            return board.top(k) if board else []
+        if days is None:
+            return self.board.top(k)
+        return self.window(days, today if today is not None else today_ordinal()).top(k)
+
+    def window(self, days, end):
+        """Leaderboard ของวันที่ยืมในช่วง end-days+1..end เลื่อนจากช่วงเดิมโดยหัก/เพิ่มเฉพาะวันที่ต่างกัน"""
+        old_end, board = self.windows.get(days, (None, None))
+        if old_end == end:
+            return board
+        new_days = range(end - days + 1, end + 1)
+        if old_end is None or abs(end - old_end) >= days:
+            board, changed = Leaderboard(), ((d, 1) for d in new_days)
+        else:
+            old_days = range(old_end - days + 1, old_end + 1)
+            changed = [(d, -1) for d in old_days if d not in new_days] + [(d, 1) for d in new_days if d not in old_days]
+        for d, sign in changed:
+            for book_id, n in self.days.get(d, {}).items():
+                board.add(book_id, sign * n)
+        self.windows[days] = [end, board]
+        return board
+
+    def item_rows(self, items):
+        """แถวของ open_items/fined_items ที่รายการยืมยังไม่ถูกลบ เรียงตาม ItemID"""
+        return [items[item_id] for item_id in sorted(items, key=lambda i: (id_number([i]), i))
+                if items[item_id][0] in self.borrow_day]
+
+
+def loan_stats():
+    """LoanStats ของ repo สร้างครั้งแรกที่ใช้ แล้วผูกเป็น listener ของทั้ง 4 ตารางให้ปรับตามการแก้ไข"""
+    for listener in repo.table("borrow_items.txt").listeners:
+        owner = getattr(listener.change, "__self__", None)
+        if isinstance(owner, LoanStats):
+            return owner
+    stats = LoanStats()
+    for filename, listener in stats.listeners.items():
+        table = repo.table(filename)
+        for r in table.rows():
+            listener.change(None, r)
+        table.listeners.append(listener)
+    return stats
+
+
+@timed("op.build_report")
+def build_report(agg=None):
+    """คำนวณข้อมูลทุกส่วนของรายงาน คืน dict ที่พร้อมแสดงผล
+    ถ้าไม่ส่ง agg มาจะอ่านตัวเลขที่ LoanStats นับไว้แล้ว ส่ง agg (เช่นจาก parallel_report) = ใช้ผลจากการวน borrow_items แทน
+    """
+    with repo.snapshot():
+        return _build_report(agg)
+
+
+def _build_report(agg):
+    borrows_table = repo.table("borrows.txt")
+    if agg is None:
+        # ตัวเลขสรุปและอันดับนับไว้แล้วใน LoanStats ไม่ต้องวน borrow_items ทั้งตาราง
+        stats = loan_stats()
+        today = today_ordinal()
+        total_books, total_copies_all = stats.total_books, stats.total_copies
+        total_members, total_borrows = stats.total_members, len(stats.borrow_day)
+        active_borrows = stats.active_borrows
+        currently_borrowed, total_fine, unpaid_fine = stats.currently_borrowed, stats.total_fine, stats.unpaid_fine
+        borrowed_rows = [(borrow_id, book_id, date_ordinal(borrows_table.get(borrow_id)[3]))
+                         for borrow_id, book_id in stats.item_rows(stats.open_items)]
+        fine_rows = stats.item_rows(stats.fined_items)
+        this_month = date.fromordinal(today)
+        popular = stats.top(5)
+        popular_recent = stats.top(5, days=POPULAR_DAYS, today=today)
+        popular_month = stats.top(5, month=(this_month.year, this_month.month))
+    else:
+        today = agg.today
+        total_books = 0
+        total_copies_all = 0
+        for b in repo.active("books.txt"):
+            total_books += 1
             total_copies_all += int(b[3]) if b[3].isdigit() else 0
-    
-    print(f"📖 จำนวนเล่มรวมทั้งหมด: {total_copies_all} เล่ม")
-    print(f"👥 จำนวนสมาชิกทั้งหมด: {total_members} คน")
-    print(f"📋 จำนวนการยืมทั้งหมด: {total_borrows} รายการ")
-    print(f"🔄 กำลังยืมอยู่: {active_borrows} รายการ")
-    print(f"✅ คืนแล้ว: {completed_borrows} รายการ")
-    print(f"📘 หนังสือที่กำลังถูกยืมอยู่: {books_currently_borrowed} เล่ม")
-    print(f"📗 หนังสือที่ว่างอยู่: {total_copies_all - books_currently_borrowed} เล่ม")
-    print(f"💰 ค่าปรับรวมทั้งหมด: {total_fine:.2f} บาท")
-    print(f"⚠️  ค่าปรับที่ยังไม่ได้รับ: {unpaid_fine:.2f} บาท")
+        total_members = sum(1 for _ in repo.active("members.txt"))
+        total_borrows = sum(1 for _ in repo.active("borrows.txt"))
+        currently_borrowed, total_fine, unpaid_fine = agg.currently_borrowed, agg.total_fine, agg.unpaid_fine
+        # agg เก็บแค่ BorrowID ไว้ ตรวจกับ borrows ตรงนี้ (รายการยืมที่ถูกลบไปแล้วไม่แสดง)
+        borrowed_rows = []
+        active_borrow_ids = set()
+        for borrow_id, book_id in agg.item_rows(agg.borrowed_rows):
+            br = borrows_table.get(borrow_id)
+            if br:
+                active_borrow_ids.add(br[0].strip())
+                borrowed_rows.append((borrow_id, book_id, date_ordinal(br[3])))
+        active_borrows = len(active_borrow_ids)
+        fine_rows = [r for r in agg.item_rows(agg.fine_rows) if borrows_table.get(r[0])]
+        recent_window, month_window = report_windows(today)
+        popular = agg.top(5)
+        popular_recent = agg.top(5, *recent_window)
+        popular_month = agg.top(5, *month_window)
+
+    # วันที่เกินกำหนดและค่าปรับสะสมของทุกเล่มที่ยังไม่คืน คำนวณพร้อมกันรอบเดียว
+    overdue_days, accrued = overdue_fines([due for _, _, due in borrowed_rows], today)
+    borrowed_books = []
+    for (borrow_id, book_id, _), days_overdue in zip(borrowed_rows, overdue_days):
+        br = borrows_table.get(borrow_id)
+        if days_overdue is None:
+            overdue_status = "ไม่ทราบ"
+        else:
+            overdue_status = f"เกิน {days_overdue} วัน" if days_overdue > 0 else "ยังไม่เกิน"
+        borrowed_books.append([borrow_id, get_member_name(br[1]), get_book_title(book_id), br[2], br[3], overdue_status])
+
+    fine_records = []
+    for borrow_id, book_id, fine, status in fine_rows:
+        br = borrows_table.get(borrow_id)
+        fine_records.append([get_member_name(br[1]), get_book_title(book_id), f"{fine:.2f}", status])
+
+    return {
+        "total_books": total_books,
+        "total_copies": total_copies_all,
+        "total_members": total_members,
+        "total_borrows": total_borrows,
+        "active_borrows": active_borrows,
+        "overdue_borrows": len(due_index().overdue(today)),
+        "completed_borrows": total_borrows - active_borrows,
+        "books_borrowed": currently_borrowed,
+        "books_available": total_copies_all - currently_borrowed,
+        "total_fine": total_fine,
+        "unpaid_fine": unpaid_fine,
+        "accrued_fine": sum(accrued),
+        "borrowed_books": borrowed_books,
+        "fine_records": fine_records,
+        "popular_books": popular_rows(popular),
+        "popular_recent": popular_rows(popular_recent),
+        "popular_month": popular_rows(popular_month),
+    }
+
+
+def popular_rows(top):
+    return [(book_id, get_book_title(book_id), count) for book_id, count in top]
+
+
+def popular_books(k=5, days=None, month=None, today=None):
+    """หนังสือที่ถูกยืมมากที่สุด k อันดับ list ของ (BookID, ชื่อหนังสือ, จำนวนครั้ง) ดู LoanStats.top"""
+    with repo.snapshot():
+        return popular_rows(loan_stats().top(k, days=days, month=month, today=today))
+
+
+def generate_report():
+    agg = None
+    if REPORT_WORKERS > 1 and isinstance(repo, Repository) and not repo.table("borrow_items.txt").loaded:
+        # ตารางที่โหลดไว้แล้วอ่านจาก LoanStats ได้ทันที แบ่งโปรเซสเฉพาะตอนที่ยังต้องอ่านทั้งไฟล์
+        agg = parallel_report()
+    report = build_report(agg)
+
+    print("\n📊 รายงานสรุประบบห้องสมุด")
+    print("="*60)
+    print(f"📚 จำนวนหนังสือทั้งหมด: {report['total_books']} เรื่อง")
+    print(f"📖 จำนวนเล่มรวมทั้งหมด: {report['total_copies']} เล่ม")
+    print(f"👥 จำนวนสมาชิกทั้งหมด: {report['total_members']} คน")
+    print(f"📋 จำนวนการยืมทั้งหมด: {report['total_borrows']} รายการ")
+    print(f"🔄 กำลังยืมอยู่: {report['active_borrows']} รายการ (เกินกำหนด {report['overdue_borrows']} รายการ)")
+    print(f"✅ คืนแล้ว: {report['completed_borrows']} รายการ")
+    print(f"📘 หนังสือที่กำลังถูกยืมอยู่: {report['books_borrowed']} เล่ม")
+    print(f"📗 หนังสือที่ว่างอยู่: {report['books_available']} เล่ม")
+    print(f"💰 ค่าปรับรวมทั้งหมด: {report['total_fine']:.2f} บาท")
+    print(f"⚠️  ค่าปรับที่ยังไม่ได้รับ: {report['unpaid_fine']:.2f} บาท")
+    print(f"⏰ ค่าปรับสะสมของเล่มที่ยังไม่คืน: {report['accrued_fine']:.2f} บาท")
     print("="*60)
 
     # หนังสือกำลังถูกยืม
     print("\n📖 หนังสือที่กำลังถูกยืม")
-    borrowed_books = []
-    for bi in borrow_items:
-        if bi and bi[-1] == "A" and len(bi) >= 6 and bi[3].strip() == "กำลังยืม":
-            borrow_id = bi[1]
-            book_id = bi[2]
-            br = next((b for b in borrows if b and b[0] == borrow_id and b[-1] == "A"), None)
-            if br:
-                member_name = get_member_name(br[1])
-                borrow_date = br[2]
-                return_date = br[3]
-                try:
-                    due_date = datetime.strptime(return_date, "%d/%m/%Y")
-                    days_overdue = (datetime.now() - due_date).days
-                    overdue_status = f"เกิน {days_overdue} วัน" if days_overdue > 0 else "ยังไม่เกิน"
-                except Exception:
-                    overdue_status = "ไม่ทราบ"
-                book_title = get_book_title(book_id)
-                borrowed_books.append([borrow_id, member_name, book_title, borrow_date, return_date, overdue_status])
-
-    if borrowed_books:
-        print(tabulate(borrowed_books, headers=["รหัสการยืม","ชื่อผู้ยืม","ชื่อหนังสือ","วันที่ยืม","ต้องคืน","สถานะ"], tablefmt="grid"))
+    if report["borrowed_books"]:
+        print(tabulate(report["borrowed_books"], headers=["รหัสการยืม","ชื่อผู้ยืม","ชื่อหนังสือ","วันที่ยืม","ต้องคืน","สถานะ"], tablefmt="grid"))
     else:
         print("ไม่มีหนังสือที่กำลังถูกยืมอยู่")
 
     # รายละเอียดค่าปรับ
     print("\n💰 รายละเอียดค่าปรับ")
-    fine_records = []
-    for bi in borrow_items:
-        if not bi or bi[-1] != "A":
-            continue
-        try:
-            fine = float(bi[4]) if str(bi[4]).replace('.', '', 1).isdigit() else 0
-            if fine > 0:
-                borrow_id = bi[1]
-                br = next((b for b in borrows if b and b[0] == borrow_id and b[-1] == "A"), None)
-                if br:
-                    member_name = get_member_name(br[1])
-                    book_title = get_book_title(bi[2])
-                    status = bi[3]
-                    fine_records.append([member_name, book_title, f"{fine:.2f}", status])
-        except Exception:
-            continue
-
-    if fine_records:
-        print(tabulate(fine_records, headers=["ชื่อสมาชิก","ชื่อหนังสือ","ค่าปรับ (บาท)","สถานะ"], tablefmt="grid"))
+    if report["fine_records"]:
+        print(tabulate(report["fine_records"], headers=["ชื่อสมาชิก","ชื่อหนังสือ","ค่าปรับ (บาท)","สถานะ"], tablefmt="grid"))
     else:
         print("ไม่มีค่าปรับ")
 
     # หนังสือยอดนิยม
     print("\n📈 สถิติการยืม")
-    book_borrow_count = {}
-    for bi in borrow_items:
-        if bi and bi[-1] == "A":
-            book_borrow_count[bi[2]] = book_borrow_count.get(bi[2], 0) + 1
-
-    if book_borrow_count:
-        popular_books = sorted(book_borrow_count.items(), key=lambda x: x[1], reverse=True)[:5]
+    if report["popular_books"]:
         print("หนังสือที่ถูกยืมมากที่สุด 5 อันดับ:")
-        for i, (book_id, count) in enumerate(popular_books, 1):
-            book_title = get_book_title(book_id)
+        for i, (book_id, book_title, count) in enumerate(report["popular_books"], 1):
             print(f"{i}. {book_title} - ถูกยืม {count} ครั้ง")
+    for key, label in (("popular_recent", f"ใน {POPULAR_DAYS} วันล่าสุด"), ("popular_month", "ในเดือนนี้")):
+        if report[key]:
+            print(f"หนังสือที่ถูกยืมมากที่สุด{label}:")
+            for i, (book_id, book_title, count) in enumerate(report[key], 1):
+                print(f"{i}. {book_title} - ถูกยืม {count} ครั้ง")
     print("="*60)
 
 # ------------ Main Menu ------------
@@ -641,79 +3025,86 @@ def main():
         data = ["1. Add Book","2. View Books","3. Update Book","4. Delete Book",
                 "5. Add Member","6. View Members","7. Update Member","8. Delete Member",
                 "9. Add Borrow","10. View Borrows","11. Return Book","12. Update Borrow",
-                "13. Delete Borrow","14. Generate Report","0. Exit"]
+                "13. Delete Borrow","14. Generate Report","15. Check Counters","16. Search Books","0. Exit"]
         table = [data[i:i+4] for i in range(0,len(data),4)]
         print("\n\t\t\t\t===== เมนูหลัก =====")
         print(tabulate(table, tablefmt="grid"))
 
         choice = input("เลือกเมนู: ").strip()
-
-        # Book Management (1-4)
-        if choice == "1": add_book()
-        elif choice == "2": view_books()
-        elif choice == "3":
-            # แสดงรายการหนังสือก่อนแก้ไข
-            view_books()
-            bid = input("\nใส่ BookID ที่ต้องการแก้ไข: ").strip()
-            title = input("ชื่อหนังสือใหม่: ").strip()
-            author = input("ผู้แต่งใหม่: ").strip()
-            while True:
-                try:
-                    total_copies = int(input("จำนวนเล่มใหม่: ").strip())
-                    if total_copies <= 0:
-                        print("✘ จำนวนเล่มต้องมากกว่า 0")
-                        continue
-                    break
-                except ValueError:
-                    print("✘ กรุณาใส่ตัวเลข")
-            update_record("books.txt", bid, [title, author, total_copies])
-        elif choice == "4":
-            # แสดงรายการหนังสือก่อนลบ
-            view_books()
-            bid = input("\nใส่ BookID ที่ต้องการลบ: ").strip()
-            delete_record("books.txt", bid)
-        # Member Management (5-8)
-        elif choice == "5": add_member()
-        elif choice == "6": view_members()
-        elif choice == "7":
-            # แสดงรายการสมาชิกก่อนแก้ไข
-            view_members()
-            mid = input("\nใส่ MemberID ที่ต้องการแก้ไข: ").strip()
-            name = input("ชื่อสมาชิกใหม่: ").strip()
-            phone = input("เบอร์ใหม่: ").strip()
-            update_record("members.txt", mid, [name, phone])
-        elif choice == "8":
-            # แสดงรายการสมาชิกก่อนลบ
-            view_members()
-            mid = input("\nใส่ MemberID ที่ต้องการลบ: ").strip()
-            delete_record("members.txt", mid)
-        # Borrow Management (9-13)
-        elif choice == "9": add_borrow()
-        elif choice == "10": view_borrows()
-        elif choice == "11": return_book()
-        elif choice == "12":
-            # แสดงรายการการยืมทั้งหมดก่อนแก้ไข
-            view_borrows()
-            borrow_id = input("\nใส่ BorrowID ที่ต้องการแก้ไข: ").strip()
-            show_members_list()
-            member_id = input("\nMemberID ใหม่: ").strip()
-            borrow_date = input("วันที่ยืมใหม่ (dd/mm/yyyy): ").strip()
-            return_date = input("วันที่ต้องคืนใหม่ (dd/mm/yyyy): ").strip()
-            fine = input("ค่าปรับใหม่: ").strip()
-            status = input("สถานะใหม่: ").strip()
-            update_record("borrows.txt", borrow_id, [member_id, borrow_date, return_date, fine, status])
-        elif choice == "13":
-            # แสดงรายการการยืมทั้งหมดก่อนลบ
-            view_borrows()
-            borrow_id = input("\nใส่ BorrowID ที่ต้องการลบ: ").strip()
-            delete_borrow_record(borrow_id)
-        # Report & Exit
-        elif choice == "14": generate_report()
-        elif choice == "0":
-            print("ออกจากระบบ")
-            break
-        else:
-            print("✘ เลือกเมนูไม่ถูกต้อง")
+        labels = dict(item.split(". ", 1) for item in data)
+        name = f"menu {choice} {labels[choice]}" if choice in labels else "menu invalid"
+
+        # เมนูแก้ไข/ลบแสดงรายการทั้งหมดแบบไม่ถามคำสั่งเลื่อนหน้า คำตอบถัดไปจึงเป็นรหัสเสมอ
+        with operation(name):
+            # Book Management (1-4)
+            if choice == "1": add_book()
+            elif choice == "2": view_books()
+            elif choice == "3":
+                # แสดงรายการหนังสือก่อนแก้ไข
+                view_books(page_size=0)
+                bid = input("\nใส่ BookID ที่ต้องการแก้ไข: ").strip()
+                title = input("ชื่อหนังสือใหม่: ").strip()
+                author = input("ผู้แต่งใหม่: ").strip()
+                while True:
+                    try:
+                        total_copies = int(input("จำนวนเล่มใหม่: ").strip())
+                        if total_copies <= 0:
+                            print("✘ จำนวนเล่มต้องมากกว่า 0")
+                            continue
+                        break
+                    except ValueError:
+                        print("✘ กรุณาใส่ตัวเลข")
+                update_record("books.txt", bid, [title, author, total_copies])
+            elif choice == "4":
+                # แสดงรายการหนังสือก่อนลบ
+                view_books(page_size=0)
+                bid = input("\nใส่ BookID ที่ต้องการลบ: ").strip()
+                delete_record("books.txt", bid)
+            # Member Management (5-8)
+            elif choice == "5": add_member()
+            elif choice == "6": view_members()
+            elif choice == "7":
+                # แสดงรายการสมาชิกก่อนแก้ไข
+                view_members(page_size=0)
+                mid = input("\nใส่ MemberID ที่ต้องการแก้ไข: ").strip()
+                name = input("ชื่อสมาชิกใหม่: ").strip()
+                phone = input("เบอร์ใหม่: ").strip()
+                update_record("members.txt", mid, [name, phone])
+            elif choice == "8":
+                # แสดงรายการสมาชิกก่อนลบ
+                view_members(page_size=0)
+                mid = input("\nใส่ MemberID ที่ต้องการลบ: ").strip()
+                delete_record("members.txt", mid)
+            # Borrow Management (9-13)
+            elif choice == "9": add_borrow()
+            elif choice == "10": view_borrows()
+            elif choice == "11": return_book()
+            elif choice == "12":
+                # แสดงรายการการยืมทั้งหมดก่อนแก้ไข
+                view_borrows(page_size=0)
+                borrow_id = input("\nใส่ BorrowID ที่ต้องการแก้ไข: ").strip()
+                show_members_list()
+                member_id = input("\nMemberID ใหม่: ").strip()
+                borrow_date = input("วันที่ยืมใหม่ (dd/mm/yyyy): ").strip()
+                return_date = input("วันที่ต้องคืนใหม่ (dd/mm/yyyy): ").strip()
+                fine = input("ค่าปรับใหม่: ").strip()
+                status = input("สถานะใหม่: ").strip()
+                update_record("borrows.txt", borrow_id, [member_id, borrow_date, return_date, fine, status])
+            elif choice == "13":
+                # แสดงรายการการยืมทั้งหมดก่อนลบ
+                view_borrows(page_size=0)
+                borrow_id = input("\nใส่ BorrowID ที่ต้องการลบ: ").strip()
+                delete_borrow_record(borrow_id)
+            # Report & Exit
+            elif choice == "14": generate_report()
+            elif choice == "15": verify_borrowed_counts()
+            elif choice == "16": find_books()
+            elif choice == "0":
+                repo.compact()
+                print("ออกจากระบบ")
+                break
+            else:
+                print("✘ เลือกเมนูไม่ถูกต้อง")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""นำเข้ารายการยืม-คืนจำนวนมากจากไฟล์ CSV หรือ JSONL โดยไม่ผ่านเมนู
+
+แต่ละบรรทัดคือหนึ่ง operation (คอลัมน์/คีย์ "op"):
+    add_book       title, author, copies
+    add_member     name, phone
+    borrow         member_id, book_ids, date
+    return         borrow_id, book_ids, date
+    delete_borrow  borrow_id
+
+book_ids ใน JSONL เป็น list ใน CSV คั่นด้วย ; (เช่น 3;5;8) date ไม่ใส่ = วันนี้
+operation ถูกรวมเป็นชุดละ --chunk รายการต่อหนึ่ง transaction (เขียน log/fsync ครั้งเดียวต่อชุด)
+รายการที่ไม่ผ่านการตรวจสอบจะไม่เขียนอะไรและไม่กระทบรายการอื่นในชุด
+
+ตัวอย่าง:
+    python batch.py events.jsonl
+    python batch.py events.csv --chunk 1000 --results results.jsonl
+"""
+import sys
+import csv
+import json
+import time
+import argparse
+
+import Library_system as ls
+
+# op -> (ฟังก์ชันใน service API, ชื่อฟิลด์ที่ส่งเป็นอาร์กิวเมนต์ตามลำดับ)
+OPERATIONS = {
+    "add_book": (ls.create_book, ["title", "author", "copies"]),
+    "add_member": (ls.create_member, ["name", "phone"]),
+    "borrow": (ls.create_borrow, ["member_id", "book_ids", "date"]),
+    "return": (ls.return_items, ["borrow_id", "book_ids", "date"]),
+    "delete_borrow": (ls.delete_borrow, ["borrow_id"]),
+}
+OPTIONAL_FIELDS = {"date"}
+
+
+def read_operations(path, fmt=None):
+    """วนอ่าน operation จากไฟล์ทีละบรรทัด คืน dict ของแต่ละบรรทัด (bulk.py ใช้อ่านแถวที่จะ import ด้วย)"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                if row.get("book_ids") is not None:
+                    row["book_ids"] = [b for b in row["book_ids"].split(";") if b.strip()]
+                yield {k: v for k, v in row.items() if v not in (None, "")}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def apply_operation(record):
+    """เรียก service API ตาม op ของ record คืนผลลัพธ์ dict"""
+    op = record.get("op")
+    if op not in OPERATIONS:
+        return ls.failure(f"ไม่รู้จัก op: {op}")
+    func, fields = OPERATIONS[op]
+    missing = [name for name in fields if name not in record and name not in OPTIONAL_FIELDS]
+    if missing:
+        return ls.failure(f"ขาดฟิลด์: {', '.join(missing)}")
+    if "book_ids" in fields and not isinstance(record["book_ids"], list):
+        return ls.failure("book_ids ต้องเป็น list")
+    return func(*(record.get(name) for name in fields))
+
+
+def run(operations, chunk=500, results=None):
+    """ประมวลผล operation ทีละชุดใน transaction คืน (จำนวนสำเร็จ, จำนวนล้มเหลว)"""
+    succeeded = failed = 0
+    batch = []
+
+    def flush():
+        nonlocal succeeded, failed
+        outcomes = []
+        try:
+            with ls.repo.transaction() as txn:
+                for line_no, record in batch:
+                    outcomes.append((line_no, record, apply_operation(record)))
+        except Exception as e:
+            # มีข้อผิดพลาดที่ไม่คาดคิด ทั้งชุดถูก rollback
+            outcomes = [(line_no, record, ls.failure(f"ทั้งชุดถูกยกเลิก: {e}")) for line_no, record in batch]
+        else:
+            if txn.ok is False:
+                outcomes = [(line_no, record, ls.failure("บันทึกข้อมูลไม่สำเร็จ")) for line_no, record in batch]
+        for line_no, record, result in outcomes:
+            if result["ok"]:
+                succeeded += 1
+            else:
+                failed += 1
+            if results is not None:
+                results.write(json.dumps({"line": line_no, "op": record.get("op"), **result}, ensure_ascii=False) + "\n")
+        batch.clear()
+
+    for line_no, record in enumerate(operations, 1):
+        batch.append((line_no, record))
+        if len(batch) >= chunk:
+            flush()
+    if batch:
+        flush()
+    return succeeded, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="นำเข้า operation ยืม-คืนจากไฟล์ CSV/JSONL")
+    parser.add_argument("path", help="ไฟล์ operation (.csv หรือ .jsonl)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="ค่าเริ่มต้น: ดูจากนามสกุลไฟล์")
+    parser.add_argument("--chunk", type=int, default=500, help="จำนวน operation ต่อหนึ่ง transaction")
+    parser.add_argument("--results", help="ไฟล์ JSONL เก็บผลลัพธ์ของแต่ละบรรทัด ('-' = stdout)")
+    args = parser.parse_args(argv)
+
+    out = None
+    if args.results == "-":
+        out = sys.stdout
+    elif args.results:
+        out = open(args.results, "w", encoding="utf-8")
+    start = time.perf_counter()
+    try:
+        succeeded, failed = run(read_operations(args.path, args.format), max(1, args.chunk), out)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    ls.repo.compact()
+    elapsed = time.perf_counter() - start
+    total = succeeded + failed
+    print(f"✔ ประมวลผล {total} รายการ (สำเร็จ {succeeded}, ล้มเหลว {failed}) ใน {elapsed:.2f} วินาที "
+          f"({total / elapsed if elapsed else 0:.0f} รายการ/วินาที)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""วัดเวลาการทำงานของเมนูหลักใน Library_system กับข้อมูลสังเคราะห์ขนาดต่างๆ
+
+สร้าง books.txt / members.txt / borrows.txt / borrow_items.txt ในโฟลเดอร์ชั่วคราว
+(เขียนทีละบรรทัด จึงสร้างได้ถึงหลักสิบล้านแถว) แล้วเรียก view_books, add_borrow, return_book,
+view_borrows, generate_report, popular_books, search_books และ overdue_borrows โดยป้อน input อัตโนมัติและทิ้ง output
+และวัดหน่วยความจำต่อแถวของ list ของ str เทียบกับ record (memory_per_row)
+เวลาโหลดวัดทั้งแบบ parse ไฟล์ (load_uncached) และแบบใช้ snapshot (load) ส่วน startup วัดในโปรเซสใหม่
+ผลลัพธ์เป็น JSON เพื่อเก็บเทียบกันระหว่างเวอร์ชัน
+
+ตัวอย่าง:
+    python benchmark.py --size 1000 --size 100000 --repeat 3 --out bench.json
+    python benchmark.py --size 50000 --tombstones 0.2 --overdue 0.5 --storage sqlite
+    python benchmark.py --generate-only --size 1000000 --data-dir /tmp/lib1m
+    python benchmark.py --size 1000000 --repeat 1 --report-workers 1 --report-workers 2 --report-workers 4
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import builtins
+import platform
+import tempfile
+import statistics
+import contextlib
+import subprocess
+import tracemalloc
+from array import array
+from datetime import date, timedelta
+
+DATE_FORMAT = "%d/%m/%Y"
+BORROWED = "กำลังยืม"
+RETURNED = "คืนแล้ว"
+
+
+# ------------ Synthetic data ------------
+def generate(data_dir, books, members, borrows, tombstones=0.05, overdue=0.2, returned=0.6,
+             max_items=3, seed=42, today=None):
+    """เขียนข้อมูลสังเคราะห์ทั้ง 4 ตารางลง data_dir คืน dict สรุปจำนวนแถวและตัวอย่างรหัสสำหรับทดสอบ
+
+    tombstones = สัดส่วนแถวที่ถูกลบ (D) ในทุกตาราง
+    returned   = สัดส่วนรายการยืมที่คืนครบแล้ว (บางเล่มคืนช้ามีค่าปรับ)
+    overdue    = สัดส่วนรายการยืมที่ยังไม่คืนและเกินกำหนดแล้ว (จำนวนวันเกินแจกแจงแบบ exponential)
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    os.makedirs(data_dir, exist_ok=True)
+
+    def path(name):
+        return os.path.join(data_dir, name)
+
+    book_alive = bytearray(books + 1)
+    copies = array("i", [0]) * (books + 1)
+    with open(path("books.txt"), "w", encoding="utf-8") as f:
+        for i in range(1, books + 1):
+            alive = rng.random() >= tombstones
+            book_alive[i] = alive
+            copies[i] = rng.randint(1, 20)
+            f.write(f"{i}|Book title {i}|Author {rng.randint(1, max(1, books // 10))}|{copies[i]}|{'A' if alive else 'D'}\n")
+
+    member_alive = bytearray(members + 1)
+    with open(path("members.txt"), "w", encoding="utf-8") as f:
+        for i in range(1, members + 1):
+            alive = rng.random() >= tombstones
+            member_alive[i] = alive
+            f.write(f"{i}|Member {i}|08{rng.randint(10000000, 99999999)}|{'A' if alive else 'D'}\n")
+
+    on_loan = array("i", [0]) * (books + 1)
+    item_id = 0
+    counts = {"books": books, "members": members, "borrows": borrows, "borrow_items": 0,
+              "active_borrows": 0, "overdue_borrows": 0}
+    member_open = array("i", [0]) * (members + 1)
+    samples = {"return": [], "members": [], "books": []}
+    with open(path("borrows.txt"), "w", encoding="utf-8") as fb, \
+            open(path("borrow_items.txt"), "w", encoding="utf-8") as fi:
+        for borrow_id in range(1, borrows + 1):
+            member_id = rng.randint(1, members)
+            deleted = rng.random() < tombstones
+            is_returned = rng.random() < returned
+            if is_returned:
+                borrow_dt = today - timedelta(days=rng.randint(8, 365))
+            elif rng.random() < overdue / max(1e-9, 1 - returned):
+                borrow_dt = today - timedelta(days=7 + 1 + int(rng.expovariate(1 / 10)))
+                counts["overdue_borrows"] += not deleted
+            else:
+                borrow_dt = today - timedelta(days=rng.randint(0, 6))
+            due_dt = borrow_dt + timedelta(days=7)
+
+            picked = []
+            for _ in range(rng.randint(1, max_items)):
+                book_id = rng.randint(1, books)
+                if not book_alive[book_id] or book_id in picked:
+                    continue
+                if not is_returned and not deleted:
+                    if on_loan[book_id] >= copies[book_id]:
+                        continue
+                    on_loan[book_id] += 1
+                picked.append(book_id)
+
+            for book_id in picked:
+                item_id += 1
+                fine = 0
+                if is_returned:
+                    fine = max(0, rng.randint(-6, 4)) * 5
+                fi.write(f"{item_id}|{borrow_id}|{book_id}|{RETURNED if is_returned else BORROWED}|{fine}|"
+                         f"{'D' if deleted else 'A'}\n")
+            fb.write(f"{borrow_id}|{member_id}|{borrow_dt.strftime(DATE_FORMAT)}|{due_dt.strftime(DATE_FORMAT)}|0|"
+                     f"{RETURNED if is_returned else BORROWED}|{'D' if deleted else 'A'}\n")
+
+            if not is_returned and not deleted and picked:
+                counts["active_borrows"] += 1
+                member_open[member_id] += len(picked)
+                if len(samples["return"]) < 64:
+                    samples["return"].append((str(borrow_id), str(picked[0])))
+        counts["borrow_items"] = item_id
+
+    # หนังสือที่ยังมีเล่มว่างสำหรับทดสอบ add_borrow
+    for book_id in range(1, books + 1):
+        if book_alive[book_id] and copies[book_id] - on_loan[book_id] >= 8:
+            samples["books"].append(str(book_id))
+            if len(samples["books"]) >= 64:
+                break
+    # สมาชิกที่ไม่มีเล่มค้าง (ยืมได้ไม่ติดเงื่อนไข LIBRARY_MAX_OPEN_ITEMS) สำหรับทดสอบ add_borrow
+    samples["members"] = [str(i) for i in range(1, members + 1) if member_alive[i] and not member_open[i]][:64] or ["1"]
+    return {"rows": counts, "samples": samples,
+            "bytes": {name: os.path.getsize(path(name)) for name in
+                      ("books.txt", "members.txt", "borrows.txt", "borrow_items.txt")}}
+
+
+# ------------ Timing ------------
+@contextlib.contextmanager
+def scripted_input(answers):
+    """แทน input() ด้วยคำตอบที่เตรียมไว้ และทิ้ง output ทั้งหมด"""
+    answers = iter(answers)
+    original = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    try:
+        with open(os.devnull, "w", encoding="utf-8") as null, contextlib.redirect_stdout(null):
+            yield
+    finally:
+        builtins.input = original
+
+
+def timed(fn, answers=()):
+    with scripted_input(answers):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+
+def summarize(samples):
+    return {"runs": len(samples), "min": min(samples), "median": statistics.median(samples),
+            "mean": statistics.fmean(samples), "max": max(samples)}
+
+
+def prepare_storage(ls, storage):
+    """แปลงไฟล์ .txt ที่สร้างไว้เป็นรูปแบบของ storage ที่จะวัด แล้วสร้าง repo ใหม่"""
+    with open(os.devnull, "w", encoding="utf-8") as null, contextlib.redirect_stdout(null):
+        if storage == "binary":
+            import binary_storage
+            binary_storage.main(["import"])
+        elif storage == "sqlite":
+            import sqlite_storage
+            sqlite_storage.main(["migrate"])
+    ls.repo = ls.make_repository(storage)
+
+
+def memory_per_row(ls):
+    """ไบต์ต่อแถวในหน่วยความจำของแต่ละตาราง (tracemalloc) ระหว่าง list ของ str กับ record ของ RECORD_TYPES
+    รวมขนาดของ VALUE_POOL ที่สร้างขึ้นระหว่างโหลดด้วย
+    """
+    result = {}
+    for filename, n in ls.TABLE_FIELDS.items():
+        sizes = {}
+        for kind, record_type in (("list", None), ("record", ls.RECORD_TYPES.get(filename))):
+            ls.VALUE_POOL.clear()
+            tracemalloc.start()
+            rows = ls.read_file(filename, min_fields=n, record_type=record_type)
+            sizes[kind] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            count = len(rows)
+            del rows
+        per_row = {kind: size / max(1, count) for kind, size in sizes.items()}
+        result[filename] = {"rows": count, "list_bytes_per_row": round(per_row["list"], 1),
+                            "record_bytes_per_row": round(per_row["record"], 1),
+                            "saved": round(1 - sizes["record"] / sizes["list"], 3) if sizes["list"] else 0}
+    ls.VALUE_POOL.clear()
+    return result
+
+
+def run_size(ls, data_dir, info, storage, repeat, report_workers=()):
+    ls.BASE_DIR = data_dir
+    prepare_storage(ls, storage)
+    samples = info["samples"]
+    today = date.today().strftime(DATE_FORMAT)
+    results = {}
+
+    def measure(name, fn, answers_for=lambda i: ()):
+        results[name] = summarize([timed(fn, answers_for(i)) for i in range(repeat)])
+
+    def cold_load():
+        ls.repo.invalidate()
+        for filename in ls.TABLE_FIELDS:
+            ls.repo.rows(filename)
+
+    # load_uncached = parse ไฟล์ทุกครั้ง, load = โหลดจาก snapshot (.cache) ที่เขียนไว้ตอนโหลดครั้งก่อน
+    cache = ls.SNAPSHOT_CACHE
+    ls.SNAPSHOT_CACHE = False
+    measure("load_uncached", cold_load)
+    ls.SNAPSHOT_CACHE = cache
+    cold_load()
+    measure("load", cold_load)
+    results["due_index_build"] = summarize([timed(ls.due_index)])
+    # หน้าแรกของรายการ (ตอบ q ถ้ามีหลายหน้า) และรายการทั้งหมดในหน้าเดียว
+    measure("view_books", ls.view_books, lambda i: ["q"])
+    measure("view_borrows", ls.view_borrows, lambda i: ["q"])
+    measure("view_books_all", lambda: ls.view_books(page_size=0))
+    measure("view_borrows_all", lambda: ls.view_borrows(page_size=0))
+    results["loan_stats_build"] = summarize([timed(ls.loan_stats)])
+    measure("generate_report", ls.generate_report)
+    measure("popular_books_30_days", lambda: ls.popular_books(5, days=30))
+    # อ่าน borrow_items ทั้งไฟล์แบบแบ่งช่วงให้หลายโปรเซส (ไม่ใช้ตารางที่โหลดไว้) เทียบกับ 1 โปรเซส
+    for workers in report_workers:
+        measure(f"parallel_report_{workers}", lambda: ls.parallel_report(workers))
+    if 1 in report_workers:
+        base = results["parallel_report_1"]["min"]
+        results["parallel_speedup"] = {str(w): base / results[f"parallel_report_{w}"]["min"] for w in report_workers}
+    results["search_index_build"] = summarize([timed(ls.book_search_index)])
+    measure("search_books", lambda: ls.search_books("title 1", available_only=True, limit=50))
+    measure("overdue_borrows", ls.overdue_borrows)
+    if samples["books"]:
+        measure("add_borrow", ls.add_borrow,
+                lambda i: [samples["members"][i % len(samples["members"])], samples["books"][i % len(samples["books"])],
+                           "done", today])
+    returns = list(samples["return"])
+    if returns:
+        measure("return_book", ls.return_book,
+                lambda i: [returns[i % len(returns)][0], returns[i % len(returns)][1], "done", today])
+    ls.repo.compact()
+    return results
+
+
+def startup_time(data_dir, repeat):
+    """เวลา import Library_system และเวลาตั้งแต่เริ่มโปรแกรมจนแสดงเมนูแล้วเลือกออก (โปรเซสใหม่ทุกรอบ)"""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, LIBRARY_DATA_DIR=data_dir)
+    code = "import time; start = time.perf_counter(); import Library_system; print(time.perf_counter() - start)"
+    imports, startups = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=script_dir, env=env)
+        imports.append(float(out.stdout.strip()))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "Library_system.py"], input="0\n", capture_output=True, text=True,
+                       cwd=script_dir, env=env)
+        startups.append(time.perf_counter() - start)
+    return {"import": summarize(imports), "menu_and_exit": summarize(startups)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Library_system กับข้อมูลสังเคราะห์")
+    parser.add_argument("--size", type=int, action="append",
+                        help="จำนวนหนังสือ (ใส่ได้หลายครั้ง ค่าเริ่มต้น 1000) สมาชิก = size/2, การยืม = size")
+    parser.add_argument("--members", type=int, help="กำหนดจำนวนสมาชิกเอง")
+    parser.add_argument("--borrows", type=int, help="กำหนดจำนวนรายการยืมเอง")
+    parser.add_argument("--tombstones", type=float, default=0.05, help="สัดส่วนแถวที่ถูกลบ (D)")
+    parser.add_argument("--overdue", type=float, default=0.2, help="สัดส่วนรายการยืมที่เกินกำหนด")
+    parser.add_argument("--returned", type=float, default=0.6, help="สัดส่วนรายการยืมที่คืนแล้ว")
+    parser.add_argument("--storage", default="text", choices=["text", "binary", "sqlite"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", help="โฟลเดอร์สำหรับข้อมูล (ค่าเริ่มต้น: โฟลเดอร์ชั่วคราวที่ลบทิ้งหลังจบ)")
+    parser.add_argument("--generate-only", action="store_true", help="สร้างข้อมูลอย่างเดียว ไม่วัดเวลา")
+    parser.add_argument("--out", help="ไฟล์ผลลัพธ์ JSON (ค่าเริ่มต้น: stdout)")
+    parser.add_argument("--report-workers", type=int, action="append", default=[],
+                        help="วัด parallel_report ด้วยจำนวนโปรเซสนี้ (ใส่ได้หลายครั้ง เช่น 1 2 4 8)")
+    args = parser.parse_args(argv)
+
+    sizes = args.size or [1000]
+    base_dir = args.data_dir or tempfile.mkdtemp(prefix="library-bench-")
+    os.environ["LIBRARY_DATA_DIR"] = base_dir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Library_system as ls
+
+    report = {"revision": git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+              "cpu_count": os.cpu_count(), "storage": args.storage, "repeat": args.repeat, "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "runs": []}
+    try:
+        for size in sizes:
+            data_dir = os.path.join(base_dir, str(size)) if len(sizes) > 1 else base_dir
+            start = time.perf_counter()
+            info = generate(data_dir, size, args.members or max(1, size // 2), args.borrows or size,
+                            tombstones=args.tombstones, overdue=args.overdue, returned=args.returned, seed=args.seed)
+            run = {"size": size, "rows": info["rows"], "bytes": info["bytes"],
+                   "generate_seconds": time.perf_counter() - start}
+            if not args.generate_only:
+                run["timings"] = run_size(ls, data_dir, info, args.storage, args.repeat, args.report_workers)
+                run["timings"]["startup"] = startup_time(data_dir, args.repeat)
+                run["memory"] = memory_per_row(ls)
+            report["runs"].append(run)
+            print(f"✔ size {size}: เสร็จใน {time.perf_counter() - start:.2f} วินาที", file=sys.stderr)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""ที่เก็บตารางแบบไบนารีเรียงตามคอลัมน์ (columnar) สำหรับ Library_system
+
+ไฟล์ .bin หนึ่งไฟล์ต่อหนึ่งตาราง (เช่น books.txt -> books.bin) อ่านผ่าน mmap
+คอลัมน์ตัวเลข/วันที่เก็บเป็น array ชนิดตายตัว จึงสแกนทั้งคอลัมน์ได้โดยไม่ต้อง split ข้อความ
+
+รูปแบบไฟล์:
+    MAGIC (8 ไบต์) | byteorder (1 ไบต์ '<' หรือ '>') | nrows, ncols (uint64 x2)
+    ไดเรกทอรีคอลัมน์ ncols ช่อง: type (uint64), offset (uint64), length (uint64)
+    คอลัมน์ lengths (uint8 ต่อแถว) บอกจำนวนฟิลด์จริงของแต่ละแถว
+    ข้อมูลแต่ละคอลัมน์ จัดแนวทีละ 8 ไบต์
+
+ชนิดคอลัมน์:
+    INT   int64 ต่อแถว
+    FLOAT float64 ต่อแถว
+    DATE  int32 ต่อแถว (ordinal ของวันที่ dd/mm/yyyy)
+    ENUM  uint16 code ต่อแถว + พจนานุกรมค่า (เช่น A/D, กำลังยืม/คืนแล้ว)
+    STR   offsets uint64 (nrows+1) + ข้อความ utf-8 ต่อกัน
+
+ตอนเขียนจะลองใช้ชนิดตาม SCHEMAS ก่อน ถ้ามีค่าใดแปลงกลับเป็นข้อความเดิมไม่ได้ตรงตัว
+(เช่นวันที่ 29/9/2025 ที่ไม่เติม 0) คอลัมน์นั้นจะถูกเก็บเป็น STR แทน ข้อมูลจึงไม่เพี้ยน
+
+ใช้เป็นเครื่องมือแปลงไฟล์:
+    python binary_storage.py import [ตาราง ...]   # .txt -> .bin
+    python binary_storage.py export [ตาราง ...]   # .bin -> .txt
+    python binary_storage.py info [ตาราง ...]     # แสดงชนิดและขนาดคอลัมน์
+"""
+import os
+import sys
+import mmap
+import array
+import struct
+import argparse
+from datetime import datetime, date
+
+MAGIC = b"LIBCOL1\0"
+HEADER = struct.Struct("=8scQQ")
+COLUMN_ENTRY = struct.Struct("=QQQ")
+
+INT, FLOAT, DATE, ENUM, STR = 1, 2, 3, 4, 5
+TYPE_NAMES = {INT: "int", FLOAT: "float", DATE: "date", ENUM: "enum", STR: "str"}
+
+# ชนิดที่ต้องการของแต่ละคอลัมน์ "num" = ลอง INT ก่อนแล้วค่อย FLOAT
+SCHEMAS = {
+    "books.txt": ("int", "str", "str", "int", "enum"),
+    "members.txt": ("int", "str", "str", "enum"),
+    "borrows.txt": ("int", "int", "date", "date", "num", "enum", "enum"),
+    "borrow_items.txt": ("int", "int", "int", "enum", "num", "enum"),
+}
+
+DATE_FORMAT = "%d/%m/%Y"
+
+
+def bin_name(filename):
+    """ชื่อไฟล์ไบนารีของตาราง เช่น books.txt -> books.bin"""
+    return os.path.splitext(filename)[0] + ".bin"
+
+
+# ------------ Encode ------------
+def encode_int(values):
+    try:
+        out = array.array("q", (int(v) for v in values))
+    except (ValueError, OverflowError):
+        return None
+    if any(str(n) != v for n, v in zip(out, values)):
+        return None
+    return out.tobytes()
+
+
+def encode_float(values):
+    try:
+        out = array.array("d", (float(v) for v in values))
+    except ValueError:
+        return None
+    if any(repr(x) != v for x, v in zip(out, values)):
+        return None
+    return out.tobytes()
+
+
+def encode_date(values):
+    out = array.array("i")
+    for v in values:
+        try:
+            d = datetime.strptime(v, DATE_FORMAT)
+        except ValueError:
+            return None
+        if d.strftime(DATE_FORMAT) != v:
+            return None
+        out.append(d.toordinal())
+    return out.tobytes()
+
+
+def encode_str(values):
+    blob = bytearray()
+    offsets = array.array("Q", [0])
+    for v in values:
+        blob += v.encode("utf-8")
+        offsets.append(len(blob))
+    return offsets.tobytes() + bytes(blob)
+
+
+def encode_enum(values):
+    codes = array.array("H")
+    lookup = {}
+    for v in values:
+        if v not in lookup:
+            if len(lookup) >= 0xFFFF:
+                return None
+            lookup[v] = len(lookup)
+        codes.append(lookup[v])
+    dictionary = encode_str(list(lookup))
+    # len ของพจนานุกรม (uint64) + พจนานุกรม + padding + codes
+    head = struct.pack("=QQ", len(lookup), len(dictionary)) + dictionary
+    head += b"\0" * (-len(head) % 8)
+    return head + codes.tobytes()
+
+
+def encode_column(kind, values):
+    """คืน (type, bytes) ของคอลัมน์ ถ้าชนิดที่ขอใช้ไม่ได้จะคืนเป็น STR"""
+    attempts = {
+        "int": [(INT, encode_int)],
+        "num": [(INT, encode_int), (FLOAT, encode_float)],
+        "date": [(DATE, encode_date)],
+        "enum": [(ENUM, encode_enum)],
+    }.get(kind, [])
+    for code, encoder in attempts:
+        data = encoder(values)
+        if data is not None:
+            return code, data
+    return STR, encode_str(values)
+
+
+def write_table(path, filename, records):
+    """เขียน records (list ของ list ของ str) เป็นไฟล์ .bin ผ่านไฟล์ชั่วคราวแล้ว rename"""
+    schema = SCHEMAS.get(filename, ())
+    nrows = len(records)
+    ncols = max((len(r) for r in records), default=len(schema))
+    lengths = array.array("B", (len(r) for r in records))
+    columns = []
+    for j in range(ncols):
+        values = [str(r[j]) if j < len(r) else "" for r in records]
+        columns.append(encode_column(schema[j] if j < len(schema) else "str", values))
+
+    body = bytearray()
+    entries = []
+    directory_size = COLUMN_ENTRY.size * ncols
+    start = HEADER.size + directory_size
+    start += -start % 8
+
+    def add(data):
+        offset = start + len(body)
+        body.extend(data)
+        body.extend(b"\0" * (-len(body) % 8))
+        return offset
+
+    add(lengths.tobytes())
+    for code, data in columns:
+        entries.append((code, add(data), len(data)))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, b"<" if sys.byteorder == "little" else b">", nrows, ncols))
+        for entry in entries:
+            f.write(COLUMN_ENTRY.pack(*entry))
+        f.write(b"\0" * (start - HEADER.size - directory_size))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# ------------ Decode ------------
+class ColumnarFile:
+    """เปิดไฟล์ .bin แบบ mmap อ่านทีละคอลัมน์ได้ (column) หรือแปลงกลับเป็นแถวข้อความ (rows)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        magic, order, self.nrows, self.ncols = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} ไม่ใช่ไฟล์ตารางไบนารี")
+        if order != (b"<" if sys.byteorder == "little" else b">"):
+            raise ValueError(f"{path} ถูกเขียนด้วย byte order ต่างจากเครื่องนี้")
+        self.columns = [COLUMN_ENTRY.unpack_from(self.mm, HEADER.size + j * COLUMN_ENTRY.size)
+                        for j in range(self.ncols)]
+        start = HEADER.size + COLUMN_ENTRY.size * self.ncols
+        start += -start % 8
+        self.lengths = self.view[start:start + self.nrows]
+
+    def close(self):
+        self.lengths.release()
+        self.view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def column_type(self, j):
+        return self.columns[j][0]
+
+    def _strings(self, data, n):
+        offsets = data[:(n + 1) * 8].cast("Q")
+        blob = data[(n + 1) * 8:]
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(n)]
+
+    def column(self, j):
+        """ค่าทั้งคอลัมน์: INT/FLOAT/DATE คืน memoryview ตัวเลข (ไม่คัดลอก) ENUM/STR คืน list ของ str
+        ต้อง release memoryview ที่ได้ไปก่อนเรียก close()
+        """
+        code, offset, length = self.columns[j]
+        data = self.view[offset:offset + length]
+        if code == INT:
+            return data.cast("q")
+        if code == FLOAT:
+            return data.cast("d")
+        if code == DATE:
+            return data.cast("i")
+        if code == ENUM:
+            size, dict_len = struct.unpack_from("=QQ", data, 0)
+            values = self._strings(data[16:16 + dict_len], size)
+            head = 16 + dict_len
+            head += -head % 8
+            return [values[c] for c in data[head:].cast("H")]
+        return self._strings(data, self.nrows)
+
+    def text_column(self, j):
+        """ค่าทั้งคอลัมน์ในรูปข้อความแบบเดียวกับไฟล์ .txt"""
+        code = self.columns[j][0]
+        values = self.column(j)
+        if code == INT:
+            return [str(v) for v in values]
+        if code == FLOAT:
+            return [repr(v) for v in values]
+        if code == DATE:
+            cache = {}
+            out = []
+            for v in values:
+                if v not in cache:
+                    cache[v] = date.fromordinal(v).strftime(DATE_FORMAT)
+                out.append(cache[v])
+            return out
+        return values
+
+    def rows(self):
+        """แปลงกลับเป็น list ของแถว (list ของ str) เหมือน read_file"""
+        cols = [self.text_column(j) for j in range(self.ncols)]
+        lengths = self.lengths
+        return [[cols[j][i] for j in range(lengths[i])] for i in range(self.nrows)]
+
+
+def read_table(path):
+    if not os.path.exists(path):
+        return []
+    with ColumnarFile(path) as cf:
+        return cf.rows()
+
+
+# ------------ Import/Export tool ------------
+def main(argv=None):
+    import Library_system as ls
+
+    parser = argparse.ArgumentParser(description="แปลงไฟล์ตาราง .txt <-> .bin")
+    parser.add_argument("action", choices=["import", "export", "info"])
+    parser.add_argument("tables", nargs="*", help="ชื่อไฟล์ตาราง เช่น books.txt (ค่าเริ่มต้น: ทั้งหมด)")
+    args = parser.parse_args(argv)
+    tables = args.tables or list(ls.TABLE_FIELDS)
+
+    for filename in tables:
+        txt_path = ls.get_path(filename)
+        bin_path = ls.get_path(bin_name(filename))
+        if args.action == "import":
+            # อ่านผ่าน repo แบบ text เพื่อรวม log ที่ค้างอยู่ด้วย แล้วรวม log เข้าไฟล์ .txt ก่อน
+            table = ls.Table(filename, ls.TABLE_FIELDS.get(filename), storage=ls.TextStorage())
+            table.compact()
+            records = table.rows()
+            write_table(bin_path, filename, records)
+            print(f"✔ {filename} -> {bin_name(filename)}: {len(records)} แถว "
+                  f"({os.path.getsize(txt_path) if os.path.exists(txt_path) else 0} -> {os.path.getsize(bin_path)} ไบต์)")
+        elif args.action == "export":
+            table = ls.Table(filename, ls.TABLE_FIELDS.get(filename), storage=ls.BinaryStorage())
+            table.compact()
+            records = table.rows()
+            ls.write_file(filename, records)
+            print(f"✔ {bin_name(filename)} -> {filename}: {len(records)} แถว")
+        else:
+            if not os.path.exists(bin_path):
+                print(f"✘ ไม่พบ {bin_name(filename)}")
+                continue
+            with ColumnarFile(bin_path) as cf:
+                kinds = ", ".join(f"{j}:{TYPE_NAMES[cf.column_type(j)]}({cf.columns[j][2]}B)" for j in range(cf.ncols))
+                print(f"{bin_name(filename)}: {cf.nrows} แถว | {kinds}")
+
+
+if __name__ == "__main__":
+    main()
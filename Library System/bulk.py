@@ -0,0 +1,311 @@
+"""นำเข้า/ส่งออกหนังสือ สมาชิก และประวัติการยืมจำนวนมากเป็น CSV หรือ JSONL
+
+import อ่านไฟล์แบบ streaming ทีละ --chunk แถว ตรวจทุกแถว (รหัสสมาชิก/หนังสือที่อ้างถึงตรวจผ่าน
+index รหัสหลักใน O(1)) แล้วเพิ่มทั้งชุดใน transaction เดียว รหัสใหม่ออกต่อกันจากรหัสสูงสุด
+และแต่ละตารางถูกเขียน (ต่อท้าย log + fsync) ครั้งเดียวต่อชุด ไม่ใช่ครั้งเดียวต่อแถวแบบ add_book
+ระหว่าง import ไม่ compact log ทุก LOG_COMPACT_OPS แต่รวมครั้งเดียวตอนจบ (Repository.bulk)
+แถวที่ไม่ผ่านการตรวจจะไม่ถูกเขียนและไม่กระทบแถวอื่นในชุด
+
+คอลัมน์ (CSV header หรือคีย์ JSONL):
+    books    title, author, copies
+    members  name, phone
+    loans    member_id, borrow_date, return_date (ไม่ใส่ = วันที่ยืม + LIBRARY_LOAN_DAYS),
+             book_ids, statuses (กำลังยืม/คืนแล้ว ค่าเริ่มต้น คืนแล้ว), fines (ค่าปรับต่อเล่ม ค่าเริ่มต้น 0)
+book_ids / statuses / fines เป็น list ใน JSONL หรือคั่นด้วย ; ใน CSV (statuses/fines ค่าเดียว = ใช้กับทุกเล่ม)
+ประวัติการยืมไม่ผ่าน loan_block (เป็นข้อมูลย้อนหลัง) แต่เล่มที่ยังยืมอยู่ต้องมีเล่มว่างพอ
+
+export เขียนคอลัมน์ชุดเดียวกันพร้อมรหัสเดิม (book_id, member_id, borrow_id) ซึ่ง import ไม่ใช้เป็นรหัสใหม่
+--id-map ไฟล์ JSON จับคู่รหัสในไฟล์ต้นทาง (คอลัมน์ book_id/member_id) กับรหัสใหม่ที่ได้:
+import books/members บันทึกลงไฟล์นี้ และ import loans แปลง member_id/book_ids ผ่านไฟล์นี้ก่อนตรวจ
+(รหัสที่ไม่มีคู่ในไฟล์ทำให้แถวนั้นไม่ผ่าน ไม่ใช้รหัสเดิมแทน ซึ่งอาจชี้ไปที่สมาชิก/หนังสือคนละรายการ)
+
+ตัวอย่าง:
+    python bulk.py import books catalogue.csv --chunk 5000 --id-map ids.json
+    python bulk.py import members members.jsonl --id-map ids.json
+    python bulk.py import loans history.csv --id-map ids.json --errors rejected.jsonl
+    python bulk.py export loans --out loans.jsonl
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+import Library_system as ls
+from batch import read_operations
+
+BORROWED = "กำลังยืม"
+RETURNED = "คืนแล้ว"
+
+COLUMNS = {
+    "books": ["book_id", "title", "author", "copies"],
+    "members": ["member_id", "name", "phone"],
+    "loans": ["borrow_id", "member_id", "borrow_date", "return_date", "book_ids", "statuses", "fines"],
+}
+LIST_COLUMNS = {"book_ids", "statuses", "fines"}
+
+
+def file_format(path, fmt=None):
+    return fmt or ("csv" if path and path.lower().endswith(".csv") else "jsonl")
+
+
+def chunks(rows, size):
+    """จัดแถวเป็นชุดละ size แถว คืน list ของ (เลขบรรทัด, แถว)"""
+    batch = []
+    for line_no, row in enumerate(rows, 1):
+        batch.append((line_no, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def required(row, name):
+    value = row.get(name)
+    if value is None or str(value).strip() == "":
+        raise ValueError(f"ขาดฟิลด์: {name}")
+    return str(value).strip()
+
+
+def split_list(value):
+    if value is None:
+        return []
+    values = value if isinstance(value, list) else str(value).split(";")
+    return [str(v).strip() for v in values if str(v).strip()]
+
+
+def per_book(values, n, name, default):
+    """ค่าของคอลัมน์ list ให้มี n ค่าตามจำนวนเล่ม (ไม่ใส่ = default, ค่าเดียว = ใช้กับทุกเล่ม)"""
+    values = values or [default]
+    if len(values) == 1:
+        return values * n
+    if len(values) != n:
+        raise ValueError(f"{name} มี {len(values)} ค่า แต่มีหนังสือ {n} เล่ม")
+    return values
+
+
+def mapped(id_map, kind, source_id):
+    """รหัสใหม่ของ source_id ตาม id map (None = ไม่ได้ใช้ --id-map คืนรหัสเดิม)"""
+    if id_map is None:
+        return source_id
+    new_id = id_map.get(kind, {}).get(source_id)
+    if new_id is None:
+        raise ValueError(f"ไม่พบรหัส {source_id} ของ {kind} ใน id map")
+    return new_id
+
+
+def fine_text(value):
+    try:
+        fine = float(value)
+    except ValueError:
+        raise ValueError(f"ค่าปรับไม่ถูกต้อง: {value}") from None
+    if fine < 0:
+        raise ValueError(f"ค่าปรับติดลบ: {value}")
+    return str(int(fine)) if fine.is_integer() else str(fine)
+
+
+# ------------ Import ------------
+def import_book(row, id_map):
+    title = required(row, "title")
+    author = required(row, "author")
+    try:
+        copies = int(required(row, "copies"))
+    except ValueError:
+        raise ValueError("จำนวนเล่มต้องเป็นตัวเลข") from None
+    if copies <= 0:
+        raise ValueError("จำนวนเล่มต้องมากกว่า 0")
+    return ls.repo.table("books.txt").insert([title, author, copies])
+
+
+def import_member(row, id_map):
+    return ls.repo.table("members.txt").insert([required(row, "name"), str(row.get("phone", "")).strip()])
+
+
+def import_loan(row, id_map):
+    """เพิ่มรายการยืมย้อนหลังหนึ่งรายการพร้อม borrow_items ตรวจครบทุกเล่มก่อนเขียน"""
+    member_id = mapped(id_map, "members", required(row, "member_id"))
+    if ls.repo.get("members.txt", member_id) is None:
+        raise ValueError(f"ไม่พบสมาชิก {member_id}")
+    borrow_date = required(row, "borrow_date")
+    if not ls.validate_date(borrow_date):
+        raise ValueError(f"รูปแบบวันที่ยืมไม่ถูกต้อง: {borrow_date}")
+    return_date = str(row.get("return_date") or ls.due_date(borrow_date)).strip()
+    if not ls.validate_date(return_date):
+        raise ValueError(f"รูปแบบวันที่ต้องคืนไม่ถูกต้อง: {return_date}")
+
+    book_ids = [mapped(id_map, "books", b) for b in split_list(row.get("book_ids"))]
+    if not book_ids:
+        raise ValueError("ขาดฟิลด์: book_ids")
+    statuses = per_book(split_list(row.get("statuses")), len(book_ids), "statuses", RETURNED)
+    fines = [fine_text(v) for v in per_book(split_list(row.get("fines")), len(book_ids), "fines", "0")]
+    for book_id in set(book_ids):
+        book = ls.repo.get("books.txt", book_id)
+        if book is None:
+            raise ValueError(f"ไม่พบหนังสือ {book_id}")
+        on_loan = sum(1 for b, s in zip(book_ids, statuses) if b == book_id and s == BORROWED)
+        if on_loan and ls.get_available_copies(book) < on_loan:
+            raise ValueError(f"หนังสือ {book_id} ไม่มีเล่มว่างพอ")
+    bad = [s for s in statuses if s not in (BORROWED, RETURNED)]
+    if bad:
+        raise ValueError(f"สถานะไม่ถูกต้อง: {bad[0]}")
+
+    borrow_status = BORROWED if BORROWED in statuses else RETURNED
+    borrow_id = ls.repo.table("borrows.txt").insert([member_id, borrow_date, return_date, "0", borrow_status])
+    items = ls.repo.table("borrow_items.txt")
+    for book_id, status, fine in zip(book_ids, statuses, fines):
+        items.insert([borrow_id, book_id, status, fine])
+    return borrow_id
+
+
+# ชนิดข้อมูล -> (ฟังก์ชันเพิ่มหนึ่งแถว, คอลัมน์รหัสเดิมที่บันทึกลง id map)
+IMPORTERS = {
+    "books": (import_book, "book_id"),
+    "members": (import_member, "member_id"),
+    "loans": (import_loan, None),
+}
+
+
+def import_chunk(kind, batch, id_map):
+    """เพิ่มแถวที่ผ่านการตรวจของชุดนี้ใน transaction เดียว คืน (list ของ (แถว, รหัสใหม่), list ของ (บรรทัด, error))"""
+    importer, _ = IMPORTERS[kind]
+    added, errors = [], []
+    try:
+        # snapshot: การตรวจรหัสที่อ้างถึงไม่ stat ไฟล์ทุกแถว (transaction โหลดการแก้ไขล่าสุดให้ตอนเริ่มแล้ว)
+        with ls.repo.snapshot(), ls.repo.transaction() as txn:
+            for line_no, row in batch:
+                try:
+                    added.append((row, importer(row, id_map)))
+                except ValueError as e:
+                    errors.append((line_no, row, str(e)))
+    except Exception as e:
+        # ข้อผิดพลาดที่ไม่คาดคิด ทั้งชุดถูก rollback
+        return [], [(line_no, row, f"ทั้งชุดถูกยกเลิก: {e}") for line_no, row in batch]
+    if txn.ok is False:
+        return [], [(line_no, row, "บันทึกข้อมูลไม่สำเร็จ") for line_no, row in batch]
+    return added, errors
+
+
+def run_import(kind, rows, chunk, id_map, errors_out=None):
+    """นำเข้าทีละชุด คืน (จำนวนที่เพิ่ม, จำนวนที่ไม่ผ่าน)"""
+    _, source_column = IMPORTERS[kind]
+    imported = rejected = 0
+    with ls.repo.bulk():
+        for batch in chunks(rows, chunk):
+            added, errors = import_chunk(kind, batch, id_map)
+            imported += len(added)
+            rejected += len(errors)
+            if source_column and id_map is not None:
+                mapping = id_map.setdefault(kind, {})
+                for row, new_id in added:
+                    if row.get(source_column) not in (None, ""):
+                        mapping[str(row[source_column]).strip()] = new_id
+            if errors_out is not None:
+                for line_no, row, error in errors:
+                    errors_out.write(json.dumps({"line": line_no, "error": error, "row": row}, ensure_ascii=False) + "\n")
+    return imported, rejected
+
+
+def load_id_map(path):
+    """id map จากไฟล์ (ยังไม่มีไฟล์ = ว่าง) หรือ None ถ้าไม่ได้ใช้ --id-map"""
+    if not path:
+        return None
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_id_map(path, id_map):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(id_map, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# ------------ Export ------------
+def export_rows(kind):
+    """วนแถวที่ยังไม่ถูกลบของชนิดข้อมูลนี้เป็น dict ตาม COLUMNS"""
+    if kind == "books":
+        for r in ls.repo.active("books.txt"):
+            yield {"book_id": r[0], "title": r[1], "author": r[2], "copies": r[3]}
+    elif kind == "members":
+        for r in ls.repo.active("members.txt"):
+            yield {"member_id": r[0], "name": r[1], "phone": r[2]}
+    else:
+        for br, items in ls.repo.borrows_with_items():
+            yield {"borrow_id": br[0], "member_id": br[1], "borrow_date": br[2], "return_date": br[3],
+                   "book_ids": [bi[2] for bi in items], "statuses": [bi[3] for bi in items],
+                   "fines": [bi[4] for bi in items]}
+
+
+def write_rows(rows, out, fmt, columns):
+    """เขียนแถวแบบ streaming คืนจำนวนแถว (CSV: คอลัมน์ list คั่นด้วย ;)"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({k: ";".join(v) if k in LIST_COLUMNS else v for k, v in row.items()})
+            count += 1
+    else:
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="นำเข้า/ส่งออกข้อมูลจำนวนมากเป็น CSV/JSONL")
+    sub = parser.add_subparsers(dest="action", required=True)
+    imp = sub.add_parser("import", help="นำเข้าจากไฟล์")
+    imp.add_argument("kind", choices=list(COLUMNS))
+    imp.add_argument("path", help="ไฟล์ต้นทาง (.csv หรือ .jsonl)")
+    imp.add_argument("--format", choices=["csv", "jsonl"], help="ค่าเริ่มต้น: ดูจากนามสกุลไฟล์")
+    imp.add_argument("--chunk", type=int, default=5000, help="จำนวนแถวต่อหนึ่ง transaction")
+    imp.add_argument("--id-map", help="ไฟล์ JSON จับคู่รหัสเดิมกับรหัสใหม่")
+    imp.add_argument("--errors", help="ไฟล์ JSONL เก็บแถวที่ไม่ผ่านการตรวจ ('-' = stdout)")
+    exp = sub.add_parser("export", help="ส่งออกเป็นไฟล์")
+    exp.add_argument("kind", choices=list(COLUMNS))
+    exp.add_argument("--format", choices=["csv", "jsonl"], help="ค่าเริ่มต้น: ดูจากนามสกุลไฟล์ (stdout = jsonl)")
+    exp.add_argument("--out", help="ไฟล์ผลลัพธ์ (ค่าเริ่มต้น: stdout)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.action == "export":
+        out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+        try:
+            with ls.repo.snapshot():
+                count = write_rows(export_rows(args.kind), out, file_format(args.out, args.format), COLUMNS[args.kind])
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - start
+        print(f"✔ ส่งออก {args.kind} {count} แถว ใน {elapsed:.2f} วินาที "
+              f"({count / elapsed if elapsed else 0:.0f} แถว/วินาที)", file=sys.stderr)
+        return 0
+
+    id_map = load_id_map(args.id_map)
+    errors_out = None
+    if args.errors == "-":
+        errors_out = sys.stdout
+    elif args.errors:
+        errors_out = open(args.errors, "w", encoding="utf-8")
+    try:
+        imported, rejected = run_import(args.kind, read_operations(args.path, args.format), max(1, args.chunk),
+                                        id_map, errors_out)
+    finally:
+        if errors_out is not None and errors_out is not sys.stdout:
+            errors_out.close()
+    if args.id_map and IMPORTERS[args.kind][1]:
+        save_id_map(args.id_map, id_map)
+    elapsed = time.perf_counter() - start
+    total = imported + rejected
+    print(f"✔ นำเข้า {args.kind} {imported} แถว (ไม่ผ่าน {rejected}) ใน {elapsed:.2f} วินาที "
+          f"({total / elapsed if elapsed else 0:.0f} แถว/วินาที)", file=sys.stderr)
+    return 1 if rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""ทดสอบหลายโปรเซส (จำลองหลายเครื่องหน้าเคาน์เตอร์) ยืม-คืนพร้อมกันบนโฟลเดอร์ข้อมูลเดียว
+
+สร้างข้อมูลเล็กๆ ที่หนังสือมีเล่มน้อย (แย่งกันยืมบ่อย) แล้วให้ --writers โปรเซสเรียก create_borrow /
+return_items แบบสุ่ม และ --readers โปรเซสเรียก view_books / view_borrows วนไปพร้อมกัน
+จบแล้วโหลดข้อมูลใหม่จากไฟล์และตรวจว่า:
+    - ไม่มีหนังสือเล่มใดถูกยืมเกินจำนวนเล่ม (over-lend)
+    - จำนวนรายการยืม/คืนที่สำเร็จตรงกับข้อมูลในไฟล์ (ไม่มี lost update)
+    - รหัส BorrowID / ItemID ไม่ซ้ำกัน
+    - ตัวนับเล่มที่ถูกยืมและตัวนับรายสมาชิกตรงกับการนับใหม่
+    - ไม่มีสมาชิกคนใดยืมค้างเกิน LIBRARY_MAX_OPEN_ITEMS เล่ม
+
+ตัวอย่าง:
+    python concurrency_stress.py --writers 8 --readers 4 --ops 200
+    python concurrency_stress.py --storage sqlite
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from collections import Counter
+
+DATE = "01/10/2026"
+
+
+def setup(data_dir, books, copies, members):
+    with open(os.path.join(data_dir, "books.txt"), "w", encoding="utf-8") as f:
+        for i in range(1, books + 1):
+            f.write(f"{i}|Book {i}|Author {i}|{copies}|A\n")
+    with open(os.path.join(data_dir, "members.txt"), "w", encoding="utf-8") as f:
+        for i in range(1, members + 1):
+            f.write(f"{i}|Member {i}|080000{i:04d}|A\n")
+    for name in ("borrows.txt", "borrow_items.txt"):
+        open(os.path.join(data_dir, name), "w").close()
+
+
+def load_library(data_dir, storage):
+    """import Library_system ใหม่ในโปรเซสลูก ให้ใช้ data_dir และ storage ที่กำหนด"""
+    os.environ["LIBRARY_DATA_DIR"] = data_dir
+    os.environ["LIBRARY_STORAGE"] = storage
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Library_system as ls
+    ls.BASE_DIR = data_dir
+    ls.repo = ls.make_repository(storage)
+    return ls
+
+
+def writer(data_dir, storage, seed, ops, books, members, results):
+    ls = load_library(data_dir, storage)
+    rng = random.Random(seed)
+    mine = []
+    counts = Counter()
+    for _ in range(ops):
+        if mine and rng.random() < 0.3:
+            borrow_id, book_ids = mine.pop(rng.randrange(len(mine)))
+            result = ls.return_items(borrow_id, book_ids, DATE)
+            counts["returned" if result["ok"] else "return_failed"] += 1
+        else:
+            book_ids = [str(rng.randint(1, books)) for _ in range(rng.randint(1, 2))]
+            result = ls.create_borrow(str(rng.randint(1, members)), book_ids, DATE)
+            if result["ok"]:
+                counts["borrowed"] += 1
+                counts["items"] += len(book_ids)
+                mine.append((result["borrow_id"], book_ids))
+            else:
+                counts["rejected:" + result["error"]] += 1
+    counts["open_items"] = sum(len(b) for _, b in mine)
+    results.put(dict(counts))
+
+
+def reader(data_dir, storage, stop, results):
+    ls = load_library(data_dir, storage)
+    reads = 0
+    with open(os.devnull, "w", encoding="utf-8") as null, contextlib.redirect_stdout(null):
+        while not stop.is_set():
+            ls.view_books(page_size=0)
+            ls.view_borrows(page_size=0)
+            reads += 1
+    results.put({"reads": reads})
+
+
+def verify(data_dir, storage, copies, totals):
+    ls = load_library(data_dir, storage)
+    ls.repo.invalidate()
+    problems = []
+    borrows = list(ls.repo.active("borrows.txt"))
+    items = list(ls.repo.active("borrow_items.txt"))
+    for filename, rows in (("borrows.txt", borrows), ("borrow_items.txt", items)):
+        dupes = [k for k, n in Counter(r[0] for r in rows).items() if n > 1]
+        if dupes:
+            problems.append(f"{filename}: รหัสซ้ำ {dupes[:10]}")
+    on_loan = Counter(bi[2] for bi in items if ls.is_borrowed_item(bi))
+    over = {book_id: n for book_id, n in on_loan.items() if n > copies}
+    if over:
+        problems.append(f"ยืมเกินจำนวนเล่ม: {over}")
+    if len(borrows) != totals.get("borrowed", 0):
+        problems.append(f"รายการยืมในไฟล์ {len(borrows)} แต่ยืมสำเร็จ {totals.get('borrowed', 0)}")
+    if len(items) != totals.get("items", 0):
+        problems.append(f"borrow_items ในไฟล์ {len(items)} แต่บันทึกสำเร็จ {totals.get('items', 0)}")
+    if sum(on_loan.values()) != totals.get("open_items", 0):
+        problems.append(f"เล่มที่ยังยืมอยู่ในไฟล์ {sum(on_loan.values())} แต่ควรเป็น {totals.get('open_items', 0)}")
+    if ls.repo.check_borrowed_counts():
+        problems.append("ตัวนับเล่มที่ถูกยืมไม่ตรงกับข้อมูล")
+    member_of = {br[0]: br[1] for br in borrows}
+    held = Counter(member_of.get(bi[1]) for bi in items if ls.is_borrowed_item(bi))
+    over_limit = {m: n for m, n in held.items() if ls.MAX_OPEN_ITEMS and n > ls.MAX_OPEN_ITEMS}
+    if over_limit:
+        problems.append(f"สมาชิกยืมค้างเกิน {ls.MAX_OPEN_ITEMS} เล่ม: {over_limit}")
+    drift = {m: n for m, n in held.items() if ls.repo.member_loans(m)[0] != n}
+    if drift:
+        problems.append(f"ตัวนับรายสมาชิกไม่ตรงกับข้อมูล: {drift}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ทดสอบการใช้งานพร้อมกันหลายโปรเซส")
+    parser.add_argument("--writers", type=int, default=6)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--ops", type=int, default=150, help="จำนวน operation ต่อ writer")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--copies", type=int, default=2)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--storage", default="text", choices=["text", "binary", "sqlite"])
+    parser.add_argument("--compact-ops", type=int, default=50,
+                        help="LIBRARY_LOG_COMPACT_OPS ของโปรเซสลูก (ค่าต่ำ = compact ระหว่างทดสอบบ่อย)")
+    parser.add_argument("--data-dir", help="ค่าเริ่มต้น: โฟลเดอร์ชั่วคราวที่ลบทิ้งหลังจบ")
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="library-stress-")
+    os.makedirs(data_dir, exist_ok=True)
+    os.environ["LIBRARY_LOG_COMPACT_OPS"] = str(args.compact_ops)
+    setup(data_dir, args.books, args.copies, args.members)
+    if args.storage != "text":
+        load_library(data_dir, "text")
+        with open(os.devnull, "w", encoding="utf-8") as null, contextlib.redirect_stdout(null):
+            if args.storage == "binary":
+                import binary_storage
+                binary_storage.main(["import"])
+            else:
+                import sqlite_storage
+                sqlite_storage.main(["migrate"])
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    stop = ctx.Event()
+    start = time.perf_counter()
+    writers = [ctx.Process(target=writer, args=(data_dir, args.storage, seed, args.ops, args.books, args.members, results))
+               for seed in range(args.writers)]
+    readers = [ctx.Process(target=reader, args=(data_dir, args.storage, stop, results)) for _ in range(args.readers)]
+    for p in writers + readers:
+        p.start()
+    outputs = [results.get() for _ in writers]
+    stop.set()
+    outputs += [results.get() for _ in readers]
+    for p in writers + readers:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    totals = Counter()
+    for out in outputs:
+        totals.update(out)
+    failed_procs = [p.exitcode for p in writers + readers if p.exitcode != 0]
+    problems = verify(data_dir, args.storage, args.copies, totals)
+    if failed_procs:
+        problems.append(f"โปรเซสลูกจบด้วย exit code {failed_procs}")
+    print(json.dumps({"storage": args.storage, "seconds": round(elapsed, 2), **dict(totals)}, ensure_ascii=False, indent=2))
+    if not args.data_dir:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if problems:
+        for p in problems:
+            print(f"✘ {p}")
+        return 1
+    print("✔ ข้อมูลสอดคล้องกันหลังทำงานพร้อมกันหลายโปรเซส")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
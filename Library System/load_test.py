@@ -0,0 +1,182 @@
+"""ยิง request ใส่ server.py บนเครื่องนี้ แล้ววัดจำนวน request ต่อวินาทีและ latency (p50/p99)
+
+ถ้าไม่ระบุ --url จะสร้างข้อมูลสังเคราะห์ด้วย benchmark.generate ในโฟลเดอร์ชั่วคราว
+แล้วเปิด server.py เป็นโปรเซสลูกให้เอง แต่ละ connection (--concurrency) ใช้ keep-alive
+สุ่มระหว่างการอ่าน (GET /books/{id}, /members/{id}, /borrows/{id}) กับการเขียน
+(POST /borrows แล้ว POST /returns ของรายการที่ตัวเองยืม) ตามสัดส่วน --writes
+
+ตัวอย่าง:
+    python load_test.py --size 10000 --concurrency 32 --duration 10
+    python load_test.py --url http://127.0.0.1:8080 --writes 0.5 --report 0.01
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+DATE = "01/10/2026"
+
+
+class Client:
+    """HTTP/1.1 keep-alive หนึ่ง connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n\r\n"
+                          .encode("latin-1") + data)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+async def worker(host, port, seed, deadline, sizes, writes, report, latencies, statuses):
+    rng = random.Random(seed)
+    client = Client(host, port)
+    mine = []
+    try:
+        while time.perf_counter() < deadline:
+            roll = rng.random()
+            if roll < report:
+                name, method, path, body = "report", "GET", "/report", None
+            elif roll < report + writes:
+                if mine and rng.random() < 0.5:
+                    borrow_id, book_ids = mine.pop(rng.randrange(len(mine)))
+                    name, method, path, body = "return", "POST", "/returns", \
+                        {"borrow_id": borrow_id, "book_ids": book_ids, "date": DATE}
+                else:
+                    book_ids = [str(rng.randint(1, sizes["books"]))]
+                    name, method, path, body = "borrow", "POST", "/borrows", \
+                        {"member_id": str(rng.randint(1, sizes["members"])), "book_ids": book_ids, "date": DATE}
+            else:
+                kind = rng.choice(["books", "members", "borrows"])
+                name, method, path, body = f"get_{kind}", "GET", f"/{kind}/{rng.randint(1, sizes[kind])}", None
+            start = time.perf_counter()
+            status, result = await client.request(method, path, body)
+            latencies[name].append(time.perf_counter() - start)
+            statuses[status] += 1
+            if name == "borrow" and result.get("ok"):
+                mine.append((result["borrow_id"], body["book_ids"]))
+    finally:
+        client.close()
+
+
+async def run_load(host, port, concurrency, duration, sizes, writes, report):
+    latencies = defaultdict(list)
+    statuses = Counter()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, seed, start + duration, sizes, writes, report, latencies, statuses)
+                           for seed in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    everything = sorted(v for values in latencies.values() for v in values)
+
+    def stats(values):
+        values = sorted(values)
+        return {"count": len(values), "p50_ms": percentile(values, 50) * 1000, "p90_ms": percentile(values, 90) * 1000,
+                "p99_ms": percentile(values, 99) * 1000, "max_ms": (values[-1] if values else 0) * 1000}
+
+    return {"seconds": elapsed, "requests": len(everything), "rps": len(everything) / elapsed,
+            "statuses": {str(k): v for k, v in sorted(statuses.items())},
+            "latency": stats(everything), "endpoints": {name: stats(v) for name, v in sorted(latencies.items())}}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_dir, port, storage):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, LIBRARY_DATA_DIR=data_dir, LIBRARY_STORAGE=storage)
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "server.py"), "--port", str(port)],
+                            env=env, stderr=subprocess.PIPE, text=True)
+    line = proc.stderr.readline()
+    if "✔" not in line:
+        proc.kill()
+        raise RuntimeError(f"เปิด server ไม่สำเร็จ: {line}{proc.stderr.read()}")
+    return proc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test ของ server.py")
+    parser.add_argument("--url", help="server ที่เปิดอยู่แล้ว (ค่าเริ่มต้น: เปิด server ใหม่บนข้อมูลสังเคราะห์)")
+    parser.add_argument("--size", type=int, default=5000, help="จำนวนหนังสือของข้อมูลสังเคราะห์")
+    parser.add_argument("--storage", default="text", choices=["text", "binary", "sqlite"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="วินาที")
+    parser.add_argument("--writes", type=float, default=0.2, help="สัดส่วน request ที่เป็นการยืม/คืน")
+    parser.add_argument("--report", type=float, default=0.0, help="สัดส่วน request ที่เป็น GET /report")
+    parser.add_argument("--out", help="ไฟล์ผลลัพธ์ JSON (ค่าเริ่มต้น: stdout)")
+    args = parser.parse_args(argv)
+
+    data_dir = proc = None
+    sizes = {"books": args.size, "members": max(1, args.size // 2), "borrows": args.size}
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            import benchmark
+            data_dir = tempfile.mkdtemp(prefix="library-load-")
+            benchmark.generate(data_dir, sizes["books"], sizes["members"], sizes["borrows"])
+            host, port = "127.0.0.1", free_port()
+            if args.storage != "text":
+                os.environ["LIBRARY_DATA_DIR"] = data_dir
+                import Library_system as ls
+                ls.BASE_DIR = data_dir
+                benchmark.prepare_storage(ls, args.storage)
+            proc = start_server(data_dir, port, args.storage)
+        result = asyncio.run(run_load(host, port, args.concurrency, args.duration, sizes, args.writes, args.report))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    result.update({"concurrency": args.concurrency, "writes": args.writes, "report": args.report,
+                   "storage": args.storage, "size": args.size if not args.url else None})
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    print(f"✔ {result['rps']:.0f} request/วินาที, p99 {result['latency']['p99_ms']:.1f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""ส่งออกใบแจ้งเตือนรายการยืมที่เกินกำหนด (หรือใกล้ครบกำหนด) แยกตามสมาชิก
+
+ใช้ DueIndex ของ Library_system จึงอ่านเฉพาะรายการที่เกินกำหนดจริง ไม่ต้องวนรายการยืมทั้งหมด
+ค่าปรับสะสมของทุกรายการคำนวณรอบเดียวด้วย overdue_fines (อัตรา LIBRARY_FINE_PER_DAY)
+
+JSONL: หนึ่งบรรทัดต่อสมาชิก {"member_id", "name", "phone", "borrows": [...], "total_fine"}
+CSV:   หนึ่งแถวต่อรายการยืม ชื่อหนังสือคั่นด้วย ;
+
+ตัวอย่าง:
+    python overdue_notices.py --out notices.jsonl
+    python overdue_notices.py --as-of 31/10/2026 --format csv --out notices.csv
+    python overdue_notices.py --due-within 2          # เตือนล่วงหน้ารายการที่จะครบกำหนดใน 2 วัน
+"""
+import sys
+import csv
+import json
+import time
+import argparse
+
+import Library_system as ls
+
+CSV_FIELDS = ["member_id", "name", "phone", "borrow_id", "borrow_date", "due_date", "days_overdue", "books", "fine"]
+
+
+def collect(as_of, due_within=None, member_id=None):
+    """ใบแจ้งเตือนของแต่ละสมาชิก เรียงตามรายการที่ครบกำหนดนานที่สุดของแต่ละคน
+    due_within=None = รายการที่เกินกำหนด ณ as_of, ไม่งั้น = รายการที่ครบกำหนดภายใน due_within วัน
+    """
+    index = ls.due_index()
+    if due_within is None:
+        entries = index.overdue(as_of, member_id)
+    else:
+        entries = index.due_within(due_within, as_of, member_id)
+    notices = {}
+    borrows = []
+    with ls.repo.snapshot():
+        for due, _, borrow_id in entries:
+            br = ls.repo.get("borrows.txt", borrow_id)
+            items = ls.repo.borrowed_items_of(borrow_id)
+            if br is None or not items:
+                continue
+            notice = notices.get(br[1])
+            if notice is None:
+                member = ls.repo.get("members.txt", br[1])
+                notice = notices[br[1]] = {"member_id": br[1], "name": member[1] if member else "ไม่ทราบชื่อ",
+                                           "phone": member[2] if member else "", "borrows": [], "total_fine": 0}
+            borrow = {"borrow_id": borrow_id, "borrow_date": br[2], "due_date": br[3],
+                      "books": [{"book_id": bi[2], "title": ls.get_book_title(bi[2])} for bi in items]}
+            notice["borrows"].append(borrow)
+            borrows.append((notice, borrow, due))
+
+    # วันที่เกินกำหนดและค่าปรับต่อเล่มของทุกรายการ คำนวณพร้อมกันรอบเดียว
+    days, fines = ls.overdue_fines([due for _, _, due in borrows], as_of)
+    for (notice, borrow, _), late, fine in zip(borrows, days, fines):
+        borrow["days_overdue"] = max(0, late)
+        borrow["fine"] = fine * len(borrow["books"])
+        notice["total_fine"] += borrow["fine"]
+    return list(notices.values())
+
+
+def write_jsonl(notices, out):
+    for notice in notices:
+        out.write(json.dumps(notice, ensure_ascii=False) + "\n")
+
+
+def write_csv(notices, out):
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for notice in notices:
+        for borrow in notice["borrows"]:
+            writer.writerow({"member_id": notice["member_id"], "name": notice["name"], "phone": notice["phone"],
+                             "borrow_id": borrow["borrow_id"], "borrow_date": borrow["borrow_date"],
+                             "due_date": borrow["due_date"], "days_overdue": borrow["days_overdue"],
+                             "books": ";".join(b["title"] for b in borrow["books"]), "fine": borrow["fine"]})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ส่งออกใบแจ้งเตือนรายการยืมที่เกินกำหนด")
+    parser.add_argument("--as-of", help="วันที่ dd/mm/yyyy ที่ใช้ตัดสินว่าเกินกำหนด (ค่าเริ่มต้น: วันนี้)")
+    parser.add_argument("--due-within", type=int, help="เตือนรายการที่จะครบกำหนดภายในจำนวนวันนี้แทน")
+    parser.add_argument("--member", help="เฉพาะ MemberID นี้")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="ค่าเริ่มต้น: ดูจากนามสกุลไฟล์ (stdout = jsonl)")
+    parser.add_argument("--out", help="ไฟล์ผลลัพธ์ (ค่าเริ่มต้น: stdout)")
+    args = parser.parse_args(argv)
+
+    as_of = ls.date_ordinal(args.as_of) if args.as_of else ls.today_ordinal()
+    if as_of is None:
+        print("✘ รูปแบบวันที่ไม่ถูกต้อง", file=sys.stderr)
+        return 2
+    fmt = args.format or ("csv" if args.out and args.out.lower().endswith(".csv") else "jsonl")
+
+    start = time.perf_counter()
+    notices = collect(as_of, args.due_within, args.member)
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
+    try:
+        (write_csv if fmt == "csv" else write_jsonl)(notices, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    total = sum(len(n["borrows"]) for n in notices)
+    print(f"✔ ส่งออกใบแจ้งเตือน {len(notices)} คน ({total} รายการยืม) ใน {time.perf_counter() - start:.2f} วินาที",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
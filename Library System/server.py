@@ -0,0 +1,384 @@
+"""HTTP/JSON server แบบ asyncio (ใช้แค่ standard library) สำหรับ Library_system
+
+ทุก request ใช้ repo ในหน่วยความจำชุดเดียวกันของโปรเซส การอ่านตอบจาก event loop ได้ทันที
+การเขียนทุกครั้งถูกส่งเข้าคิวให้ writer task ตัวเดียวทำตามลำดับ writer จะดึงงานที่รออยู่
+ทั้งหมด (ไม่เกิน --group) มาทำใน transaction เดียว จึง fsync ครั้งเดียวต่อกลุ่ม (group commit)
+งานที่ผิดพลาดถูกย้อนเฉพาะงานนั้น (savepoint) งานอื่นในกลุ่มยังบันทึกตามปกติ
+transaction ทั้งกลุ่มทำใน thread ของ executor ระหว่างนั้นการอ่านรอที่ Writer.lock แต่ event loop ยังรับ/ส่งข้อมูลได้
+
+Endpoints:
+    GET    /books                 รายการหนังสือพร้อมจำนวนเล่มว่าง
+                                  ?q=คำค้น ค้นจากชื่อเรื่อง/ผู้แต่ง, ?available=1 เฉพาะที่มีเล่มว่าง
+                                  ?sort=id|title|author|available
+    GET    /books/{id}
+    POST   /books                 {"title", "author", "copies"}
+    GET    /members               ?sort=id|name
+    GET    /members/{id}          รวมสถานะการยืม open_items, unpaid_fine, overdue
+    POST   /members               {"name", "phone"}
+    GET    /borrows               ?active=1 เฉพาะรายการที่ยังคืนไม่ครบ, ?overdue=1 เฉพาะที่เกินกำหนด
+                                  ?due_within=3 เฉพาะที่ครบกำหนดภายใน 3 วัน
+                                  ?member_id=3, ?status=คืนแล้ว, ?sort=id|borrow_date|return_date|member
+    GET    /borrows/{id}
+    POST   /borrows               {"member_id", "book_ids", "date"}
+    DELETE /borrows/{id}
+    POST   /returns               {"borrow_id", "book_ids", "date"}
+    GET    /report                ข้อมูลเดียวกับเมนู Generate Report (build_report)
+    GET    /popular               หนังสือที่ถูกยืมมากที่สุด ?limit=10, ?days=30 เฉพาะ 30 วันล่าสุด
+                                  หรือ ?month=10/2026 เฉพาะเดือนนั้น
+    GET    /stats                 ตัวนับ/ตัวจับเวลาของโปรเซสนี้ (เมื่อเปิด LIBRARY_PROFILE)
+
+endpoint รายการ (GET /books, /members, /borrows) แบ่งหน้าแบบ cursor: ?limit=100 (ไม่เกิน MAX_LIMIT)
+คืน {"items": [...], "next": cursor} ส่ง ?after=<cursor> เพื่อขอหน้าถัดไป ("next" เป็น null = หน้าสุดท้าย)
+
+ตัวอย่าง:
+    python server.py --port 8080
+    curl -X POST localhost:8080/borrows -d '{"member_id": "1", "book_ids": ["2"]}'
+"""
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+
+import Library_system as ls
+
+MAX_BODY = 1 << 20
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------ แปลงแถวเป็น JSON ------------
+def book_json(r):
+    return {"book_id": r[0], "title": r[1], "author": r[2], "total_copies": int(r[3]) if r[3].isdigit() else 0,
+            "available": ls.get_available_copies(r)}
+
+
+def member_json(r):
+    return {"member_id": r[0], "name": r[1], "phone": r[2]}
+
+
+def borrow_json(br, items):
+    return {"borrow_id": br[0], "member_id": br[1], "borrow_date": br[2], "return_date": br[3], "status": br[5],
+            "total_fine": sum(ls.parse_fine(bi[4]) for bi in items),
+            "items": [{"item_id": bi[0], "book_id": bi[2], "status": bi[3], "fine": ls.parse_fine(bi[4])}
+                      for bi in items]}
+
+
+# ------------ Writer task ------------
+class Writer:
+    """ผู้เขียนคนเดียวของเซิร์ฟเวอร์: รับ (ฟังก์ชัน service, อาร์กิวเมนต์) ผ่านคิว ทำทีละกลุ่มใน transaction เดียว
+    lock กันไม่ให้ route อ่าน repo ระหว่างที่ transaction กำลังทำงานอยู่ใน thread อื่น
+    """
+
+    def __init__(self, group=256):
+        self.queue = asyncio.Queue()
+        self.group = group
+        self.lock = asyncio.Lock()
+
+    async def submit(self, func, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, future))
+        return await future
+
+    async def run(self):
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.group and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            # รอ WRITE_LOCK, เขียน log และ fsync นอก event loop การเชื่อมต่ออื่นจึงไม่ค้าง
+            async with self.lock:
+                results = await asyncio.get_running_loop().run_in_executor(None, self.apply, jobs)
+            for (_, _, future), result in zip(jobs, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def apply(self, jobs):
+        """ทำทุกงานใน transaction เดียว งานที่ exception ถูกย้อนกลับถึง savepoint ของตัวเอง คืนผลลัพธ์ตามลำดับงาน"""
+        results = []
+        try:
+            with ls.repo.transaction() as txn:
+                for func, args, _ in jobs:
+                    mark = txn.savepoint()
+                    try:
+                        results.append(func(*args))
+                    except Exception as e:
+                        txn.rollback_to(mark)
+                        results.append(ls.failure(f"งานนี้ถูกยกเลิก: {e}"))
+            if txn.ok is False:
+                results = [ls.failure("บันทึกข้อมูลไม่สำเร็จ")] * len(jobs)
+        except Exception as e:
+            results = [ls.failure(f"ทั้งกลุ่มถูกยกเลิก: {e}")] * len(jobs)
+        return results
+
+
+# ------------ Routes ------------
+def param(params, name, default=None):
+    return params.get(name, [default])[0]
+
+
+def flag(params, name):
+    return param(params, name, "0") in ("1", "true", "yes")
+
+
+def paged(params, rows, sorts, to_json):
+    """หนึ่งหน้าของ rows ตาม ?sort, ?after, ?limit คืน {"items", "next"}"""
+    sort = param(params, "sort", "id")
+    if sort not in sorts:
+        raise HTTPError(400, f"sort ต้องเป็นหนึ่งใน {', '.join(sorts)}")
+    try:
+        limit = min(MAX_LIMIT, max(1, int(param(params, "limit", DEFAULT_LIMIT))))
+        after = json.loads(param(params, "after")) if "after" in params else None
+    except (ValueError, json.JSONDecodeError):
+        raise HTTPError(400, "limit หรือ after ไม่ถูกต้อง")
+    if after is not None and not isinstance(after, list):
+        raise HTTPError(400, "after ไม่ถูกต้อง")
+    page, next_after = ls.page_of(rows, sorts[sort], limit, after)
+    return {"items": [to_json(r) for r in page],
+            "next": json.dumps(next_after, ensure_ascii=False) if next_after is not None else None}
+
+
+def get_books(params):
+    rows = ls.book_rows(available_only=flag(params, "available"), query=param(params, "q"))
+    return 200, paged(params, rows, ls.BOOK_SORTS, book_json)
+
+
+def get_book(book_id):
+    r = ls.repo.get("books.txt", book_id)
+    if r is None:
+        raise HTTPError(404, "ไม่พบหนังสือในระบบ")
+    return 200, book_json(r)
+
+
+def get_members(params):
+    return 200, paged(params, ls.member_rows(), ls.MEMBER_SORTS, member_json)
+
+
+def get_member(member_id):
+    r = ls.repo.get("members.txt", member_id)
+    if r is None:
+        raise HTTPError(404, "ไม่พบสมาชิกในระบบ")
+    return 200, {**member_json(r), **ls.member_state(r[0])}
+
+
+def get_borrows(params):
+    due_within = param(params, "due_within")
+    if due_within is not None and not due_within.isdigit():
+        raise HTTPError(400, "due_within ต้องเป็นจำนวนวัน")
+    rows = ls.borrow_rows(status=param(params, "status"), member_id=param(params, "member_id"),
+                          overdue_only=flag(params, "overdue"), unreturned_only=flag(params, "active"),
+                          due_within=int(due_within) if due_within is not None else None)
+    return 200, paged(params, rows, ls.BORROW_SORTS, lambda p: borrow_json(*p))
+
+
+def get_borrow(borrow_id):
+    br = ls.repo.get("borrows.txt", borrow_id)
+    if br is None:
+        raise HTTPError(404, "ไม่พบรหัสการยืม")
+    return 200, borrow_json(br, ls.repo.items_of(borrow_id))
+
+
+def popular_json(rows):
+    return [{"book_id": b, "title": t, "count": n} for b, t, n in rows]
+
+
+def get_report(params):
+    report = ls.build_report()
+    for key in ("popular_books", "popular_recent", "popular_month"):
+        report[key] = popular_json(report[key])
+    return 200, report
+
+
+def get_popular(params):
+    limit, days, month = param(params, "limit", "10"), param(params, "days"), param(params, "month")
+    if not limit.isdigit() or (days is not None and not days.isdigit()):
+        raise HTTPError(400, "limit และ days ต้องเป็นตัวเลข")
+    if month is not None:
+        parts = month.split("/")
+        if len(parts) != 2 or not all(p.isdigit() for p in parts) or not 1 <= int(parts[0]) <= 12:
+            raise HTTPError(400, "month ต้องเป็น mm/yyyy")
+        month = (int(parts[1]), int(parts[0]))
+    rows = ls.popular_books(min(MAX_LIMIT, int(limit)), days=int(days) if days else None, month=month)
+    return 200, {"items": popular_json(rows)}
+
+
+def get_stats(params):
+    if ls.STATS is None:
+        raise HTTPError(404, "ไม่ได้เปิด LIBRARY_PROFILE")
+    return 200, ls.STATS.summary()
+
+
+# ชนิดที่รับได้ของแต่ละฟิลด์ใน body (รหัสและจำนวนเล่มส่งเป็นตัวเลขหรือสตริงก็ได้)
+FIELD_TYPES = {"title": str, "author": str, "name": str, "phone": str, "date": str,
+               "copies": (str, int), "member_id": (str, int), "borrow_id": (str, int), "book_ids": list}
+
+
+def valid_type(value, types):
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def field(body, name, required=True):
+    if name not in body:
+        if required:
+            raise HTTPError(400, f"ขาดฟิลด์: {name}")
+        return None
+    value = body[name]
+    if not valid_type(value, FIELD_TYPES[name]):
+        raise HTTPError(400, f"ชนิดของฟิลด์ {name} ไม่ถูกต้อง")
+    if name == "book_ids" and not all(valid_type(b, (str, int)) for b in value):
+        raise HTTPError(400, "book_ids ต้องเป็น list ของ BookID")
+    return value
+
+
+# (method, ชื่อคอลเลกชัน) -> (ฟังก์ชัน service, ฟิลด์ใน body) สำหรับงานเขียน
+WRITE_ROUTES = {
+    ("POST", "books"): (ls.create_book, [("title", True), ("author", True), ("copies", True)]),
+    ("POST", "members"): (ls.create_member, [("name", True), ("phone", True)]),
+    ("POST", "borrows"): (ls.create_borrow, [("member_id", True), ("book_ids", True), ("date", False)]),
+    ("POST", "returns"): (ls.return_items, [("borrow_id", True), ("book_ids", True), ("date", False)]),
+}
+READ_ROUTES = {"books": (get_books, get_book), "members": (get_members, get_member),
+               "borrows": (get_borrows, get_borrow), "report": (get_report, None), "popular": (get_popular, None),
+               "stats": (get_stats, None)}
+
+
+async def dispatch(writer, method, path, params, body):
+    parts = [p for p in path.split("/") if p]
+    if not parts:
+        raise HTTPError(404, "ไม่พบ endpoint")
+    name, rest = parts[0], parts[1:]
+    if method == "GET" and name in READ_ROUTES and len(rest) <= 1:
+        list_route, item_route = READ_ROUTES[name]
+        async with writer.lock:
+            if not rest:
+                return list_route(params)
+            if item_route is not None:
+                return item_route(rest[0])
+    if method == "DELETE" and name == "borrows" and len(rest) == 1:
+        return result_response(await writer.submit(ls.delete_borrow, rest[0]), 200)
+    if (method, name) in WRITE_ROUTES and not rest:
+        func, fields = WRITE_ROUTES[(method, name)]
+        if not isinstance(body, dict):
+            raise HTTPError(400, "body ต้องเป็น JSON object")
+        args = [field(body, f, required) for f, required in fields]
+        return result_response(await writer.submit(func, *args), 201)
+    if name in READ_ROUTES or name == "returns":
+        raise HTTPError(405, "method ไม่รองรับ")
+    raise HTTPError(404, "ไม่พบ endpoint")
+
+
+def route_name(path):
+    """ชื่อ endpoint สำหรับตัวจับเวลา เช่น /books/12 -> /books/{id}"""
+    parts = [p for p in path.split("/") if p]
+    if not parts or (parts[0] not in READ_ROUTES and parts[0] != "returns"):
+        return "other"
+    return "/" + parts[0] + ("/{id}" if len(parts) > 1 else "")
+
+
+def result_response(result, status):
+    if result["ok"]:
+        return status, result
+    return (404 if result["error"] in ("ไม่พบข้อมูล", "ไม่พบรหัสการยืม") else 400), result
+
+
+# ------------ HTTP ------------
+async def read_request(reader):
+    """อ่าน request หนึ่งอัน คืน (method, target, headers, body) หรือ None ถ้าฝั่ง client ปิดการเชื่อมต่อ"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "request line ไม่ถูกต้อง")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413, "body ใหญ่เกินไป")
+    body = await reader.readexactly(length) if length else b""
+    headers[":version"] = version
+    return method.upper(), target, headers, body
+
+
+def encode_response(status, payload, keep_alive):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("latin-1") + data
+
+
+async def handle(reader, conn, writer):
+    try:
+        while True:
+            keep_alive = False
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and headers[":version"] != "HTTP/1.0")
+                url = urlsplit(target)
+                payload = json.loads(body) if body else None
+                with ls.operation(f"http {method} {route_name(url.path)}"):
+                    status, result = await dispatch(writer, method, url.path, parse_qs(url.query), payload)
+            except HTTPError as e:
+                status, result = e.status, ls.failure(str(e))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                status, result = 400, ls.failure("body ไม่ใช่ JSON")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except Exception as e:
+                status, result = 500, ls.failure(str(e))
+            conn.write(encode_response(status, result, keep_alive))
+            await conn.drain()
+            if not keep_alive:
+                break
+    finally:
+        conn.close()
+
+
+async def serve(host, port, group):
+    writer = Writer(group)
+    writer_task = asyncio.create_task(writer.run())
+    server = await asyncio.start_server(lambda r, w: handle(r, w, writer), host, port)
+    addr = ", ".join(str(s.getsockname()[:2]) for s in server.sockets)
+    print(f"✔ Library server พร้อมใช้งานที่ {addr}", file=sys.stderr, flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+        async with writer.lock:
+            ls.repo.compact()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON server ของ Library_system")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--group", type=int, default=256, help="จำนวนงานเขียนสูงสุดต่อหนึ่ง transaction")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, max(1, args.group)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
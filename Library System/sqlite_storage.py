@@ -0,0 +1,447 @@
+"""Repository แบบ SQLite สำหรับ Library_system (เลือกด้วย LIBRARY_STORAGE=sqlite)
+
+ทั้ง 4 ตารางอยู่ในไฟล์ library.db แต่ละตารางมีคอลัมน์ slot (ลำดับแถวแบบเดียวกับในไฟล์ .txt)
+และคอลัมน์ข้อมูลเป็น TEXT ตามลำดับฟิลด์ของไฟล์ .txt จึงคืนแถวเป็น list ของ str รูปแบบเดิม
+การค้นหาตามรหัสและ join ระหว่าง borrows กับ borrow_items ใช้ index ของ SQLite แทน dict ในหน่วยความจำ
+
+ย้ายข้อมูลจากไฟล์ .txt (รวม log ที่ค้างอยู่) เข้า library.db ครั้งเดียว:
+    python sqlite_storage.py migrate
+"""
+import os
+import sqlite3
+import contextlib
+import argparse
+
+DB_FILE = "library.db"
+
+COLUMNS = {
+    "books.txt": ("book_id", "title", "author", "total_copies", "status"),
+    "members.txt": ("member_id", "name", "phone", "status"),
+    "borrows.txt": ("borrow_id", "member_id", "borrow_date", "return_date", "fine", "borrow_status", "status"),
+    "borrow_items.txt": ("item_id", "borrow_id", "book_id", "item_status", "fine", "status"),
+}
+
+# index รองแบบเดียวกับ TABLE_INDEXES ของ Library_system: ชื่อ -> คอลัมน์
+GROUPS = {
+    "borrows.txt": {"member": "member_id"},
+    "borrow_items.txt": {"borrow": "borrow_id"},
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS books_id ON books(book_id, status)",
+    "CREATE INDEX IF NOT EXISTS books_status ON books(status, slot)",
+    "CREATE INDEX IF NOT EXISTS members_id ON members(member_id, status)",
+    "CREATE INDEX IF NOT EXISTS members_status ON members(status, slot)",
+    "CREATE INDEX IF NOT EXISTS borrows_id ON borrows(borrow_id, status)",
+    "CREATE INDEX IF NOT EXISTS borrows_member ON borrows(member_id, status)",
+    "CREATE INDEX IF NOT EXISTS borrows_status ON borrows(status, slot)",
+    "CREATE INDEX IF NOT EXISTS borrow_items_id ON borrow_items(item_id, status)",
+    "CREATE INDEX IF NOT EXISTS borrow_items_borrow ON borrow_items(borrow_id, status)",
+    "CREATE INDEX IF NOT EXISTS borrow_items_book ON borrow_items(book_id, item_status, status)",
+    "CREATE INDEX IF NOT EXISTS borrow_items_status ON borrow_items(status, slot)",
+]
+
+BORROWED = "กำลังยืม"
+RETURNED = "คืนแล้ว"
+
+# วินาทีที่รอล็อกของโปรเซสอื่นก่อนจะ error ว่า database is locked
+LOCK_TIMEOUT = 30
+
+
+def table_name(filename):
+    return os.path.splitext(filename)[0]
+
+
+def create_schema(conn):
+    for filename, cols in COLUMNS.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name(filename)} "
+                     f"(slot INTEGER PRIMARY KEY, {', '.join(c + ' TEXT' for c in cols)})")
+    for sql in INDEXES:
+        conn.execute(sql)
+
+
+def fit_row(row, n):
+    """ปรับแถวให้มี n ฟิลด์พอดี (คอลัมน์ Status อยู่ท้ายเสมอ)"""
+    row = [str(x) for x in row]
+    if len(row) < n:
+        return row[:-1] + [""] * (n - len(row)) + row[-1:]
+    return row[:n - 1] + row[-1:]
+
+
+class SqliteTable:
+    """ตารางหนึ่งใน library.db มีเมธอดชุดเดียวกับ Library_system.Table"""
+
+    def __init__(self, conn, filename, repo=None):
+        self.conn = conn
+        self.repo = repo
+        self.filename = filename
+        self.name = table_name(filename)
+        self.cols = COLUMNS[filename]
+        self.id_col = self.cols[0]
+        self.select = f"SELECT {', '.join(self.cols)} FROM {self.name}"
+        self.listeners = []
+        self.max_id = None
+        self.fed = False
+
+    def _rows(self, sql, params=()):
+        return [list(r) for r in self.conn.execute(sql, params)]
+
+    def rows(self):
+        """แถวทั้งหมด (รวมแถวที่ถูกลบ D) เรียงตาม slot"""
+        if self.repo is not None:
+            self.repo.sync()
+        records = self._rows(f"{self.select} ORDER BY slot")
+        if not self.fed:
+            self.fed = True
+            self._feed(records)
+        return records
+
+    def _feed(self, records):
+        for listener in self.listeners:
+            listener.reset()
+            for r in records:
+                listener.change(None, r)
+
+    def rebuild_indexes(self):
+        """ป้อนแถวทั้งหมดให้ listener ใหม่ (index ของ SQLite ไม่ต้องสร้างใหม่)"""
+        self.fed = True
+        self._feed(self._rows(f"{self.select} ORDER BY slot"))
+
+    def ensure_fed(self):
+        if self.listeners and not self.fed:
+            self.rows()
+
+    def active(self):
+        return self._rows(f"{self.select} WHERE status = 'A' ORDER BY slot")
+
+    def _slot_of(self, record_id):
+        r = self.conn.execute(f"SELECT slot FROM {self.name} WHERE {self.id_col} = ? AND status = 'A' "
+                              f"ORDER BY slot LIMIT 1", (str(record_id).strip(),)).fetchone()
+        return r[0] if r else None
+
+    def get(self, record_id):
+        r = self.conn.execute(f"{self.select} WHERE {self.id_col} = ? AND status = 'A' ORDER BY slot LIMIT 1",
+                              (str(record_id).strip(),)).fetchone()
+        return list(r) if r else None
+
+    def group(self, name, key):
+        col = GROUPS[self.filename][name]
+        return self._rows(f"{self.select} WHERE {col} = ? AND status = 'A' ORDER BY slot", (str(key).strip(),))
+
+    def put(self, i, row):
+        self.ensure_fed()
+        row = fit_row(row, len(self.cols))
+        old = self.conn.execute(f"{self.select} WHERE slot = ?", (i,)).fetchone()
+        placeholders = ", ".join("?" for _ in range(len(self.cols) + 1))
+        self.conn.execute(f"INSERT OR REPLACE INTO {self.name} (slot, {', '.join(self.cols)}) "
+                          f"VALUES ({placeholders})", [i] + row)
+        if self.max_id is not None:
+            self.max_id = max(self.max_id, _id_number(row[0]))
+        for listener in self.listeners:
+            listener.change(list(old) if old else None, row)
+
+    def free_slot(self):
+        r = self.conn.execute(f"SELECT slot FROM {self.name} WHERE status = 'D' ORDER BY slot LIMIT 1").fetchone()
+        return r[0] if r else None
+
+    def next_id(self):
+        if self.max_id is None:
+            self.max_id = max((_id_number(r[0]) for r in self.conn.execute(f"SELECT {self.id_col} FROM {self.name}")),
+                              default=0)
+        return self.max_id + 1
+
+    def insert(self, fields):
+        slot = self.free_slot()
+        if slot is None:
+            slot = self.conn.execute(f"SELECT COALESCE(MAX(slot) + 1, 0) FROM {self.name}").fetchone()[0]
+        new_id = str(self.next_id())
+        self.put(slot, [new_id] + [str(x) for x in fields] + ["A"])
+        return new_id
+
+    def replace(self, record_id, row):
+        slot = self._slot_of(record_id)
+        if slot is None:
+            return False
+        self.put(slot, row)
+        return True
+
+    def save(self):
+        # อยู่นอก transaction แต่ละคำสั่ง commit เองอยู่แล้ว (autocommit)
+        return True
+
+    def compact(self):
+        return True
+
+    def invalidate(self):
+        self.fed = False
+        self.max_id = None
+
+
+def _id_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+class SqliteTransaction:
+    """BEGIN ... COMMIT ของ SQLite ใช้แทน Library_system.Transaction"""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.nested = False
+        self.ok = None
+        self.savepoints = 0
+
+    def __enter__(self):
+        if self.repo.txn is not None:
+            self.nested = True
+            return self
+        self.repo.conn.execute("BEGIN IMMEDIATE")
+        # โปรเซสอื่นอาจเพิ่มแถวไปแล้ว ให้หารหัสสูงสุดใหม่ภายใต้ล็อกเขียนของ SQLite
+        for t in self.repo.tables.values():
+            t.max_id = None
+        # listener ต้องตรงกับข้อมูลล่าสุดก่อนรับการแก้ไขทีละแถวจาก put()
+        self.repo.sync()
+        self.repo.txn = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.nested:
+            return False
+        self.repo.txn = None
+        if exc_type is None:
+            try:
+                self.repo.conn.execute("COMMIT")
+                self.ok = True
+            except sqlite3.Error as e:
+                print(f"✘ ข้อผิดพลาดในการบันทึกฐานข้อมูล: {e}")
+                self.repo.conn.execute("ROLLBACK")
+                self.ok = False
+        else:
+            self.repo.conn.execute("ROLLBACK")
+            self.ok = False
+        if not self.ok:
+            # listener ในหน่วยความจำเห็นการแก้ไขที่ถูกยกเลิกไปแล้ว ให้ป้อนข้อมูลใหม่
+            for t in self.repo.tables.values():
+                if t.listeners:
+                    t.rebuild_indexes()
+        return False
+
+
+    def savepoint(self):
+        """SAVEPOINT ของ SQLite ใช้แทน Transaction.savepoint"""
+        self.savepoints += 1
+        name = f"sp{self.savepoints}"
+        self.repo.conn.execute(f"SAVEPOINT {name}")
+        return name
+
+    def rollback_to(self, mark):
+        self.repo.conn.execute(f"ROLLBACK TO {mark}")
+        # listener เห็นแถวที่ถูกย้อนไปแล้ว ให้ป้อนข้อมูลใหม่ (แบบเดียวกับ rollback ทั้ง transaction)
+        for t in self.repo.tables.values():
+            t.max_id = None
+            if t.listeners:
+                t.rebuild_indexes()
+
+
+class SqliteRepository:
+    """Repository ที่อ่าน/เขียนผ่าน SQLite มีเมธอดชุดเดียวกับ Library_system.Repository"""
+
+    def __init__(self, path):
+        self.path = path
+        # server.py ทำ transaction ใน thread ของ executor (ทีละงาน ไม่พร้อมกับการอ่าน) จึงปิดการตรวจ thread
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        # WAL: ผู้อ่านหลายโปรเซสไม่ถูกบล็อกโดยผู้เขียน (BEGIN IMMEDIATE ให้เขียนได้ทีละโปรเซส)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        create_schema(self.conn)
+        self.tables = {filename: SqliteTable(self.conn, filename, self) for filename in COLUMNS}
+        self.txn = None
+        self.data_version = self.read_data_version()
+
+    def read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def sync(self):
+        """ถ้าโปรเซสอื่น commit ไปแล้ว (PRAGMA data_version เปลี่ยน) ป้อนข้อมูลใหม่ให้ listener ทุกตาราง
+        (SearchIndex, DueIndex, LoanStats) การเขียนของโปรเซสนี้เองไม่เปลี่ยนค่านี้ listener เห็นผ่าน put() อยู่แล้ว
+        """
+        version = self.read_data_version()
+        if version == self.data_version:
+            return
+        self.data_version = version
+        for t in self.tables.values():
+            t.max_id = None
+            if t.listeners and t.fed:
+                t.rebuild_indexes()
+
+    def table(self, filename):
+        return self.tables[filename]
+
+    def rows(self, filename):
+        return self.tables[filename].rows()
+
+    def active(self, filename):
+        return iter(self.tables[filename].active())
+
+    def get(self, filename, record_id):
+        return self.tables[filename].get(record_id)
+
+    def items_of(self, borrow_id):
+        return self.tables["borrow_items.txt"].group("borrow", borrow_id)
+
+    def borrowed_items_of(self, borrow_id):
+        t = self.tables["borrow_items.txt"]
+        return t._rows(f"{t.select} WHERE borrow_id = ? AND status = 'A' AND item_status = ? ORDER BY slot",
+                       (str(borrow_id).strip(), BORROWED))
+
+    def borrowed_count(self, book_id):
+        return self.conn.execute("SELECT COUNT(*) FROM borrow_items WHERE book_id = ? AND item_status = ? "
+                                 "AND status = 'A'", (str(book_id).strip(), BORROWED)).fetchone()[0]
+
+    def member_loans(self, member_id):
+        """(จำนวนเล่มที่ยังไม่คืน, ค่าปรับที่บันทึกไว้) ของสมาชิก นับผ่าน index borrows_member/borrow_items_borrow"""
+        r = self.conn.execute(
+            "SELECT COALESCE(SUM(i.item_status = ?), 0), "
+            "COALESCE(SUM(CASE WHEN i.item_status = ? AND CAST(i.fine AS REAL) > 0 THEN CAST(i.fine AS REAL) "
+            "ELSE 0 END), 0) "
+            "FROM borrows b JOIN borrow_items i ON i.borrow_id = b.borrow_id AND i.status = 'A' "
+            "WHERE b.member_id = ? AND b.status = 'A'", (BORROWED, RETURNED, str(member_id).strip())).fetchone()
+        return r[0], r[1]
+
+    def check_borrowed_counts(self):
+        # นับจาก index ทุกครั้ง จึงไม่มีตัวนับที่จะคลาดเคลื่อน
+        return {}
+
+    def borrows_with_items(self, unreturned_only=False):
+        """join รายการยืมที่ยังไม่ถูกลบกับ borrow_items ด้วยคำสั่งเดียวผ่าน index borrow_items_borrow"""
+        b_cols = ", ".join("b." + c for c in COLUMNS["borrows.txt"])
+        i_cols = ", ".join("i." + c for c in COLUMNS["borrow_items.txt"])
+        where = "b.status = 'A'"
+        if unreturned_only:
+            where += (" AND EXISTS (SELECT 1 FROM borrow_items x WHERE x.borrow_id = b.borrow_id "
+                      "AND x.status = 'A' AND x.item_status = ?)")
+        sql = (f"SELECT b.slot, {b_cols}, {i_cols} FROM borrows b "
+               f"LEFT JOIN borrow_items i ON i.borrow_id = b.borrow_id AND i.status = 'A' "
+               f"WHERE {where} ORDER BY b.slot, i.slot")
+        nb = len(COLUMNS["borrows.txt"]) + 1
+        current, items, current_slot = None, [], None
+        for r in self.conn.execute(sql, (BORROWED,) if unreturned_only else ()):
+            if current is None or r[0] != current_slot:
+                if current is not None:
+                    yield current, items
+                current, items, current_slot = list(r[1:nb]), [], r[0]
+            if r[nb] is not None:
+                items.append(list(r[nb:]))
+        if current is not None:
+            yield current, items
+
+    def save(self, filename):
+        return True
+
+    def transaction(self):
+        return SqliteTransaction(self)
+
+    def snapshot(self):
+        # ทุกคำสั่งอ่านจากฐานข้อมูลโดยตรง มีแค่ listener ที่ต้องตามการแก้ไขของโปรเซสอื่นให้ทันก่อนอ่าน
+        self.sync()
+        return contextlib.nullcontext(self)
+
+    def bulk(self):
+        # ไม่มี log ที่ต้องเลื่อนการ compact ออกไป
+        return contextlib.nullcontext(self)
+
+    def compact(self):
+        import Library_system as ls
+
+        if self.txn is not None:
+            return True
+        for t in self.tables.values():
+            total, dead = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(status = 'D'), 0) FROM {t.name}").fetchone()
+            if ls.needs_vacuum(dead, total):
+                return self.vacuum() is not None
+        return True
+
+    def vacuum(self, archive=False, before=None):
+        """ลบแถว D ของทุกตาราง (เก็บแถวรหัสสูงสุดไว้กันรหัสซ้ำ) แล้ว VACUUM ไฟล์ฐานข้อมูล
+        archive=True ย้ายรายการยืมที่ปิดแล้วไปไฟล์ประวัติ .txt แบบเดียวกับ Library_system.Repository.vacuum
+        """
+        import Library_system as ls
+
+        result = {}
+        try:
+            with self.transaction():
+                closed = ls.archivable_borrows(self.borrows_with_items(), before) if archive else set()
+                keys = {"borrows.txt": 0, "borrow_items.txt": 1}
+                for filename in sorted(self.tables, key=lambda name: name != "borrow_items.txt"):
+                    t = self.tables[filename]
+                    moved = []
+                    if closed and filename in keys:
+                        moved = [r for r in self.conn.execute(f"SELECT slot, {', '.join(t.cols)} FROM {t.name} "
+                                                              f"WHERE status = 'A' ORDER BY slot")
+                                 if r[1 + keys[filename]].strip() in closed]
+                        if moved and not ls.append_lines(ls.HISTORY_FILES[filename], ["|".join(r[1:]) for r in moved]):
+                            raise OSError(ls.HISTORY_FILES[filename])
+                    # แถวรหัสสูงสุดเก็บไว้เสมอ (เป็น D ถ้าถูกย้ายไป) รหัสใหม่จึงไม่ซ้ำกับรหัสที่เคยใช้
+                    top = self.conn.execute(f"SELECT slot FROM {t.name} ORDER BY CAST({t.id_col} AS INTEGER) DESC "
+                                            f"LIMIT 1").fetchone()
+                    top = top[0] if top else -1
+                    self.conn.executemany(f"DELETE FROM {t.name} WHERE slot = ?", ((r[0],) for r in moved if r[0] != top))
+                    if any(r[0] == top for r in moved):
+                        self.conn.execute(f"UPDATE {t.name} SET status = 'D' WHERE slot = ?", (top,))
+                    removed = self.conn.execute(f"DELETE FROM {t.name} WHERE status = 'D' AND slot != ?", (top,)).rowcount
+                    result[filename] = (removed, len(moved))
+        except OSError:
+            # เขียนไฟล์ประวัติไม่ได้: ทรานแซกชันถูก ROLLBACK ทั้งชุด ไม่ลบแถวใดและไม่ VACUUM
+            return None
+        self.conn.execute("VACUUM")
+        # โหมด WAL: VACUUM เขียนหน้าใหม่ลง library.db-wal ก่อน checkpoint แล้วตัด -wal ทิ้งเพื่อคืนพื้นที่
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        for t in self.tables.values():
+            if t.listeners:
+                t.rebuild_indexes()
+        return result
+
+    def invalidate(self):
+        for t in self.tables.values():
+            t.invalidate()
+
+
+# ------------ Migrator ------------
+def migrate(db_path, tables):
+    """คัดลอกแถวทั้งหมดของแต่ละตาราง (list ของแถว) ลง db_path แทนที่ข้อมูลเดิม"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    create_schema(conn)
+    conn.execute("BEGIN")
+    for filename, records in tables.items():
+        cols = COLUMNS[filename]
+        conn.execute(f"DELETE FROM {table_name(filename)}")
+        conn.executemany(
+            f"INSERT INTO {table_name(filename)} (slot, {', '.join(cols)}) VALUES ({', '.join('?' for _ in range(len(cols) + 1))})",
+            ([i] + fit_row(r, len(cols)) for i, r in enumerate(records)))
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def main(argv=None):
+    import Library_system as ls
+
+    parser = argparse.ArgumentParser(description="ย้ายข้อมูลจากไฟล์ .txt เข้า SQLite")
+    parser.add_argument("action", choices=["migrate"])
+    parser.add_argument("--db", default=DB_FILE, help=f"ไฟล์ฐานข้อมูล (ค่าเริ่มต้น {DB_FILE})")
+    args = parser.parse_args(argv)
+
+    tables = {}
+    for filename, n in ls.TABLE_FIELDS.items():
+        table = ls.Table(filename, n, storage=ls.TextStorage())
+        table.compact()
+        tables[filename] = table.rows()
+    db_path = ls.get_path(args.db)
+    migrate(db_path, tables)
+    for filename, records in tables.items():
+        print(f"✔ {filename} -> {args.db}:{table_name(filename)} {len(records)} แถว")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import Library_system as ls  # noqa: E402
+
+SAMPLE_FILES = ("books.txt", "members.txt", "borrows.txt", "borrow_items.txt")
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """โฟลเดอร์ข้อมูลชั่วคราวที่คัดลอกข้อมูลตัวอย่างมา พร้อม ls.repo ใหม่ที่อ่านจากโฟลเดอร์นั้น"""
+    for name in SAMPLE_FILES:
+        shutil.copy(os.path.join(APP_DIR, name), tmp_path / name)
+    monkeypatch.setattr(ls, "BASE_DIR", str(tmp_path))
+    monkeypatch.setattr(ls, "repo", ls.make_repository("text"))
+    return tmp_path
@@ -0,0 +1,126 @@
+import pytest
+
+import Library_system as ls
+
+TABLES = ("books.txt", "members.txt", "borrows.txt", "borrow_items.txt")
+
+
+def reopen(monkeypatch):
+    """เปิด repo ใหม่จากไฟล์ในโฟลเดอร์ข้อมูล เหมือนเริ่มโปรแกรมใหม่"""
+    monkeypatch.setattr(ls, "repo", ls.make_repository("text"))
+    return ls.repo
+
+
+def active_rows(repo):
+    return {name: [tuple(r) for r in repo.active(name)] for name in TABLES}
+
+
+def available_book():
+    return next(b[0] for b in ls.repo.active("books.txt") if ls.get_available_copies(b) > 0)
+
+
+@pytest.mark.parametrize("cache", [True, False])
+def test_torn_last_log_line_is_dropped(data_dir, monkeypatch, cache):
+    monkeypatch.setattr(ls, "SNAPSHOT_CACHE", cache)
+    first = ls.repo.get("members.txt", "1")
+    member_id = ls.add_record("members.txt", ["ทดสอบ", "000"])
+    log = data_dir / ls.log_name("members.txt")
+    committed = log.read_bytes()
+    # โปรแกรมล่มระหว่างเขียนบรรทัดสุดท้าย
+    with open(log, "ab") as f:
+        f.write("U|0|1|เขียนไม่ครบ".encode("utf-8"))
+
+    repo = reopen(monkeypatch)
+    assert repo.get("members.txt", member_id)[1] == "ทดสอบ"
+    assert repo.get("members.txt", "1") == first
+    assert log.read_bytes() == committed
+
+
+def test_failed_multi_table_transaction_is_rolled_back(data_dir, monkeypatch):
+    before = active_rows(ls.repo)
+    with pytest.raises(RuntimeError):
+        with ls.repo.transaction():
+            borrow_id = ls.repo.table("borrows.txt").insert(["1", "01/10/2025", "08/10/2025", "0", "กำลังยืม"])
+            ls.repo.table("borrow_items.txt").insert([borrow_id, "1", "กำลังยืม", "0"])
+            raise RuntimeError("ล่มกลาง transaction")
+
+    assert active_rows(ls.repo) == before
+    assert not (data_dir / ls.log_name("borrows.txt")).exists()
+    assert not (data_dir / ls.log_name("borrow_items.txt")).exists()
+    assert active_rows(reopen(monkeypatch)) == before
+
+
+def test_multi_table_commit_without_journal_entry_is_ignored(data_dir, monkeypatch):
+    before = active_rows(ls.repo)
+    assert ls.create_borrow("1", [available_book()])["ok"]
+    # ล่มหลังต่อท้าย log ของทั้งสองตารางแต่ก่อนเขียน txid ลง journal
+    (data_dir / ls.JOURNAL_FILE).write_text("")
+
+    assert active_rows(reopen(monkeypatch)) == before
+
+
+def test_compact_then_reopen_keeps_rows(data_dir, monkeypatch):
+    borrow_id = ls.create_borrow("1", [available_book()])["borrow_id"]
+    assert ls.return_items("6", ["1"])["ok"]
+    assert ls.delete_borrow("5")["ok"]
+    ls.update_record("members.txt", "2", ["ก้อง ใหม่", "062 000"])
+    expected = active_rows(ls.repo)
+    assert ls.repo.get("borrows.txt", borrow_id)
+
+    assert ls.repo.compact()
+    for name in TABLES:
+        assert not (data_dir / ls.log_name(name)).exists()
+    assert not (data_dir / ls.JOURNAL_FILE).exists()
+    assert active_rows(reopen(monkeypatch)) == expected
+    monkeypatch.setattr(ls, "SNAPSHOT_CACHE", False)
+    assert active_rows(reopen(monkeypatch)) == expected
+
+
+def test_parallel_report_matches_build_report(data_dir):
+    assert ls.build_report(ls.parallel_report(2)) == ls.build_report()
+    # การแก้ไขที่ยังอยู่ใน log (ยังไม่ compact) ต้องนับเหมือนกัน
+    assert ls.create_borrow("1", [available_book()])["ok"]
+    assert ls.return_items("6", ["3"])["ok"]
+    assert ls.delete_borrow("4")["ok"]
+    assert ls.build_report(ls.parallel_report(2)) == ls.build_report()
+
+
+def due_open_items(index):
+    """MemberID -> จำนวนเล่มที่ยังไม่คืน นับจากรายการยืมที่อยู่ใน DueIndex"""
+    counts = {}
+    for _, _, borrow_id in index.between():
+        member_id = index.borrows[borrow_id][1]
+        counts[member_id] = counts.get(member_id, 0) + index.open_count[borrow_id]
+    return counts
+
+
+def loan_open_items():
+    counts = {r[0]: ls.repo.member_loans(r[0])[0] for r in ls.repo.active("members.txt")}
+    return {member_id: n for member_id, n in counts.items() if n}
+
+
+def rebuilt_due_index():
+    index = ls.DueIndex()
+    for name, listener in (("borrows.txt", index.borrows_listener), ("borrow_items.txt", index.items_listener)):
+        for r in ls.repo.rows(name):
+            listener.change(None, r)
+    return index
+
+
+@pytest.mark.parametrize("step", ["borrow", "partial_return", "full_return", "delete"])
+def test_due_index_matches_member_loans(data_dir, step):
+    index = ls.due_index()
+    assert due_open_items(index) == loan_open_items()
+
+    if step == "borrow":
+        assert ls.create_borrow("1", [available_book()])["ok"]
+    elif step == "partial_return":
+        assert ls.return_items("6", ["1", "3"])["ok"]
+    elif step == "full_return":
+        assert ls.return_items("6", ["1", "3", "4"])["status"] == "คืนแล้ว"
+    else:
+        assert ls.delete_borrow("4")["ok"]
+
+    assert ls.due_index() is index
+    assert due_open_items(index) == loan_open_items()
+    assert index.between() == rebuilt_due_index().between()
@@ -0,0 +1,116 @@
+"""ตัดแถวที่ถูกลบ (D) ออกจากไฟล์ข้อมูล และย้ายรายการยืมที่ปิดแล้วไปไฟล์ประวัติ
+
+การลบไม่ได้เอาแถวออกจากไฟล์ แค่เปลี่ยนสถานะเป็น D ทุกการโหลดจึงต้องอ่านข้ามแถวเหล่านี้ไปด้วย
+vacuum เขียนตารางใหม่เฉพาะแถวที่ยังใช้อยู่ รหัสของทุกแถวไม่เปลี่ยน (การอ้างอิงระหว่างตารางยังถูกต้อง)
+และเก็บแถวรหัสสูงสุดไว้เป็น D ถ้าจำเป็น รหัสใหม่จึงไม่ซ้ำกับรหัสที่เคยใช้หรือที่อยู่ในไฟล์ประวัติ
+
+--archive ย้ายรายการยืมที่คืนครบทุกเล่มและไม่มีค่าปรับค้าง พร้อม borrow_items ของรายการนั้น
+ไปต่อท้าย borrows_history.txt / borrow_items_history.txt (รูปแบบเดียวกับไฟล์หลัก)
+
+vacuum อัตโนมัติ: ทุกครั้งที่ compact (ออกจากโปรแกรม, จบ batch.py, ปิด server.py) ตารางที่มีแถว D
+เกิน LIBRARY_VACUUM_RATIO ของตาราง (ค่าเริ่มต้น 0.3, 0 = ปิด) และอย่างน้อย LIBRARY_VACUUM_MIN_ROWS แถว
+(ค่าเริ่มต้น 1000) จะถูก vacuum ให้เอง แบบอัตโนมัติไม่ย้ายข้อมูลไปไฟล์ประวัติ
+
+ตัวอย่าง:
+    python vacuum.py
+    python vacuum.py --archive --before 01/01/2026
+"""
+import gc
+import sys
+import time
+import argparse
+
+import Library_system as ls
+
+
+def table_files(filename):
+    """ไฟล์ที่เก็บตารางนี้ (ไฟล์หลัก + log) ว่างถ้าทุกตารางอยู่ในไฟล์ฐานข้อมูลเดียว"""
+    if ls.STORAGE == "sqlite":
+        return []
+    return [ls.repo.storage.base_name(filename), ls.log_name(filename)]
+
+
+def data_files():
+    if ls.STORAGE == "sqlite":
+        import sqlite_storage
+        return [sqlite_storage.DB_FILE, sqlite_storage.DB_FILE + "-wal"]
+    return [name for filename in ls.repo.tables for name in table_files(filename)]
+
+
+def file_bytes(names):
+    return sum((ls.file_stamp(name) or (0, 0))[1] for name in names)
+
+
+def scan_time(filename, repeat):
+    """เวลาโหลดตารางจากไฟล์ใหม่ทั้งหมด (ค่าต่ำสุดจาก repeat รอบ ปิด GC ระหว่างวัดแบบ timeit)
+    ไม่ใช้ snapshot (.cache) เพื่อให้เห็นเวลาอ่านแถว D ที่ตัดออกไป
+    """
+    best = float("inf")
+    table = ls.repo.table(filename)
+    cache = ls.SNAPSHOT_CACHE
+    ls.SNAPSHOT_CACHE = False
+    try:
+        for _ in range(repeat):
+            table.invalidate()
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                table.rows()
+                best = min(best, time.perf_counter() - start)
+            finally:
+                gc.enable()
+    finally:
+        ls.SNAPSHOT_CACHE = cache
+    return best
+
+
+def measure(repeat):
+    return ({filename: file_bytes(table_files(filename)) for filename in ls.repo.tables},
+            {filename: scan_time(filename, repeat) for filename in ls.repo.tables},
+            file_bytes(data_files()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ตัดแถวที่ถูกลบออกจากไฟล์ข้อมูล")
+    parser.add_argument("--archive", action="store_true",
+                        help="ย้ายรายการยืมที่คืนครบและไม่มีค่าปรับค้างไปไฟล์ประวัติ")
+    parser.add_argument("--before", help="ย้ายเฉพาะรายการที่ครบกำหนดคืนก่อนวันที่ dd/mm/yyyy นี้")
+    parser.add_argument("--repeat", type=int, default=3, help="จำนวนรอบที่วัดเวลาโหลดแต่ละตาราง")
+    args = parser.parse_args(argv)
+
+    before = None
+    if args.before:
+        before = ls.date_ordinal(args.before)
+        if before is None:
+            print("✘ รูปแบบวันที่ไม่ถูกต้อง", file=sys.stderr)
+            return 2
+
+    # รวม log ก่อนวัด ขนาดที่ลดลงจึงมาจากการตัดแถวเท่านั้น
+    for table in ls.repo.tables.values():
+        table.compact()
+    bytes_before, scan_before, total_before = measure(max(1, args.repeat))
+    start = time.perf_counter()
+    result = ls.repo.vacuum(archive=args.archive, before=before)
+    elapsed = time.perf_counter() - start
+    if result is None:
+        print("✘ vacuum ไม่สำเร็จ", file=sys.stderr)
+        return 1
+    bytes_after, scan_after, total_after = measure(max(1, args.repeat))
+
+    for filename, (removed, moved) in result.items():
+        line = f"{filename}: ตัด {removed} แถว"
+        if moved:
+            line += f", ย้ายไป {ls.HISTORY_FILES[filename]} {moved} แถว"
+        if table_files(filename):
+            line += f", {bytes_before[filename]:,} -> {bytes_after[filename]:,} ไบต์"
+        line += f", โหลด {scan_before[filename] * 1000:.1f} -> {scan_after[filename] * 1000:.1f} ms"
+        print(line)
+    saved_scan = sum(scan_before.values()) - sum(scan_after.values())
+    print(f"✔ vacuum เสร็จใน {elapsed:.2f} วินาที ลดขนาดไฟล์ {total_before - total_after:,} ไบต์ "
+          f"({total_before:,} -> {total_after:,}) เวลาโหลดลดลง {saved_scan * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())